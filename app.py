@@ -5,17 +5,35 @@ This is a simple FastAPI application that integrates with Supabase.
 """
 
 import os
-import traceback
+import logging
+import uuid
 from fastapi import FastAPI, HTTPException, Request, Depends, Form, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from starlette.middleware.sessions import SessionMiddleware
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
 from supabase import create_client, Client
 from typing import Optional, List
+from services.billing import BillingService
+from services.payments import PaymentLedger
+from services.storage import stream_upload, upload_progress
+from services.listing import (
+    paginate, filter_time_logs, filter_expenses, filter_invoices, with_insurance_dates, summarize_hours,
+)
+from services.sessions import ServerSessionMiddleware, create_session_backend
+from services.metrics import (
+    MetricsMiddleware, TimedJinja2Templates, render_metrics, PROMETHEUS_CONTENT_TYPE
+)
+from services.query_log import QueryLogMiddleware, instrument_postgrest, recent_requests, QUERY_LOG_DEBUG
+from services.profiler import ProfilerMiddleware, ProfilerBusy, profile_worker, get_profile, authorized
+from services.logging_config import configure_logging, formatted_traceback, RequestIdMiddleware
+from services.warmup import register_warmup, run_warmups, warm_templates, template_options
+from services.urls import URLTable
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
 def get_supabase_client() -> Optional[Client]:
@@ -27,13 +45,12 @@ def get_supabase_client() -> Optional[Client]:
         supabase_key = os.getenv("SUPABASE_KEY")
         
         if not supabase_url or not supabase_key:
-            print("Warning: Supabase environment variables not found, using mock data")
+            logger.warning("Supabase environment variables not found, using mock data")
             return None
             
         return create_client(supabase_url, supabase_key)
     except Exception as e:
-        print(f"Error initializing Supabase client: {e}")
-        traceback.print_exc()
+        logger.exception("Error initializing Supabase client: %s", e)
         return None
 
 # Google Maps API configuration
@@ -332,14 +349,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add session middleware
-app.add_middleware(SessionMiddleware, secret_key=os.getenv("FLASK_SECRET_KEY", "your-secret-key"))
+# Add session middleware; session data is kept server-side and only written when it changes
+app.add_middleware(
+    ServerSessionMiddleware,
+    backend=create_session_backend(),
+    https_only=os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
+)
+
+# Record each request's Supabase queries and flag repeated query shapes (N+1)
+app.add_middleware(QueryLogMiddleware)
+instrument_postgrest()
+
+# Time every request by route; it also covers the session and query log middleware
+app.add_middleware(MetricsMiddleware)
+
+# Profile single requests sent with an X-Profile header carrying PROFILE_TOKEN
+app.add_middleware(ProfilerMiddleware)
+
+# Tag log records with the request's id; outermost, so every other layer's records carry it
+app.add_middleware(RequestIdMiddleware)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Templates
-templates = Jinja2Templates(directory="templates")
+# Templates (TEMPLATE_MODE=production turns off reload checks and caches their bytecode on disk)
+templates = TimedJinja2Templates(directory="templates", **template_options())
+
+# Names templates use that no route is registered under
+URL_PATHS = {
+    "vendors": "/vendors",
+    "vendor_detail": "/vendors/{vendor_id}",
+    "delete_vendor": "/vendors/{vendor_id}/delete",
+    "admin_users": "/admin/users",
+    "profile": "/profile",
+    "edit_expense": "/expenses/{expense_id}/edit",
+    "expense_summary_report": "/reports/expense-summary",
+    "edit_contact": "/contacts/{contact_id}/edit",
+    "delete_invoice": "/invoices/{invoice_id}/delete",
+    "index": "/",
+}
+url_table = URLTable(app, URL_PATHS)
 
 # Add custom template functions
 def url_for(name, filename=None, **kwargs):
@@ -347,100 +396,15 @@ def url_for(name, filename=None, **kwargs):
     if name == 'static' and filename:
         return f"/static/{filename}"
     
-    # Map function names to URL paths
-    url_map = {
-        # Main navigation
-        "dashboard": "/dashboard",
-        "contacts": "/contacts",
-        "projects": "/projects",
-        "time_logs": "/time-logs",
-        "expenses": "/expenses",
-        "vendors": "/vendors",
-        "reports": "/reports",
-        "admin_users": "/admin/users",
-        "profile": "/profile",
-        
-        # Time logs
-        "new_time_log": "/time-logs/new",
-        "edit_time_log": "/time-logs/{}/edit",
-        "time_summary_report": "/reports/time-summary",
-        
-        # Expenses
-        "new_expense": "/expenses/new",
-        "edit_expense": "/expenses/{}/edit",
-        "expense_detail": "/expenses/{}",
-        "expense_summary_report": "/reports/expense-summary",
-        
-        # Projects
-        "new_project": "/projects/new",
-        "edit_project": "/projects/{}/edit",
-        "project_detail": "/projects/{}",
-        
-        # Contacts
-        "new_contact": "/contacts/new",
-        "contact_detail": "/contacts/{}",
-        "edit_contact": "/contacts/{}/edit",
-        
-        # Customers
-        "customers": "/customers",
-        "new_customer": "/customers/new",
-        "customer_detail": "/customers/{}",
-        "edit_customer": "/customers/{}/edit",
-        "delete_customer": "/customers/{}/delete",
-        
-        # Vendors
-        "vendor_detail": "/vendors/{}",
-        "edit_vendor": "/vendors/{}/edit",
-        "new_vendor": "/vendors/new",
-        "delete_vendor": "/vendors/{}/delete",
-        
-        # Invoices
-        "invoices": "/invoices",
-        "edit_invoice": "/invoices/{}/edit",
-        "new_invoice": "/invoices/new",
-        "invoice_detail": "/invoices/{}",
-        "create_invoice": "/invoices/create",
-        "update_invoice": "/invoices/{}/update",
-        "delete_invoice": "/invoices/{}/delete",
-        "send_invoice": "/invoices/{}/send",
-        "record_payment": "/invoices/{}/payment",
-        "cancel_invoice": "/invoices/{}/cancel",
-        "project_invoices": "/projects/{}/invoices",
-        
-        # Other
-        "login": "/login",
-        "logout": "/logout",
-        "index": "/"
-    }
-    
-    if name in url_map:
-        url_pattern = url_map[name]
-        
-        # Handle URL patterns with format placeholders
-        if "{}" in url_pattern and kwargs:
-            # For routes with a single parameter (like customer_id)
-            if len(kwargs) == 1:
-                param_value = list(kwargs.values())[0]
-                return url_pattern.format(param_value)
-            # For routes with multiple parameters
-            elif len(kwargs) > 1:
-                url_parts = url_pattern.split('{}')
-                if len(url_parts) == len(kwargs) + 1:
-                    result = url_parts[0]
-                    for i, key in enumerate(kwargs):
-                        result += str(kwargs[key]) + url_parts[i+1]
-                    return result
-        
-        return url_pattern
+    pattern = url_table.get(name)
+    if pattern is not None:
+        return pattern.format(kwargs)
     
     # Special case for direct paths
     if name.startswith('/'):
         return name
     
-    # If the name contains a slash, treat it as a direct path
-    if '/' in name:
-        return f"/{name}"
-    
+    # Anything else, such as 'estimates/' + id, is treated as a path
     return f"/{name}"
 
 # Add template globals
@@ -448,6 +412,21 @@ templates.env.globals["url_for"] = url_for
 templates.env.globals["get_flashed_messages"] = lambda with_categories=False: []
 templates.env.globals["google_maps_api_key"] = GOOGLE_MAPS_API_KEY
 
+# Compile every template at startup, before workers fork
+@register_warmup
+def compile_templates():
+    return f"{warm_templates(templates)} templates"
+
+# Compile the url_for table once every route is registered
+@register_warmup
+def compile_url_table():
+    return f"{url_table.build()} route names"
+
+@app.on_event("startup")
+async def warm_caches():
+    """Fill startup caches; a no-op in workers forked from a master that already did."""
+    run_warmups()
+
 # Session dependency
 def get_session(request: Request):
     return request.session
@@ -456,33 +435,79 @@ def get_session(request: Request):
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Root endpoint for the API."""
-    # Set a mock session for templates
-    request.session["user_id"] = None
-    request.session["user_name"] = "Guest"
-    request.session["user_role"] = None
-    
-    # Pass the session to the template context
+    # Pass the session to the template context; templates treat missing keys as a guest
     return templates.TemplateResponse("index.html", {"request": request, "session": request.session})
 
+# Upload progress endpoint
+@app.get("/uploads/{upload_id}/progress")
+async def upload_progress_route(upload_id: str, session: dict = Depends(get_session)):
+    """Progress of a streaming upload to storage, for the upload forms to poll."""
+    if not check_auth(session):
+        return JSONResponse({"status": "unauthorized"}, status_code=401)
+    progress = await run_in_threadpool(upload_progress.get, upload_id)
+    if progress is None:
+        return JSONResponse({"status": "unknown"}, status_code=404)
+    return progress
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
+# Metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Request latency, status and in-flight metrics for Prometheus to scrape."""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+# Query log of recent requests, for development
+@app.get("/debug/queries", include_in_schema=False)
+async def debug_queries(request: Request):
+    """Supabase calls made by recent requests, with repeated query shapes flagged."""
+    if not QUERY_LOG_DEBUG or request.session.get("user_role") != "admin":
+        raise HTTPException(status_code=404, detail="Not found")
+    return JSONResponse({"requests": recent_requests()})
+
+def can_profile(request: Request) -> bool:
+    """Profiling is for admins, or for tools sending X-Profile with PROFILE_TOKEN"""
+    return request.session.get("user_role") == "admin" or authorized(request.headers.get("x-profile"))
+
+# Sampling profile of this worker
+@app.get("/debug/profile", include_in_schema=False)
+async def debug_profile(request: Request, seconds: float = 10, interval: float = 0.005):
+    """Sample every thread of this worker for a number of seconds and return collapsed stacks for a flamegraph."""
+    if not can_profile(request):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        profile = await profile_worker(seconds, interval)
+    except ProfilerBusy:
+        return PlainTextResponse("A profile is already running", status_code=409)
+    return PlainTextResponse(profile, headers={"Content-Disposition": 'attachment; filename="worker.collapsed"'})
+
+# Profile of a single request made with X-Profile
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False)
+async def debug_request_profile(profile_id: str, request: Request):
+    """Collapsed stacks recorded while handling a request sent with X-Profile."""
+    profile = await run_in_threadpool(get_profile, profile_id) if can_profile(request) else None
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return PlainTextResponse(profile, headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed"'})
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     return templates.TemplateResponse(
         "error.html", 
-        {"request": request, "status_code": exc.status_code, "detail": exc.detail}
+        {"request": request, "status_code": exc.status_code, "detail": exc.detail},
+        status_code=exc.status_code
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    # Log the error
-    print(f"Internal Server Error: {str(exc)}")
-    print(f"Stack Trace: {traceback.format_exc()}")
+    # Format the traceback once; the log writer reuses it from the exception
+    stack_trace = formatted_traceback(exc)
+    logger.error("Internal Server Error: %s %s: %s", request.method, request.url.path, exc, exc_info=exc)
     
     # Return a more helpful error page in development
     return templates.TemplateResponse(
@@ -491,8 +516,9 @@ async def general_exception_handler(request: Request, exc: Exception):
             "request": request, 
             "status_code": 500, 
             "detail": str(exc),
-            "traceback": traceback.format_exc()
-        }
+            "traceback": stack_trace
+        },
+        status_code=500
     )
 
 # Initialize database tables if they don't exist
@@ -548,7 +574,7 @@ async def dashboard(request: Request):
                     "pending_approvals": len(supabase.table("purchases").select("id").eq("status", "pending").execute().data)
                 }
             except Exception as e:
-                print(f"Error fetching data from Supabase: {str(e)}")
+                logger.error("Error fetching data from Supabase: %s", e)
                 recent_activity = MOCK_ACTIVITY
                 metrics = MOCK_METRICS
         else:
@@ -566,8 +592,7 @@ async def dashboard(request: Request):
             }
         )
     except Exception as e:
-        print(f"Dashboard Error: {str(e)}")
-        print(f"Stack Trace: {traceback.format_exc()}")
+        logger.exception("Dashboard Error: %s", e)
         
         # Return error response with mock data as fallback
         return templates.TemplateResponse(
@@ -599,23 +624,8 @@ async def contacts(request: Request, session: dict = Depends(get_session), page:
         {"id": 8, "name": "Frank Wilson", "company": "HVAC Solutions", "email": "frank.wilson@hvac.com", "phone": "(555) 765-4321", "type": "Vendor", "type_color": "success"},
     ]
     
-    # Pagination variables
-    items_per_page = 10
-    total_items = len(mock_contacts)
-    total_pages = (total_items + items_per_page - 1) // items_per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate pagination indices
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_items)
-    
     # Get contacts for current page
-    paginated_contacts = mock_contacts[start_idx:end_idx]
+    paginated_contacts, page, total_pages = paginate(mock_contacts, page)
     
     # Prepare context with pagination data
     context = {
@@ -726,23 +736,9 @@ async def projects(
         elif sort == 'progress':
             projects_data = sorted(projects_data, key=lambda p: p["progress"], reverse=reverse)
     
-    # Pagination variables
-    items_per_page = 10
     total_items = len(projects_data)
-    total_pages = (total_items + items_per_page - 1) // items_per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate pagination indices
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_items)
-    
     # Get paginated projects
-    paginated_projects = projects_data[start_idx:end_idx]
+    paginated_projects, page, total_pages = paginate(projects_data, page)
     
     # Get available statuses for filter dropdown
     statuses = ["Planning", "In Progress", "On Hold", "Completed", "Cancelled"]
@@ -920,35 +916,11 @@ async def time_logs(
     time_logs_data = MOCK_TIME_LOGS.copy()
     
     # Apply filters
-    if search_query:
-        time_logs_data = [log for log in time_logs_data if 
-                         search_query.lower() in log["project_name"].lower() or 
-                         search_query.lower() in log["task_name"].lower() or 
-                         search_query.lower() in log["description"].lower()]
-    
-    if status_filter:
-        time_logs_data = [log for log in time_logs_data if log["status"].lower() == status_filter.lower()]
-    
-    if project_filter:
-        time_logs_data = [log for log in time_logs_data if log["project_id"] == project_filter]
-    
-    # Pagination variables
-    items_per_page = 10
+    time_logs_data = filter_time_logs(time_logs_data, search_query, status_filter, project_filter)
+
     total_items = len(time_logs_data)
-    total_pages = (total_items + items_per_page - 1) // items_per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate pagination indices
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_items)
-    
     # Get paginated time logs
-    paginated_time_logs = time_logs_data[start_idx:end_idx]
+    paginated_time_logs, page, total_pages = paginate(time_logs_data, page)
     
     # Get projects for filter dropdown
     projects = [(p["id"], p["name"]) for p in MOCK_PROJECTS]
@@ -1212,66 +1184,7 @@ async def time_summary_report(
         mock_time_logs = [log for log in mock_time_logs if log["project_id"] == int(project_id)]
     
     # Calculate summary based on group_by parameter
-    summary = []
-    if group_by == "project":
-        # Group by project
-        project_data = {}
-        for log in mock_time_logs:
-            project_id = log["project_id"]
-            if project_id not in project_data:
-                project_data[project_id] = {
-                    "name": log["project_name"],
-                    "total_hours": 0,
-                    "billable_hours": 0,
-                    "non_billable_hours": 0
-                }
-            project_data[project_id]["total_hours"] += log["hours"]
-            if log["billable"]:
-                project_data[project_id]["billable_hours"] += log["hours"]
-            else:
-                project_data[project_id]["non_billable_hours"] += log["hours"]
-        
-        summary = list(project_data.values())
-    
-    elif group_by == "user":
-        # Group by user
-        user_data = {}
-        for log in mock_time_logs:
-            user_id = log["user_id"]
-            if user_id not in user_data:
-                user_data[user_id] = {
-                    "name": log["user_name"],
-                    "total_hours": 0,
-                    "billable_hours": 0,
-                    "non_billable_hours": 0
-                }
-            user_data[user_id]["total_hours"] += log["hours"]
-            if log["billable"]:
-                user_data[user_id]["billable_hours"] += log["hours"]
-            else:
-                user_data[user_id]["non_billable_hours"] += log["hours"]
-        
-        summary = list(user_data.values())
-    
-    elif group_by == "task":
-        # Group by task
-        task_data = {}
-        for log in mock_time_logs:
-            task_id = log["task_id"]
-            if task_id not in task_data:
-                task_data[task_id] = {
-                    "name": log["task_name"],
-                    "total_hours": 0,
-                    "billable_hours": 0,
-                    "non_billable_hours": 0
-                }
-            task_data[task_id]["total_hours"] += log["hours"]
-            if log["billable"]:
-                task_data[task_id]["billable_hours"] += log["hours"]
-            else:
-                task_data[task_id]["non_billable_hours"] += log["hours"]
-        
-        summary = list(task_data.values())
+    summary = summarize_hours(mock_time_logs, group_by)
     
     # Calculate totals
     total_hours = sum(item["total_hours"] for item in summary)
@@ -1316,52 +1229,11 @@ async def expenses(
     # Use our comprehensive MOCK_EXPENSES for data
     expenses_data = MOCK_EXPENSES.copy()
     
-    # Filter by search query
-    if search:
-        search = search.lower()
-        expenses_data = [e for e in expenses_data if 
-                        (e["description"] and search in e["description"].lower()) or 
-                        (e["vendor_name"] and search in e["vendor_name"].lower()) or 
-                        (e["project_name"] and search in e["project_name"].lower()) or
-                        (e["category"] and search in e["category"].lower()) or
-                        (e["submitted_by"] and search in e["submitted_by"].lower())]
-    
-    # Filter by category
-    if category and category != "All":
-        expenses_data = [e for e in expenses_data if e["category"] == category]
-    
-    # Filter by project
-    if project_id:
-        expenses_data = [e for e in expenses_data if e["project_id"] == project_id]
-    
-    # Filter by status
-    if status and status != "All":
-        expenses_data = [e for e in expenses_data if e["status"] == status]
-    
-    # Filter by date range
-    if date_from:
-        expenses_data = [e for e in expenses_data if e["date"] >= date_from]
-    
-    if date_to:
-        expenses_data = [e for e in expenses_data if e["date"] <= date_to]
+    expenses_data = filter_expenses(expenses_data, search, category, project_id, status, date_from, date_to)
     
-    # Pagination variables
-    items_per_page = 10
     total_items = len(expenses_data)
-    total_pages = (total_items + items_per_page - 1) // items_per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate pagination indices
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_items)
-    
     # Get expenses for current page
-    paginated_expenses = expenses_data[start_idx:end_idx]
+    paginated_expenses, page, total_pages = paginate(expenses_data, page)
     
     # Process expense status for display
     for expense in paginated_expenses:
@@ -1618,16 +1490,8 @@ async def list_vendors(
             if status:
                 vendors = [v for v in vendors if v.get('status') == status]
         
-        # Process vendor dates for comparison
-        for vendor in vendors:
-            if vendor.get('insurance_expiry'):
-                # Parse the ISO-formatted date string to a datetime object
-                try:
-                    insurance_date = datetime.fromisoformat(vendor['insurance_expiry'].replace('Z', '+00:00'))
-                    vendor['insurance_expiry'] = insurance_date.date()
-                except (ValueError, AttributeError):
-                    # If parsing fails, set to None to avoid comparison errors
-                    vendor['insurance_expiry'] = None
+        # Parse insurance dates for comparison
+        vendors = with_insurance_dates(vendors)
         
         return templates.TemplateResponse(
             "vendors.html",
@@ -1640,7 +1504,7 @@ async def list_vendors(
             }
         )
     except Exception as e:
-        print(f"Error listing vendors: {str(e)}")
+        logger.error("Error listing vendors: %s", e)
         # Fall back to mock data on error
         current_date = datetime.now().date()  # Also add in the error case
         vendors = MOCK_VENDORS
@@ -1651,17 +1515,9 @@ async def list_vendors(
         if status:
             vendors = [v for v in vendors if v.get('status') == status]
         
-        # Process vendor dates for comparison
-        for vendor in vendors:
-            if vendor.get('insurance_expiry'):
-                # Parse the ISO-formatted date string to a datetime object
-                try:
-                    insurance_date = datetime.fromisoformat(vendor['insurance_expiry'].replace('Z', '+00:00'))
-                    vendor['insurance_expiry'] = insurance_date.date()
-                except (ValueError, AttributeError):
-                    # If parsing fails, set to None to avoid comparison errors
-                    vendor['insurance_expiry'] = None
-            
+        # Parse insurance dates for comparison
+        vendors = with_insurance_dates(vendors)
+        
         return templates.TemplateResponse(
             "vendors.html",
             {
@@ -1696,19 +1552,27 @@ async def create_vendor_route(
     material_categories: List[str] = Form(...),
     address: str = Form(...),
     tax_id: str = Form(...),
-    insurance_doc: UploadFile = File(...),
-    notes: Optional[str] = Form(None)
+    insurance_document: Optional[UploadFile] = File(None),
+    notes: Optional[str] = Form(None),
+    upload_id: Optional[str] = Form(None)
 ):
     """Create a new vendor."""
     try:
         supabase = get_supabase_client()
         
-        # Upload insurance document
-        file_path = f"vendor_docs/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{insurance_doc.filename}"
-        result = supabase.storage.from_("vendor_documents").upload(
-            file_path,
-            insurance_doc.file.read()
-        )
+        # Stream the insurance document to storage in chunks, off the event loop
+        file_path = None
+        if insurance_document and insurance_document.filename:
+            file_path = f"vendor_docs/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{insurance_document.filename}"
+            file_path = await run_in_threadpool(
+                stream_upload,
+                supabase,
+                "vendor_documents",
+                file_path,
+                insurance_document.file,
+                content_type=insurance_document.content_type,
+                upload_id=upload_id
+            )
         
         # Create vendor record
         vendor_data = {
@@ -1719,7 +1583,7 @@ async def create_vendor_route(
             "material_categories": material_categories,
             "address": address,
             "tax_id": tax_id,
-            "insurance_doc_url": file_path if result else None,
+            "insurance_doc_url": file_path,
             "notes": notes,
             "status": "pending",
             "created_at": datetime.utcnow().isoformat(),
@@ -1734,7 +1598,7 @@ async def create_vendor_route(
             raise HTTPException(status_code=500, detail="Failed to create vendor")
             
     except Exception as e:
-        print(f"Error creating vendor: {str(e)}")
+        logger.error("Error creating vendor: %s", e)
         return templates.TemplateResponse(
             "error.html",
             {
@@ -1807,7 +1671,7 @@ async def view_vendor(request: Request, vendor_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error viewing vendor: {str(e)}")
+        logger.error("Error viewing vendor: %s", e)
         # Fall back to mock data on error
         vendor = next((v for v in MOCK_VENDORS if v['id'] == vendor_id), None)
         if not vendor:
@@ -1868,7 +1732,7 @@ async def edit_vendor(
             "session": session
         })
     except Exception as e:
-        print(f"Error editing vendor: {e}")
+        logger.error("Error editing vendor: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/vendors/{vendor_id}/edit")
@@ -1895,7 +1759,8 @@ async def update_vendor_route(
     insurance_expiry: str = Form(None),
     certifications: str = Form(None),
     notes: str = Form(None),
-    insurance_document: Optional[UploadFile] = File(None)
+    insurance_document: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None)
 ):
     """Update a vendor"""
     if not check_auth(session):
@@ -1930,9 +1795,14 @@ async def update_vendor_route(
         # Handle insurance document upload if provided
         if insurance_document and insurance_document.filename:
             file_path = f"vendor_docs/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{insurance_document.filename}"
-            result = supabase.storage.from_("vendor_documents").upload(
+            result = await run_in_threadpool(
+                stream_upload,
+                supabase,
+                "vendor_documents",
                 file_path,
-                insurance_document.file.read()
+                insurance_document.file,
+                content_type=insurance_document.content_type,
+                upload_id=upload_id
             )
             if result:
                 vendor_data["insurance_doc_url"] = file_path
@@ -1945,7 +1815,7 @@ async def update_vendor_route(
         
         return RedirectResponse(url=f"/vendors/{vendor_id}", status_code=303)
     except Exception as e:
-        print(f"Error updating vendor: {str(e)}")
+        logger.error("Error updating vendor: %s", e)
         return templates.TemplateResponse(
             "error.html",
             {
@@ -1979,7 +1849,7 @@ async def delete_vendor_route(
             status_code=303
         )
     except Exception as e:
-        print(f"Error deleting vendor: {e}")
+        logger.error("Error deleting vendor: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/vendors/{vendor_id}/materials", response_class=HTMLResponse)
@@ -2020,7 +1890,7 @@ async def view_vendor_materials(
             "session": session
         })
     except Exception as e:
-        print(f"Error viewing vendor materials: {e}")
+        logger.error("Error viewing vendor materials: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/vendors/{vendor_id}/materials/{material_id}/stock")
@@ -2064,20 +1934,153 @@ async def update_material_stock_route(
             status_code=303
         )
     except Exception as e:
-        print(f"Error updating material stock: {e}")
+        logger.error("Error updating material stock: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Vendor documents uploaded in mock mode
+MOCK_VENDOR_DOCUMENTS = []
+
+def get_vendor(vendor_id: str):
+    """Vendor by id from Supabase, or from mock data"""
+    if supabase:
+        response = supabase.from_("vendors").select("*").eq("id", vendor_id).execute()
+        return response.data[0] if response.data else None
+    return next((v for v in MOCK_VENDORS if v['id'] == vendor_id), None)
+
+@app.get("/vendors/{vendor_id}/documents/mobile/upload", response_class=HTMLResponse)
+async def mobile_document_upload(
+    vendor_id: str,
+    request: Request,
+    session: dict = Depends(get_session)
+):
+    """Display the mobile document upload form"""
+    if not check_auth(session):
+        return RedirectResponse(url="/login")
+    
+    vendor = get_vendor(vendor_id)
+    if not vendor:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    
+    if supabase:
+        response = supabase.table("projects").select("id, name").execute()
+        projects = response.data if response.data else []
+    else:
+        projects = MOCK_PROJECTS
+    
+    return templates.TemplateResponse("mobile_document_upload.html", {
+        "request": request,
+        "vendor": vendor,
+        "projects": projects,
+        # No approver directory yet; approvers are auto-assigned
+        "users": [],
+        "session": session
+    })
+
+@app.post("/vendors/{vendor_id}/documents/mobile/upload")
+async def mobile_document_upload_post(
+    vendor_id: str,
+    request: Request,
+    session: dict = Depends(get_session),
+    document_name: str = Form(...),
+    document_type: str = Form(...),
+    document_date: str = Form(...),
+    document_file: UploadFile = File(...),
+    reference_number: Optional[str] = Form(None),
+    amount: Optional[str] = Form(None),
+    project_id: Optional[str] = Form(None),
+    document_description: Optional[str] = Form(None),
+    needs_approval: bool = Form(False),
+    approval_status: str = Form("draft"),
+    approval_level: Optional[str] = Form(None),
+    approver_id: Optional[str] = Form(None),
+    due_date: Optional[str] = Form(None),
+    upload_id: Optional[str] = Form(None)
+):
+    """Upload a vendor document from the mobile form"""
+    if not check_auth(session):
+        return RedirectResponse(url="/login", status_code=303)
+    
+    vendor = get_vendor(vendor_id)
+    if not vendor:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    
+    try:
+        amount = float(amount) if amount else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Amount must be a number")
+    
+    try:
+        # Stream the document to storage in chunks, off the event loop
+        file_path = f"vendor_docs/{vendor_id}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{document_file.filename}"
+        file_path = await run_in_threadpool(
+            stream_upload,
+            supabase,
+            "vendor_documents",
+            file_path,
+            document_file.file,
+            content_type=document_file.content_type,
+            upload_id=upload_id
+        )
+        
+        pending = needs_approval and approval_status == "pending"
+        document_data = {
+            "vendor_id": vendor_id,
+            "name": document_name,
+            "document_type": document_type,
+            "document_date": document_date,
+            "reference_number": reference_number or None,
+            "amount": amount,
+            "project_id": project_id or None,
+            "description": document_description or None,
+            "file_name": document_file.filename,
+            "file_path": file_path,
+            "approval_status": approval_status if needs_approval else None,
+            "approval_level": approval_level if pending else None,
+            "approver_id": (approver_id or None) if pending else None,
+            "due_date": (due_date or None) if pending else None,
+            "created_by": session.get("user_id"),
+            "created_at": datetime.utcnow().isoformat()
+        }
+        
+        if supabase:
+            result = supabase.table("vendor_documents").insert(document_data).execute()
+            if not result or not result.data:
+                raise HTTPException(status_code=500, detail="Failed to save document")
+        else:
+            MOCK_VENDOR_DOCUMENTS.append(document_data)
+        
+        return RedirectResponse(url=f"/vendors/{vendor_id}", status_code=303)
+    except Exception as e:
+        logger.error("Error uploading vendor document: %s", e)
+        return templates.TemplateResponse(
+            "error.html",
+            {
+                "request": request,
+                "status_code": 500,
+                "detail": "Error uploading document"
+            },
+            status_code=500
+        )
+
 # Login page
 @app.get("/login", response_class=HTMLResponse)
 async def login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "session": request.session})
 
+@app.get("/logout")
+async def logout(request: Request):
+    request.session.clear()
+    request.session.regenerate()
+    return RedirectResponse(url="/login", status_code=303)
+
 # Login form submission
 @app.post("/login", response_class=HTMLResponse)
 async def login_post(request: Request, username: str = Form(...), password: str = Form(...)):
     # This is a simple mock authentication
     # In a real application, you would validate against a database
     if username == "admin@akc.org" and password == "admin123":
+        # A new session id on login, so an id set before it can't be used to ride this session
+        request.session.regenerate()
         request.session["user_id"] = 1
         request.session["user_name"] = "Admin"
         request.session["user_role"] = "admin"
@@ -2089,12 +2092,6 @@ async def login_post(request: Request, username: str = Form(...), password: str
         {"request": request, "session": request.session, "error": "Invalid username or password"}
     )
 
-# If this file is run directly, use Uvicorn to serve the app
-if __name__ == "__main__":
-    import uvicorn
-    port = int(os.environ.get("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
-
 # Customer routes
 @app.get("/customers", response_class=HTMLResponse)
 async def customers(
@@ -2139,7 +2136,7 @@ async def customers(
                                  search in c["contact_name"].lower() or
                                  search in c["email"].lower()]
     except Exception as e:
-        print(f"Error fetching customers: {str(e)}")
+        logger.error("Error fetching customers: %s", e)
         # Fallback to mock data
         customers_data = MOCK_CUSTOMERS
     
@@ -2253,7 +2250,7 @@ async def create_customer(
                 if result.data:
                     customer_id = result.data[0].get('id')
             except Exception as supabase_error:
-                print(f"Supabase error creating customer: {str(supabase_error)}")
+                logger.error("Supabase error creating customer: %s", supabase_error)
         
         # If we couldn't insert into Supabase, use a mock ID
         if not customer_id:
@@ -2268,7 +2265,7 @@ async def create_customer(
         return RedirectResponse(url=f"/customers/{customer_id}", status_code=303)
     
     except Exception as e:
-        print(f"Error creating customer: {str(e)}")
+        logger.error("Error creating customer: %s", e)
         return templates.TemplateResponse(
             "error.html",
             {
@@ -2326,7 +2323,7 @@ async def customer_detail(customer_id: int, request: Request, session: dict = De
         )
     
     except Exception as e:
-        print(f"Error retrieving customer {customer_id}: {str(e)}")
+        logger.error("Error retrieving customer %s: %s", customer_id, e)
         return templates.TemplateResponse(
             "error.html", 
             {
@@ -2387,7 +2384,7 @@ async def edit_customer(customer_id: int, request: Request, session: dict = Depe
         )
     
     except Exception as e:
-        print(f"Error retrieving customer {customer_id} for edit: {str(e)}")
+        logger.error("Error retrieving customer %s for edit: %s", customer_id, e)
         return templates.TemplateResponse(
             "error.html", 
             {
@@ -2453,9 +2450,9 @@ async def update_customer(
                 result = supabase_client.table("customers").update(customer_data).eq("id", customer_id).execute()
                 
                 if not result.data:
-                    print(f"No data returned when updating customer {customer_id}")
+                    logger.warning("No data returned when updating customer %s", customer_id)
             except Exception as supabase_error:
-                print(f"Supabase error updating customer: {str(supabase_error)}")
+                logger.error("Supabase error updating customer: %s", supabase_error)
         
         # In a real app, you would update the customer in the database
         # Here we're just redirecting back to the customer detail page
@@ -2463,7 +2460,7 @@ async def update_customer(
         return RedirectResponse(url=f"/customers/{customer_id}", status_code=303)
     
     except Exception as e:
-        print(f"Error updating customer {customer_id}: {str(e)}")
+        logger.error("Error updating customer %s: %s", customer_id, e)
         return templates.TemplateResponse(
             "error.html",
             {
@@ -2495,7 +2492,7 @@ async def delete_customer(customer_id: int, request: Request, session: dict = De
         return RedirectResponse(url="/customers", status_code=303)
     
     except Exception as e:
-        print(f"Error deleting customer {customer_id}: {str(e)}")
+        logger.error("Error deleting customer %s: %s", customer_id, e)
         return templates.TemplateResponse(
             "error.html", 
             {
@@ -2990,6 +2987,12 @@ MOCK_INVOICES = [
     }
 ]
 
+# Indexes unbilled expenses and time logs for billing runs
+billing = BillingService(MOCK_EXPENSES, MOCK_TIME_LOGS, MOCK_INVOICES, MOCK_PROJECTS)
+
+# Payments ledger with per-invoice locking and idempotency keys
+payment_ledger = PaymentLedger(MOCK_INVOICES)
+
 @app.get("/invoices", response_class=HTMLResponse)
 async def invoices(
     request: Request, 
@@ -3008,51 +3011,11 @@ async def invoices(
     # Use our comprehensive MOCK_INVOICES for data
     invoices_data = MOCK_INVOICES.copy()
     
-    # Filter by search query
-    if search:
-        search = search.lower()
-        invoices_data = [i for i in invoices_data if 
-                        (i["invoice_number"] and search in i["invoice_number"].lower()) or 
-                        (i["client_name"] and search in i["client_name"].lower()) or 
-                        (i["project_name"] and search in i["project_name"].lower()) or
-                        (i["notes"] and search in i["notes"].lower())]
-    
-    # Filter by status
-    if status and status != "All":
-        invoices_data = [i for i in invoices_data if i["status"] == status]
-    
-    # Filter by client
-    if client_id:
-        invoices_data = [i for i in invoices_data if i["client_id"] == client_id]
-    
-    # Filter by project
-    if project_id:
-        invoices_data = [i for i in invoices_data if i["project_id"] == project_id]
-    
-    # Filter by date range
-    if date_from:
-        invoices_data = [i for i in invoices_data if i["issue_date"] >= date_from]
+    invoices_data = filter_invoices(invoices_data, search, status, client_id, project_id, date_from, date_to)
     
-    if date_to:
-        invoices_data = [i for i in invoices_data if i["issue_date"] <= date_to]
-    
-    # Pagination variables
-    items_per_page = 10
     total_items = len(invoices_data)
-    total_pages = (total_items + items_per_page - 1) // items_per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Calculate pagination indices
-    start_idx = (page - 1) * items_per_page
-    end_idx = min(start_idx + items_per_page, total_items)
-    
     # Get invoices for current page
-    paginated_invoices = invoices_data[start_idx:end_idx]
+    paginated_invoices, page, total_pages = paginate(invoices_data, page)
     
     # Process invoice status for display
     for invoice in paginated_invoices:
@@ -3090,6 +3053,7 @@ async def invoices(
         "date_to": date_to or "",
         "statuses": invoice_statuses,
         "projects": MOCK_PROJECTS,
+        "customers": MOCK_CUSTOMERS,
         "total_invoices": total_items,
         "total_amount": total_amount,
         "paid_amount": paid_amount,
@@ -3154,7 +3118,8 @@ async def invoice_detail(
             "session": request.session,
             "invoice": invoice_data,
             "project": project,
-            "related_expenses": related_expenses
+            "related_expenses": related_expenses,
+            "payment_idempotency_key": uuid.uuid4().hex
         }
     )
 
@@ -3176,11 +3141,10 @@ async def new_invoice(
         selected_project = next((p for p in projects if p["id"] == project_id), None)
     
     # Get unbilled expenses
-    unbilled_expenses = [e for e in MOCK_EXPENSES if e.get("invoice_id") is None and e.get("billable") is True]
+    unbilled_expenses = billing.unbilled_expenses()
     
     # Generate a new invoice number
-    last_invoice_num = max([int(i["invoice_number"].split("-")[-1]) for i in MOCK_INVOICES])
-    new_invoice_num = f"INV-2025-{last_invoice_num + 1:03d}"
+    new_invoice_num = billing.next_invoice_number()
     
     # Get invoice statuses
     invoice_statuses = ["Draft", "Sent", "Paid", "Overdue", "Cancelled"]
@@ -3211,6 +3175,41 @@ async def create_invoice(
     # For now, we'll just redirect back to the invoices page
     return RedirectResponse(url="/invoices", status_code=303)
 
+@app.post("/invoices/billing-run", response_class=RedirectResponse)
+async def billing_run(
+    request: Request,
+    session: dict = Depends(get_session)
+):
+    if not check_auth(session):
+        return RedirectResponse(url="/login")
+    
+    form = await request.form()
+    try:
+        project_id = int(form["project_id"]) if form.get("project_id") else None
+        client_id = int(form["client_id"]) if form.get("client_id") else None
+        tax_rate = float(form.get("tax_rate") or 0)
+    except ValueError:
+        request.session["flash_messages"] = [
+            {"type": "danger", "message": "Billing run needs a valid project, client and tax rate."}
+        ]
+        return RedirectResponse(url="/invoices", status_code=303)
+    if project_id is None and client_id is None:
+        return RedirectResponse(url="/invoices", status_code=303)
+
+    # Bill every unbilled billable expense and approved billable time log in the range
+    invoice = billing.run(
+        project_id=project_id,
+        client_id=client_id,
+        start_date=form.get("start_date") or None,
+        end_date=form.get("end_date") or None,
+        tax_rate=tax_rate,
+        created_by=session.get("user_name")
+    )
+    
+    if invoice is None:
+        return RedirectResponse(url="/invoices", status_code=303)
+    return RedirectResponse(url=f"/invoices/{invoice['id']}", status_code=303)
+
 @app.post("/invoices/{invoice_id}/update", response_class=RedirectResponse)
 async def update_invoice(
     request: Request,
@@ -3294,24 +3293,27 @@ async def record_payment(
     if not check_auth(session):
         return RedirectResponse(url="/login")
     
-    # This would normally record a payment for an invoice
-    # For now, we'll just redirect back to the invoice detail page with a status update
-    invoice = next((i for i in MOCK_INVOICES if i["id"] == invoice_id), None)
-    
-    if invoice:
-        form = await request.form()
+    form = await request.form()
+    try:
         amount = float(form.get("amount", 0))
-        
-        if amount >= invoice["balance_due"]:
-            # Full payment
-            invoice["status"] = "Paid"
-            invoice["amount_paid"] = invoice["total_amount"]
-            invoice["balance_due"] = 0
-            invoice["paid_date"] = datetime.now().strftime("%Y-%m-%d")
-        else:
-            # Partial payment
-            invoice["amount_paid"] += amount
-            invoice["balance_due"] -= amount
+    except ValueError:
+        amount = 0
+    
+    # The form's idempotency key makes a double-submitted payment a no-op
+    if amount > 0:
+        try:
+            payment_ledger.record(
+                invoice_id,
+                amount,
+                idempotency_key=form.get("idempotency_key") or None,
+                date=form.get("date") or None,
+                method=form.get("method"),
+                reference=form.get("reference"),
+                notes=form.get("notes")
+            )
+        except ValueError as e:
+            # Overpayments are rejected; the form caps the amount at the balance due
+            request.session["flash_messages"] = [{"type": "danger", "message": str(e)}]
     
     return RedirectResponse(url=f"/invoices/{invoice_id}", status_code=303)
 
@@ -3368,4 +3370,11 @@ async def project_invoices(
             "project": project,
             "invoices": project_invoices
         }
-    )
\ No newline at end of file
+    )
+
+# If this file is run directly, serve the app with a single Uvicorn worker for development;
+# production runs under Gunicorn with gunicorn.conf.py
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get("PORT", 8080))
+    uvicorn.run(app, host="0.0.0.0", port=port)
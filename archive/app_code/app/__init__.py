@@ -60,6 +60,18 @@ def create_app(test_config=None):
     from . import supabase_client
     supabase_client.init_app(app)
     
+    # Register the recurring invoice command
+    from .services import recurring_invoices
+    recurring_invoices.init_app(app)
+    
+    # Register the document search index command
+    from .services import document_search
+    document_search.init_app(app)
+    
+    # Register the project membership backfill command
+    from .services import acl
+    acl.init_app(app)
+    
     # Register blueprints
     from .routes import main, auth, clients, projects, bids, invoices, documents
     app.register_blueprint(main.bp)
@@ -7,7 +7,7 @@ from werkzeug.utils import secure_filename
 from app.routes.auth import login_required
 from app.services.bids import (
     get_all_bids, get_bid_by_id, get_bid_items, create_bid, 
-    update_bid, delete_bid, calculate_bid_totals, save_bid_document,
+    update_bid, delete_bid, save_bid_document, save_bid_items, save_bid_version,
     get_bid_versions, get_bid_version_data, convert_bid_to_project
 )
 from app.services.clients import get_all_clients, get_client_by_id
@@ -148,8 +148,9 @@ def edit_bid(bid_id):
             'created_by_id': session.get('user_id')
         }
         
-        # Update the bid
+        # Update the bid and record the edit as a version
         update_bid(bid_id, bid_data)
+        save_bid_version(bid_id, session.get('user_id'), bid_data)
         
         # Handle file upload if present
         if 'document' in request.files and request.files['document'].filename:
@@ -205,11 +206,9 @@ def manage_bid_items(bid_id):
             try:
                 items_data = json.loads(request.form['item_data'])
                 
-                # Update bid with new items
-                update_bid(bid_id, {}, items_data)
-                
-                # Recalculate totals
-                calculate_bid_totals(bid_id)
+                # Save only the changed items, adjusting totals by their deltas,
+                # and record the edit as a version
+                save_bid_items(bid_id, items_data, session.get('user_id'))
                 
                 return jsonify({'success': True, 'message': 'Items updated successfully'})
             except Exception as e:
@@ -335,6 +334,7 @@ def client_response(bid_id):
     }
     
     update_bid(bid_id, bid_data)
+    save_bid_version(bid_id, session.get('user_id'), bid_data)
     
     flash(f'Bid marked as {response}', 'success')
     return redirect(url_for('bids.view_bid', bid_id=bid_id))
@@ -366,6 +366,18 @@ def api_get_bid_items(bid_id):
 @bp.route('/api/calculate/<int:bid_id>', methods=['POST'])
 @login_required
 def api_calculate_totals(bid_id):
-    """API endpoint to calculate bid totals"""
-    totals = calculate_bid_totals(bid_id)
-    return jsonify(totals) 
\ No newline at end of file
+    """API endpoint to get bid totals
+    
+    Item edits keep the totals current as they are saved, so this reads them
+    rather than re-summing the items.
+    """
+    bid = get_bid_by_id(bid_id)
+    if not bid:
+        return jsonify({'error': 'Bid not found'}), 404
+    
+    return jsonify({
+        'labor_cost': bid['labor_cost'] or 0,
+        'material_cost': bid['material_cost'] or 0,
+        'overhead_cost': bid['overhead_cost'] or 0,
+        'total_amount': bid['total_amount'] or 0
+    }) 
\ No newline at end of file
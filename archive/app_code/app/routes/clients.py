@@ -7,6 +7,7 @@ from app.services.clients import (
     get_all_clients, get_client_by_id, create_client,
     update_client, delete_client, get_client_projects
 )
+from app.services.user_context import can_access_client, current_access
 import uuid
 from datetime import datetime
 import os
@@ -19,7 +20,7 @@ bp = Blueprint('clients', __name__, url_prefix='/clients')
 @login_required
 def list_clients():
     """List all clients"""
-    clients = get_all_clients()
+    clients = get_all_clients(client_ids=current_access().client_ids)
     return render_template('clients/index.html', clients=clients)
 
 @bp.route('/create', methods=('GET', 'POST'))
@@ -69,7 +70,7 @@ def create_client():
 @login_required
 def view_client(id):
     """View a client's details"""
-    client = get_client_by_id(id)
+    client = get_client_by_id(id) if can_access_client(id) else None
     
     if client:
         # Get projects for this client
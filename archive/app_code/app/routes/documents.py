@@ -1,19 +1,23 @@
 from flask import (
     Blueprint, flash, redirect, render_template, 
     request, session, url_for, jsonify, send_from_directory,
-    current_app, abort
+    current_app, abort, Response, stream_with_context
 )
 from app.routes.auth import login_required
 from app.services.documents import (
     get_all_documents, get_document, get_entity_documents,
-    save_uploaded_file, delete_document, update_document,
-    get_file_type_icon
+    create_uploaded_document, add_document_version, delete_document, update_document,
+    get_file_type_icon, search_documents_by_content,
+    get_project_folder_name, get_project_export_entries
 )
+from app.services.zip_export import stream_zip
+from app.services.document_versions import get_version, get_versions, read_version
 from app.services.projects import get_all_projects, get_project_by_id
 from app.services.clients import get_all_clients, get_client_by_id
 import os
 from werkzeug.utils import secure_filename
 from app.services.email import send_document_share_email
+from app.services.images import best_image_path
 
 bp = Blueprint('documents', __name__, url_prefix='/documents')
 
@@ -70,6 +74,22 @@ def project_documents(project_id):
         project=project
     )
 
+@bp.route('/project/<project_id>/export.zip')
+@login_required
+def export_project_documents(project_id):
+    """Download a project's document folder as a ZIP, streamed as it is built"""
+    project = get_project_by_id(project_id)
+    
+    if not project:
+        abort(404)
+    
+    filename = f"{get_project_folder_name(project)}.zip"
+    return Response(
+        stream_with_context(stream_zip(get_project_export_entries(project))),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @bp.route('/client/<client_id>')
 @login_required
 def client_documents(client_id):
@@ -105,8 +125,10 @@ def upload_document():
         entity_id = request.form['entity_id']
         description = request.form.get('description', '')
         
-        # Save the uploaded file
-        document = save_uploaded_file(file, entity_type, entity_id, description)
+        # Store the file and create its document
+        document = create_uploaded_document(
+            file, entity_type, entity_id, description, session.get('user_id')
+        )
         
         if document:
             flash('Document uploaded successfully!')
@@ -165,16 +187,37 @@ def document_detail(document_id):
         'documents/detail.html',
         document=document,
         entity=entity,
-        file_icon=get_file_type_icon(document.get('file_type'))
+        file_icon=get_file_type_icon(document.get('file_type')),
+        versions=get_versions(document_id)
+    )
+
+def _version_response(document, version, filename):
+    """Stream a version as an attachment, from its blob or reassembled from its chunks"""
+    return Response(
+        stream_with_context(read_version(version)),
+        mimetype=document['file_type'] or 'application/octet-stream',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Content-Length': str(version['file_size'])
+        }
     )
 
 @bp.route('/download/<document_id>')
 @login_required
 def download_document(document_id):
-    """Download a document"""
+    """Download the latest version of a document"""
     document = get_document(document_id)
     
-    if not document or not document.get('file_path'):
+    if not document:
+        flash('Document not found or no file available')
+        return redirect(url_for('documents.list_documents'))
+    
+    version = get_version(document_id)
+    if version:
+        return _version_response(document, version, secure_filename(document['name']) or 'document')
+    
+    # Documents uploaded before versions were kept only have their original file
+    if not document.get('file_path'):
         flash('Document not found or no file available')
         return redirect(url_for('documents.list_documents'))
     
@@ -199,6 +242,70 @@ def download_document(document_id):
         as_attachment=True
     )
 
+@bp.route('/image/<document_id>')
+@login_required
+def document_image(document_id):
+    """Serve an image document at the requested size (?size=thumb, web or a width in pixels)"""
+    document = get_document(document_id)
+    
+    if not document or not document.get('file_path'):
+        abort(404)
+    
+    file_path = document['file_path']
+    if file_path.startswith('uploads/'):
+        file_path = file_path[8:]  # Remove 'uploads/' prefix
+    
+    full_path = os.path.join(current_app.config['UPLOAD_FOLDER'], file_path)
+    if not os.path.exists(full_path):
+        abort(404)
+    
+    # Falls back to the original until the derivatives have been generated
+    image_path = best_image_path(full_path, request.args.get('size'))
+    return send_from_directory(
+        os.path.dirname(image_path),
+        os.path.basename(image_path),
+        max_age=86400
+    )
+
+@bp.route('/<document_id>/versions', methods=['POST'])
+@login_required
+def upload_document_version(document_id):
+    """Upload a new version of a document"""
+    document = get_document(document_id)
+    
+    if not document:
+        flash('Document not found')
+        return redirect(url_for('documents.list_documents'))
+    
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash('No selected file')
+        return redirect(url_for('documents.document_detail', document_id=document_id))
+    
+    # The new version becomes the document's current file
+    version = add_document_version(
+        document,
+        file,
+        uploaded_by=session.get('user_id'),
+        change_notes=request.form.get('change_notes')
+    )
+    flash(f"Version {version['version_number']} uploaded successfully!")
+    return redirect(url_for('documents.document_detail', document_id=document_id))
+
+@bp.route('/<document_id>/versions/<int:version_number>/download')
+@login_required
+def download_document_version(document_id, version_number):
+    """Download a specific version of a document"""
+    document = get_document(document_id)
+    version = get_version(document_id, version_number) if document else None
+    
+    if not version:
+        flash('Document version not found')
+        return redirect(url_for('documents.list_documents'))
+    
+    root, extension = os.path.splitext(secure_filename(document['name']) or 'document')
+    return _version_response(document, version, f"{root}-v{version_number}{extension}")
+
 @bp.route('/delete/<document_id>', methods=['POST'])
 @login_required
 def delete_document_route(document_id):
@@ -264,15 +371,8 @@ def search_documents():
     if not query:
         return redirect(url_for('documents.list_documents'))
     
-    # Search documents
-    all_documents = get_all_documents()
-    
-    # Simple search by name and description
-    documents = [
-        doc for doc in all_documents 
-        if query.lower() in doc.get('name', '').lower() or 
-           query.lower() in doc.get('description', '').lower()
-    ]
+    # Ranked search over names, descriptions and document contents
+    documents = search_documents_by_content(query)
     
     return render_template(
         'documents/list.html',
@@ -17,8 +17,7 @@ from app.services.time import (
     create_time_entry, get_user_time_entries,
     get_time_summary
 )
-from app.services.documents import save_uploaded_file
-import os
+from app.services.documents import create_uploaded_document
 from datetime import datetime, timedelta
 import uuid
 import json
@@ -282,8 +281,8 @@ def upload_photo():
             flash('No photo uploaded')
             return redirect(url_for('field.upload_photo'))
         
-        # Save the uploaded file
-        document = save_uploaded_file(photo, 'project', project_id, description)
+        # Store the photo and create its document, with the photo as version 1
+        document = create_uploaded_document(photo, 'project', project_id, description, session.get('user_id'))
         
         if document:
             flash('Photo uploaded successfully')
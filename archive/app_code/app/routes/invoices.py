@@ -19,6 +19,7 @@ from app.models.payment import Payment
 from datetime import datetime, timedelta
 import os
 import json
+import uuid
 
 bp = Blueprint('invoices', __name__, url_prefix='/invoices')
 
@@ -271,11 +272,11 @@ def send_invoice(invoice_id):
         # Try to send email
         success = send_invoice_email(invoice_id, 'new')
         if success:
-            flash('Invoice sent successfully via email', 'success')
+            flash('Invoice queued for email delivery', 'success')
         else:
             # Just mark as sent if email fails
             mark_invoice_as_sent(invoice_id)
-            flash('Failed to send email, but invoice marked as sent', 'warning')
+            flash('Failed to queue email, but invoice marked as sent', 'warning')
     else:
         # Just mark as sent without sending email
         mark_invoice_as_sent(invoice_id)
@@ -333,6 +334,7 @@ def record_payment_route(invoice_id):
             'payment_method': request.form.get('payment_method', Payment.METHOD_CHECK),
             'reference_number': request.form.get('reference_number'),
             'notes': request.form.get('notes'),
+            'idempotency_key': request.form.get('idempotency_key'),
             'created_by_id': session.get('user_id')
         }
         
@@ -345,11 +347,11 @@ def record_payment_route(invoice_id):
             
             if send_receipt:
                 # Try to send receipt email
-                success = send_invoice_email(invoice_id, 'receipt')
+                success = send_invoice_email(invoice_id, 'receipt', payment_id=payment_id)
                 if success:
-                    flash('Payment recorded and receipt sent', 'success')
+                    flash('Payment recorded and receipt queued for delivery', 'success')
                 else:
-                    flash('Payment recorded but failed to send receipt', 'warning')
+                    flash('Payment recorded but failed to queue receipt', 'warning')
             else:
                 flash('Payment recorded successfully', 'success')
         else:
@@ -360,7 +362,8 @@ def record_payment_route(invoice_id):
     # GET request - show payment form
     return render_template(
         'invoices/payment.html', 
-        invoice=invoice
+        invoice=invoice,
+        idempotency_key=uuid.uuid4().hex
     )
 
 @bp.route('/<int:invoice_id>/payment/<int:payment_id>/delete', methods=['POST'])
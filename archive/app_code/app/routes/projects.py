@@ -12,7 +12,10 @@ from app.services.projects import (
 )
 from app.services.clients import get_all_clients, get_client_by_id
 from app.services.tasks import TASK_STATUSES
-from app.services.user_context import can_edit_project
+from app.services.user_context import can_edit_project, can_access_project, current_access, has_permission
+from app.services.acl import (
+    get_project_members, get_member_candidates, add_project_member, remove_project_member
+)
 from datetime import datetime
 from collections import defaultdict
 
@@ -27,8 +30,8 @@ def list_projects():
     client_filter = request.args.get('client', '')
     search_query = request.args.get('search', '')
     
-    # Get all projects
-    projects = get_all_projects()
+    # Get the projects this user can see
+    projects = get_all_projects(project_ids=current_access().project_ids)
     
     # Apply filters
     if status_filter:
@@ -45,7 +48,7 @@ def list_projects():
                     search_query in p.get('location', '').lower()]
     
     # Get clients for filter dropdown
-    clients = get_all_clients()
+    clients = get_all_clients(client_ids=current_access().client_ids)
     
     return render_template('project_list.html', 
                           projects=projects,
@@ -118,7 +121,7 @@ def create_project():
 @login_required
 def view_project(project_id):
     """View a single project's details"""
-    project = get_project_by_id(project_id)
+    project = get_project_by_id(project_id) if can_access_project(project_id) else None
     
     if not project:
         flash('Project not found')
@@ -146,6 +149,11 @@ def view_project(project_id):
     # Check if user can edit this project
     can_edit = can_edit_project(project_id)
     
+    # Project members, and the users that can be added for those who manage them
+    can_manage_members = has_permission('update_projects')
+    members = get_project_members(project_id)
+    member_candidates = get_member_candidates(project_id) if can_manage_members else []
+    
     return render_template('project_detail.html', 
                           project=project,
                           client=client,
@@ -156,7 +164,45 @@ def view_project(project_id):
                           task_statuses=TASK_STATUSES,
                           project_types=PROJECT_TYPES,
                           allowed_transitions=allowed_transitions,
-                          can_edit=can_edit)
+                          can_edit=can_edit,
+                          members=members,
+                          member_candidates=member_candidates,
+                          can_manage_members=can_manage_members)
+
+@bp.route('/<project_id>/members', methods=('POST',))
+@login_required
+def add_member(project_id):
+    """Add a user to a project, or change their project role"""
+    project = get_project_by_id(project_id)
+    
+    if not project:
+        flash('Project not found')
+        return redirect(url_for('projects.list_projects'))
+    
+    if not has_permission('update_projects'):
+        flash('You do not have permission to manage this project\'s members')
+        return redirect(url_for('projects.view_project', project_id=project_id))
+    
+    user_id = request.form.get('user_id')
+    if not user_id:
+        flash('Select a user to add')
+        return redirect(url_for('projects.view_project', project_id=project_id))
+    
+    add_project_member(project_id, user_id, request.form.get('role') or 'member')
+    flash('Project member added')
+    return redirect(url_for('projects.view_project', project_id=project_id))
+
+@bp.route('/<project_id>/members/<user_id>/remove', methods=('POST',))
+@login_required
+def remove_member(project_id, user_id):
+    """Remove a user from a project"""
+    if not has_permission('update_projects'):
+        flash('You do not have permission to manage this project\'s members')
+        return redirect(url_for('projects.view_project', project_id=project_id))
+    
+    remove_project_member(project_id, user_id)
+    flash('Project member removed')
+    return redirect(url_for('projects.view_project', project_id=project_id))
 
 @bp.route('/<project_id>/edit', methods=('GET', 'POST'))
 @login_required
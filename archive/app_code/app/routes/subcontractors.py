@@ -9,7 +9,7 @@ from app.services.subcontractors import (
     create_invoice, update_invoice, delete_invoice, get_subcontractor_projects
 )
 from app.services.projects import get_all_projects
-from app.services.documents import get_entity_documents, save_uploaded_file, delete_document
+from app.services.documents import get_entity_documents, create_uploaded_document, delete_document
 import uuid
 from datetime import datetime
 
@@ -298,7 +298,7 @@ def upload_document(subcontractor_id):
             
         description = request.form.get('description', '')
         
-        document = save_uploaded_file(file, 'subcontractor', subcontractor_id, description)
+        document = create_uploaded_document(file, 'subcontractor', subcontractor_id, description, session.get('user_id'))
         
         if document:
             flash('Document uploaded successfully')
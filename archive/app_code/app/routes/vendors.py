@@ -9,7 +9,7 @@ from app.services.vendors import (
     add_purchase, update_purchase, delete_purchase
 )
 from app.services.projects import get_all_projects
-from app.services.documents import get_entity_documents, save_uploaded_file, delete_document
+from app.services.documents import get_entity_documents, create_uploaded_document, delete_document
 import uuid
 from datetime import datetime
 import os
@@ -262,7 +262,7 @@ def upload_document(vendor_id):
             
         description = request.form.get('description', '')
         
-        document = save_uploaded_file(file, 'vendor', vendor_id, description)
+        document = create_uploaded_document(file, 'vendor', vendor_id, description, session.get('user_id'))
         
         if document:
             flash('Document uploaded successfully')
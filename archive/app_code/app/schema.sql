@@ -2,10 +2,15 @@
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS clients;
 DROP TABLE IF EXISTS projects;
+DROP TABLE IF EXISTS project_members;
 DROP TABLE IF EXISTS tasks;
 DROP TABLE IF EXISTS time_entries;
 DROP TABLE IF EXISTS expenses;
 DROP TABLE IF EXISTS documents;
+DROP TABLE IF EXISTS blobs;
+DROP TABLE IF EXISTS document_versions;
+DROP TABLE IF EXISTS document_chunks;
+DROP TABLE IF EXISTS document_search;
 DROP TABLE IF EXISTS document_access;
 DROP TABLE IF EXISTS bids;
 DROP TABLE IF EXISTS bid_items;
@@ -23,6 +28,7 @@ CREATE TABLE users (
   role TEXT NOT NULL DEFAULT 'employee',
   first_name TEXT,
   last_name TEXT,
+  acl_version INTEGER NOT NULL DEFAULT 0,
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
@@ -65,6 +71,19 @@ CREATE TABLE projects (
   FOREIGN KEY (created_by_id) REFERENCES users (id)
 );
 
+-- Project members
+CREATE TABLE project_members (
+  project_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  role TEXT NOT NULL DEFAULT 'member',
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (project_id, user_id),
+  FOREIGN KEY (project_id) REFERENCES projects (id),
+  FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE INDEX idx_project_members_user_id ON project_members (user_id);
+
 -- Tasks table
 CREATE TABLE tasks (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -129,14 +148,64 @@ CREATE TABLE documents (
   file_size INTEGER,
   project_id INTEGER,
   client_id INTEGER,
+  vendor_id TEXT,
+  subcontractor_id TEXT,
   description TEXT,
   version TEXT,
   created_by_id INTEGER,
+  content_hash TEXT,
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (project_id) REFERENCES projects (id),
   FOREIGN KEY (client_id) REFERENCES clients (id),
-  FOREIGN KEY (created_by_id) REFERENCES users (id)
+  FOREIGN KEY (created_by_id) REFERENCES users (id),
+  FOREIGN KEY (content_hash) REFERENCES blobs (hash)
+);
+
+CREATE INDEX idx_documents_content_hash ON documents (content_hash);
+CREATE INDEX idx_documents_vendor_id ON documents (vendor_id);
+CREATE INDEX idx_documents_subcontractor_id ON documents (subcontractor_id);
+
+-- Content-addressed file storage shared by documents with identical content
+CREATE TABLE blobs (
+  hash TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  content_type TEXT,
+  ref_count INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Document versions, stored as ordered lists of content-defined chunks; the
+-- current version has no chunks and is the blob with its content_hash
+CREATE TABLE document_versions (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  document_id INTEGER NOT NULL,
+  version_number INTEGER NOT NULL,
+  content_hash TEXT NOT NULL,
+  file_size INTEGER NOT NULL,
+  chunks TEXT,
+  uploaded_by INTEGER,
+  change_notes TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (document_id) REFERENCES documents (id),
+  FOREIGN KEY (uploaded_by) REFERENCES users (id),
+  UNIQUE (document_id, version_number)
+);
+
+-- Chunks shared between document versions
+CREATE TABLE document_chunks (
+  hash TEXT PRIMARY KEY,
+  size INTEGER NOT NULL,
+  stored_size INTEGER NOT NULL,
+  compressed BOOLEAN NOT NULL DEFAULT 0,
+  ref_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Full-text index of document names, descriptions and extracted text (rowid = documents.id)
+CREATE VIRTUAL TABLE document_search USING fts5(
+  name, description, content,
+  tokenize = 'porter unicode61 remove_diacritics 2'
 );
 
 -- Document access
@@ -0,0 +1,272 @@
+"""
+Precomputed access control for users.
+
+A user's role permissions and the ids of the projects and clients they can
+reach are worked out once and cached, so permission checks while rendering
+a list are set lookups rather than a query or role lookup each, and list
+queries can filter by the same id sets. Cached entries are tagged with the
+user's acl_version, which every membership change bumps, so all workers see
+a change on the user's next request.
+
+Memberships are managed from the project page. backfill_project_members
+(the backfill-project-members command) adds them for existing task
+assignments and time entries.
+"""
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Roles that can see every project and every client
+ALL_PROJECTS_ROLES = ('admin', 'project_manager', 'accountant')
+ALL_CLIENTS_ROLES = ('admin', 'project_manager', 'accountant')
+# Roles that can edit every project, and roles that can edit the projects they're members of
+EDIT_ALL_PROJECTS_ROLES = ('admin', 'project_manager')
+EDIT_MEMBER_PROJECTS_ROLES = ('foreman',)
+ACCESS_CACHE_SIZE = 1000
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _connect(database):
+    conn = sqlite3.connect(database or current_app.config['DATABASE'], timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _ids(values):
+    """Ids as strings, so route arguments and database ids compare equal"""
+    return frozenset(str(value) for value in values if value is not None)
+
+class AccessControl:
+    """What one user can do; project_ids or client_ids of None mean all of them"""
+    __slots__ = ('user_id', 'role', 'permissions', 'project_ids', 'editable_project_ids', 'client_ids')
+
+    def __init__(self, user_id, role, permissions, project_ids=None, editable_project_ids=None, client_ids=None):
+        self.user_id = user_id
+        self.role = role
+        self.permissions = frozenset(permissions)
+        self.project_ids = project_ids
+        self.editable_project_ids = editable_project_ids
+        self.client_ids = client_ids
+
+    def has_permission(self, permission):
+        return permission in self.permissions
+
+    def can_access_project(self, project_id):
+        return self.project_ids is None or str(project_id) in self.project_ids
+
+    def can_edit_project(self, project_id):
+        return self.editable_project_ids is None or str(project_id) in self.editable_project_ids
+
+    def can_access_client(self, client_id):
+        return self.client_ids is None or str(client_id) in self.client_ids
+
+def _membership_based(role):
+    """Whether a role's access depends on which projects the user belongs to"""
+    return not (role in ALL_PROJECTS_ROLES and role in ALL_CLIENTS_ROLES and role in EDIT_ALL_PROJECTS_ROLES)
+
+def id_filter(ids):
+    """An id set as a JSON array, for `id IN (SELECT value FROM json_each(?))`"""
+    return json.dumps(sorted(ids))
+
+def build_access(user_id, role, permissions, database=None):
+    """Compute a user's access from their role and project memberships"""
+    if not _membership_based(role):
+        return AccessControl(user_id, role, permissions)
+
+    conn = _connect(database)
+    try:
+        project_ids = _ids(row[0] for row in conn.execute('''
+            SELECT project_id FROM project_members WHERE user_id = ?
+            UNION
+            SELECT id FROM projects WHERE created_by_id = ?
+        ''', (user_id, user_id)))
+        member_client_ids = _ids(row[0] for row in conn.execute(
+            "SELECT DISTINCT client_id FROM projects WHERE id IN (SELECT value FROM json_each(?))",
+            (id_filter(project_ids),)
+        ))
+    finally:
+        conn.close()
+
+    if role in EDIT_ALL_PROJECTS_ROLES:
+        editable = None
+    elif role in EDIT_MEMBER_PROJECTS_ROLES:
+        editable = project_ids
+    else:
+        editable = frozenset()
+    return AccessControl(
+        user_id, role, permissions,
+        project_ids=None if role in ALL_PROJECTS_ROLES else project_ids,
+        editable_project_ids=editable,
+        client_ids=None if role in ALL_CLIENTS_ROLES else member_client_ids
+    )
+
+def get_access(user_id, role, permissions, database=None):
+    """A user's access, from the cache unless their memberships changed since it was built"""
+    if user_id is None:
+        return AccessControl(None, role, permissions, frozenset(), frozenset(), frozenset())
+
+    # Access that doesn't depend on membership never goes stale
+    version = 0
+    if _membership_based(role):
+        conn = _connect(database)
+        try:
+            row = conn.execute("SELECT acl_version FROM users WHERE id = ?", (user_id,)).fetchone()
+        finally:
+            conn.close()
+        version = row[0] if row else 0
+
+    key = (str(user_id), role)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] == version and entry[1].permissions == frozenset(permissions):
+            _cache.move_to_end(key)
+            return entry[1]
+
+    access = build_access(user_id, role, permissions, database=database)
+    with _cache_lock:
+        _cache[key] = (version, access)
+        _cache.move_to_end(key)
+        while len(_cache) > ACCESS_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return access
+
+def invalidate_user_access(user_ids, database=None):
+    """Mark users' cached access stale after their memberships changed"""
+    user_ids = [str(user_id) for user_id in user_ids if user_id is not None]
+    if not user_ids:
+        return
+    conn = _connect(database)
+    try:
+        conn.execute(
+            "UPDATE users SET acl_version = acl_version + 1 WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(user_ids),)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] in user_ids]:
+            del _cache[key]
+
+def _project_user_ids(conn, project_id):
+    return [row[0] for row in conn.execute('''
+        SELECT user_id FROM project_members WHERE project_id = ?
+        UNION
+        SELECT created_by_id FROM projects WHERE id = ? AND created_by_id IS NOT NULL
+    ''', (project_id, project_id))]
+
+def invalidate_project_access(project_id, database=None):
+    """Mark stale the cached access of everyone on a project, e.g. after its client changed"""
+    conn = _connect(database)
+    try:
+        user_ids = _project_user_ids(conn, project_id)
+    finally:
+        conn.close()
+    invalidate_user_access(user_ids, database=database)
+
+def get_project_members(project_id, database=None):
+    """Members of a project with their project role"""
+    conn = _connect(database)
+    try:
+        rows = conn.execute('''
+            SELECT m.user_id, m.role, m.created_at, u.username, u.first_name, u.last_name
+            FROM project_members m
+            LEFT JOIN users u ON u.id = m.user_id
+            WHERE m.project_id = ?
+            ORDER BY u.last_name, u.first_name
+        ''', (project_id,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def add_project_member(project_id, user_id, role='member', database=None):
+    """Add a user to a project, or change their project role"""
+    conn = _connect(database)
+    try:
+        conn.execute('''
+            INSERT INTO project_members (project_id, user_id, role) VALUES (?, ?, ?)
+            ON CONFLICT(project_id, user_id) DO UPDATE SET role = excluded.role
+        ''', (project_id, user_id, role))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_user_access([user_id], database=database)
+
+def remove_project_member(project_id, user_id, database=None):
+    """Remove a user from a project"""
+    conn = _connect(database)
+    try:
+        conn.execute(
+            "DELETE FROM project_members WHERE project_id = ? AND user_id = ?", (project_id, user_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_user_access([user_id], database=database)
+
+def get_member_candidates(project_id, database=None):
+    """Users who aren't members of a project yet, to offer when adding members"""
+    conn = _connect(database)
+    try:
+        rows = conn.execute('''
+            SELECT id, username, first_name, last_name, role FROM users
+            WHERE id NOT IN (SELECT user_id FROM project_members WHERE project_id = ?)
+            ORDER BY last_name, first_name, username
+        ''', (project_id,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def backfill_project_members(database=None):
+    """Make users members of the projects they're assigned tasks on or log time to
+
+    Returns the number of memberships added. Existing memberships and their
+    project roles are left alone.
+    """
+    conn = _connect(database)
+    try:
+        added = conn.execute('''
+            INSERT OR IGNORE INTO project_members (project_id, user_id)
+            SELECT project_id, assigned_to_id FROM tasks
+            WHERE project_id IS NOT NULL AND assigned_to_id IS NOT NULL
+            UNION
+            SELECT project_id, user_id FROM time_entries WHERE project_id IS NOT NULL
+        ''').rowcount
+        if added:
+            conn.execute("UPDATE users SET acl_version = acl_version + 1")
+        conn.commit()
+    finally:
+        conn.close()
+    clear_cache()
+    return added
+
+def remove_project(project_id, database=None):
+    """Drop a deleted project's memberships"""
+    conn = _connect(database)
+    try:
+        user_ids = _project_user_ids(conn, project_id)
+        conn.execute("DELETE FROM project_members WHERE project_id = ?", (project_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_user_access(user_ids, database=database)
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+@click.command('backfill-project-members')
+@with_appcontext
+def backfill_project_members_command():
+    """Add project memberships from existing task assignments and time entries."""
+    added = backfill_project_members()
+    click.echo(f"Added {added} project memberships.")
+
+def init_app(app):
+    """Register the membership backfill command with the Flask app."""
+    app.cli.add_command(backfill_project_members_command)
@@ -0,0 +1,347 @@
+"""
+Bid edits: line item changes and bid versions.
+
+Adding, changing or removing a line item adjusts the bid's cost columns by
+the change in that item's price, in the same transaction, rather than
+re-reading and re-summing every item. Bid versions are stored as diffs
+against the previous version (line items diffed per item), with a full
+snapshot every BID_VERSION_SNAPSHOT_INTERVAL versions, so any version is
+rebuilt from its nearest snapshot plus at most N-1 diffs.
+
+The functions here take an open connection and leave committing to the
+caller, so an edit and the version recording it are one transaction.
+"""
+import json
+from datetime import datetime
+
+# Bid item types roll up into these bid cost columns; any other type is overhead
+ITEM_COST_COLUMNS = {
+    'Labor': 'labor_cost',
+    'Material': 'material_cost'
+}
+OTHER_COST_COLUMN = 'overhead_cost'
+
+# Every Nth bid version is stored as a full snapshot; the versions in between
+# are stored as diffs against the previous version, so reconstructing any
+# version replays at most N-1 diffs
+BID_VERSION_SNAPSHOT_INTERVAL = 10
+
+# Bid item columns that may be changed by an item update
+BID_ITEM_FIELDS = (
+    'item_type', 'category', 'description', 'quantity', 'unit', 'unit_cost',
+    'total_cost', 'markup_percentage', 'markup_amount', 'total_price', 'notes', 'sort_order'
+)
+PRICING_FIELDS = ('quantity', 'unit_cost', 'markup_percentage')
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def price_bid_item(item_data):
+    """Fill in total_cost, markup_amount and total_price from quantity, unit cost and markup"""
+    quantity = float(item_data.get('quantity', 1) or 0)
+    unit_cost = float(item_data.get('unit_cost') or 0)
+    markup_percentage = float(item_data.get('markup_percentage') or 0)
+
+    total_cost = quantity * unit_cost
+    markup_amount = total_cost * markup_percentage / 100
+
+    item_data['total_cost'] = total_cost
+    item_data['markup_amount'] = markup_amount
+    item_data['total_price'] = total_cost + markup_amount
+    return item_data
+
+def apply_item_delta(conn, bid_id, old_item=None, new_item=None):
+    """Adjust bid totals by the difference an item change makes, without re-reading items"""
+    deltas = {}
+    if old_item:
+        column = ITEM_COST_COLUMNS.get(old_item['item_type'], OTHER_COST_COLUMN)
+        deltas[column] = deltas.get(column, 0) - float(old_item['total_price'] or 0)
+    if new_item:
+        column = ITEM_COST_COLUMNS.get(new_item.get('item_type', 'Labor'), OTHER_COST_COLUMN)
+        deltas[column] = deltas.get(column, 0) + float(new_item.get('total_price') or 0)
+
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # Column names come from ITEM_COST_COLUMNS/OTHER_COST_COLUMN, never from input
+    assignments = ', '.join(f"{column} = COALESCE({column}, 0) + ?" for column in deltas)
+    params = list(deltas.values())
+    params.extend([sum(deltas.values()), _now(), bid_id])
+    conn.execute(
+        f"UPDATE bids SET {assignments}, total_amount = COALESCE(total_amount, 0) + ?, updated_at = ? WHERE id = ?",
+        params
+    )
+
+def add_item(conn, bid_id, item_data):
+    """Insert an item and add its price to the bid totals; returns the item id"""
+    item_data = {field: item_data[field] for field in BID_ITEM_FIELDS if field in item_data}
+    item_data['bid_id'] = bid_id
+    if item_data.get('total_price') is None:
+        price_bid_item(item_data)
+
+    cursor = conn.execute('''
+        INSERT INTO bid_items (
+            bid_id, item_type, category, description, quantity, unit,
+            unit_cost, total_cost, markup_percentage, markup_amount,
+            total_price, notes, sort_order
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        bid_id,
+        item_data.get('item_type', 'Labor'),
+        item_data.get('category'),
+        item_data.get('description', ''),
+        item_data.get('quantity', 1),
+        item_data.get('unit', 'Hours'),
+        item_data.get('unit_cost', 0),
+        item_data.get('total_cost', 0),
+        item_data.get('markup_percentage', 0),
+        item_data.get('markup_amount', 0),
+        item_data.get('total_price', 0),
+        item_data.get('notes'),
+        item_data.get('sort_order', 0)
+    ))
+    apply_item_delta(conn, bid_id, new_item=item_data)
+    return cursor.lastrowid
+
+def update_item(conn, old_item, item_data):
+    """Write the fields of item_data that differ from old_item and adjust the bid totals
+
+    Returns True if anything changed.
+    """
+    old_item = dict(old_item)
+    changes = {field: item_data[field] for field in BID_ITEM_FIELDS
+               if field in item_data and item_data[field] != old_item.get(field)}
+
+    # Re-price when the inputs changed but an explicit price was not given
+    if 'total_price' not in changes and any(field in changes for field in PRICING_FIELDS):
+        priced = price_bid_item(dict(old_item, **changes))
+        for field in ('total_cost', 'markup_amount', 'total_price'):
+            if priced[field] != old_item.get(field):
+                changes[field] = priced[field]
+
+    if not changes:
+        return False
+
+    assignments = ', '.join(f"{field} = ?" for field in changes)
+    conn.execute(
+        f"UPDATE bid_items SET {assignments}, updated_at = ? WHERE id = ?",
+        list(changes.values()) + [_now(), old_item['id']]
+    )
+    apply_item_delta(conn, old_item['bid_id'], old_item, dict(old_item, **changes))
+    return True
+
+def delete_item(conn, old_item):
+    """Delete an item and subtract its price from the bid totals"""
+    conn.execute("DELETE FROM bid_items WHERE id = ?", (old_item['id'],))
+    apply_item_delta(conn, old_item['bid_id'], old_item=old_item)
+
+def _item_key(item_id):
+    """An existing item's id as an int; None for ids the browser made up for new rows ("new_...")"""
+    try:
+        return int(item_id)
+    except (TypeError, ValueError):
+        return None
+
+def sync_items(conn, bid_id, items_data):
+    """Make a bid's items match items_data, writing only the items that changed
+
+    Items whose id is one of the bid's are updated, items without one are
+    added, and the bid's items missing from items_data are deleted; each
+    adjusts the totals by its own delta. Returns (added, updated, deleted).
+    """
+    existing = {row['id']: row for row in conn.execute(
+        "SELECT * FROM bid_items WHERE bid_id = ?", (bid_id,)
+    ).fetchall()}
+
+    added = updated = 0
+    kept = set()
+    for item_data in items_data:
+        key = _item_key(item_data.get('id'))
+        if key in existing:
+            kept.add(key)
+            updated += update_item(conn, existing[key], item_data)
+        else:
+            add_item(conn, bid_id, item_data)
+            added += 1
+
+    removed = [row for key, row in existing.items() if key not in kept]
+    for row in removed:
+        delete_item(conn, row)
+    return added, updated, len(removed)
+
+def _diff_bid_items(old_items, new_items):
+    """Diff two item lists keyed by item id. Returns None if any item has no id."""
+    if any(item.get('id') is None for item in old_items + new_items):
+        return None
+
+    old_by_id = {str(item['id']): item for item in old_items}
+    new_ids = [str(item['id']) for item in new_items]
+    new_id_set = set(new_ids)
+
+    added = []
+    changed = {}
+    for item in new_items:
+        key = str(item['id'])
+        old = old_by_id.get(key)
+        if old is None:
+            added.append(item)
+        elif old != item:
+            changed[key] = {
+                'set': {field: value for field, value in item.items() if field not in old or old[field] != value},
+                'unset': [field for field in old if field not in item]
+            }
+    deleted = [item['id'] for item in old_items if str(item['id']) not in new_id_set]
+
+    diff = {}
+    if added:
+        diff['added'] = added
+    if changed:
+        diff['changed'] = changed
+    if deleted:
+        diff['deleted'] = deleted
+
+    # Only record the order when it differs from "old order, then new items"
+    expected_order = [key for key in old_by_id if key in new_id_set] + [str(item['id']) for item in added]
+    if expected_order != new_ids:
+        diff['order'] = [item['id'] for item in new_items]
+    return diff
+
+def _apply_bid_items_diff(items, diff):
+    """Apply a diff produced by _diff_bid_items"""
+    deleted = {str(item_id) for item_id in diff.get('deleted', [])}
+    changed = diff.get('changed', {})
+
+    result = []
+    for item in items:
+        key = str(item['id'])
+        if key in deleted:
+            continue
+        if key in changed:
+            item = {field: value for field, value in item.items() if field not in changed[key].get('unset', [])}
+            item.update(changed[key].get('set', {}))
+        result.append(item)
+    result.extend(diff.get('added', []))
+
+    if 'order' in diff:
+        by_id = {str(item['id']): item for item in result}
+        result = [by_id[str(item_id)] for item_id in diff['order']]
+    return result
+
+def diff_bid_data(old, new):
+    """Diff two bid snapshots; line items are diffed per item rather than stored whole"""
+    diff = {}
+    fields = {}
+    for key, value in new.items():
+        if key in old and old[key] == value:
+            continue
+        if key == 'items' and isinstance(old.get(key), list) and isinstance(value, list):
+            items_diff = _diff_bid_items(old[key], value)
+            if items_diff is not None:
+                diff['items'] = items_diff
+                continue
+        fields[key] = value
+
+    removed = [key for key in old if key not in new]
+    if fields:
+        diff['set'] = fields
+    if removed:
+        diff['unset'] = removed
+    return diff
+
+def apply_bid_diff(data, diff):
+    """Apply a diff produced by diff_bid_data"""
+    data = {key: value for key, value in data.items() if key not in diff.get('unset', [])}
+    data.update(diff.get('set', {}))
+    if 'items' in diff:
+        data['items'] = _apply_bid_items_diff(data.get('items', []), diff['items'])
+    return data
+
+def load_version_data(conn, bid_id, version_number):
+    """Reconstruct a version from the nearest snapshot and the diffs after it"""
+    snapshot = conn.execute(
+        """SELECT version_number, data FROM bid_versions
+           WHERE bid_id = ? AND version_number <= ? AND is_snapshot = 1
+           ORDER BY version_number DESC LIMIT 1""",
+        (bid_id, version_number)
+    ).fetchone()
+    if not snapshot:
+        return None
+
+    data = json.loads(snapshot['data'])
+    current_version = snapshot['version_number']
+
+    diffs = conn.execute(
+        """SELECT version_number, data FROM bid_versions
+           WHERE bid_id = ? AND version_number > ? AND version_number <= ?
+           ORDER BY version_number ASC""",
+        (bid_id, current_version, version_number)
+    ).fetchall()
+    for row in diffs:
+        if row['version_number'] != current_version + 1:
+            # A version in the chain is missing; the diff can't be applied
+            return None
+        data = apply_bid_diff(data, json.loads(row['data']))
+        current_version = row['version_number']
+
+    if current_version != version_number:
+        return None
+    return data
+
+def save_version(conn, bid_id, version_number, bid_data, created_by_id):
+    """Save a version of a bid
+
+    Stored as a diff against the previous version, except every
+    BID_VERSION_SNAPSHOT_INTERVAL versions (and when the previous version is
+    missing), which are stored as full snapshots.
+    """
+    # Round-trip through JSON so the diff compares like with like
+    bid_data = json.loads(json.dumps(bid_data))
+
+    previous = None
+    if (version_number - 1) % BID_VERSION_SNAPSHOT_INTERVAL != 0:
+        previous = load_version_data(conn, bid_id, version_number - 1)
+
+    if previous is None:
+        is_snapshot = 1
+        data = bid_data
+    else:
+        is_snapshot = 0
+        data = diff_bid_data(previous, bid_data)
+
+    cursor = conn.execute('''
+        INSERT INTO bid_versions (
+            bid_id, version_number, data, is_snapshot, created_by_id, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        bid_id,
+        version_number,
+        json.dumps(data, separators=(',', ':')),
+        is_snapshot,
+        created_by_id,
+        _now()
+    ))
+    return cursor.lastrowid
+
+def record_version(conn, bid_id, created_by_id=None, changes=None):
+    """Save the bid as it now stands, with its items, as its next version
+
+    changes are bid fields to record over the stored row, for edits saved
+    somewhere other than this database. Returns the version number, or None
+    if there is no such bid.
+    """
+    bid = conn.execute("SELECT * FROM bids WHERE id = ?", (bid_id,)).fetchone()
+    if not bid:
+        return None
+
+    data = dict(bid)
+    data.update(changes or {})
+    data['items'] = [dict(item) for item in conn.execute(
+        "SELECT * FROM bid_items WHERE bid_id = ? ORDER BY sort_order ASC, id ASC", (bid_id,)
+    ).fetchall()]
+
+    version_number = conn.execute(
+        "SELECT COALESCE(MAX(version_number), 0) + 1 FROM bid_versions WHERE bid_id = ?", (bid_id,)
+    ).fetchone()[0]
+    save_version(conn, bid_id, version_number, data, created_by_id)
+    return version_number
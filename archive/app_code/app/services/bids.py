@@ -11,6 +11,7 @@ from app.models.bid import Bid
 from app.models.bid_item import BidItem
 import uuid
 from app.services.supabase import supabase
+from app.services import bid_edits
 
 def get_db_connection():
     """Get a database connection"""
@@ -117,55 +118,87 @@ def delete_bid(bid_id):
         current_app.logger.error(f"Error deleting bid {bid_id}: {str(e)}")
         return False
 
-def _save_bid_item(conn, item_data):
-    """Save a bid item (helper function)"""
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO bid_items (
-            bid_id, item_type, category, description, quantity, unit, 
-            unit_cost, total_cost, markup_percentage, markup_amount, 
-            total_price, notes, sort_order
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        item_data.get('bid_id'),
-        item_data.get('item_type', 'Labor'),
-        item_data.get('category'),
-        item_data.get('description', ''),
-        item_data.get('quantity', 1),
-        item_data.get('unit', 'Hours'),
-        item_data.get('unit_cost', 0),
-        item_data.get('total_cost', 0),
-        item_data.get('markup_percentage', 0),
-        item_data.get('markup_amount', 0),
-        item_data.get('total_price', 0),
-        item_data.get('notes'),
-        item_data.get('sort_order', 0)
-    ))
+def add_bid_item(bid_id, item_data):
+    """Add an item to a bid and update the bid totals by its price"""
+    conn = get_db_connection()
+    item_id = bid_edits.add_item(conn, bid_id, item_data)
+    conn.commit()
+    conn.close()
     
-    return cursor.lastrowid
+    return item_id
 
-def _save_bid_version(conn, bid_id, version_number, bid_data, created_by_id):
-    """Save a version of a bid (helper function)"""
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO bid_versions (
-            bid_id, version_number, data, created_by_id, created_at
-        ) VALUES (?, ?, ?, ?, ?)
-    ''', (
-        bid_id,
-        version_number,
-        json.dumps(bid_data),
-        created_by_id,
-        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    ))
+def update_bid_item(item_id, item_data):
+    """Update a bid item and adjust the bid totals by the change in its price"""
+    conn = get_db_connection()
+    old_item = conn.execute("SELECT * FROM bid_items WHERE id = ?", (item_id,)).fetchone()
+    if not old_item:
+        conn.close()
+        return False
+    
+    if bid_edits.update_item(conn, old_item, item_data):
+        conn.commit()
+    conn.close()
+    return True
+
+def delete_bid_item(item_id):
+    """Delete a bid item and subtract its price from the bid totals"""
+    conn = get_db_connection()
+    old_item = conn.execute("SELECT * FROM bid_items WHERE id = ?", (item_id,)).fetchone()
+    if not old_item:
+        conn.close()
+        return False
+    
+    bid_edits.delete_item(conn, old_item)
+    conn.commit()
+    conn.close()
     
-    return cursor.lastrowid
+    return True
+
+def save_bid_items(bid_id, items_data, created_by_id=None):
+    """Save a bid's full item list from the item editor and record a version
+    
+    Only the items that were added, changed or removed are written, each
+    adjusting the totals by its own delta; the edit and its version are
+    committed together. Returns the new version number, or None if there is
+    no such bid.
+    """
+    conn = get_db_connection()
+    try:
+        bid_edits.sync_items(conn, bid_id, items_data)
+        version_number = bid_edits.record_version(conn, bid_id, created_by_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return version_number
+
+def save_bid_version(bid_id, created_by_id=None, changes=None):
+    """Record the bid as it now stands as its next version
+    
+    Bid details are saved through Supabase, so pass the saved fields as
+    changes to have them recorded over the local copy of the bid.
+    """
+    conn = get_db_connection()
+    try:
+        version_number = bid_edits.record_version(conn, bid_id, created_by_id, changes)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return version_number
 
 def get_bid_versions(bid_id):
-    """Get all versions of a bid"""
+    """Get all versions of a bid (without their data)"""
     conn = get_db_connection()
     versions = conn.execute(
-        """SELECT bv.*, u.name as created_by_name
+        """SELECT bv.id, bv.bid_id, bv.version_number, bv.is_snapshot, bv.created_by_id,
+                  bv.created_at, u.name as created_by_name
            FROM bid_versions bv
            LEFT JOIN users u ON bv.created_by_id = u.id
            WHERE bv.bid_id = ? 
@@ -177,37 +210,43 @@ def get_bid_versions(bid_id):
     return [dict(version) for version in versions]
 
 def get_bid_version_data(bid_id, version_number):
-    """Get a specific version of a bid"""
+    """Get a specific version of a bid, reconstructed to its full data"""
     conn = get_db_connection()
     version = conn.execute(
-        "SELECT * FROM bid_versions WHERE bid_id = ? AND version_number = ?", 
+        """SELECT id, bid_id, version_number, is_snapshot, created_by_id, created_at
+           FROM bid_versions WHERE bid_id = ? AND version_number = ?""", 
         (bid_id, version_number)
     ).fetchone()
-    conn.close()
     
-    if version:
-        version_dict = dict(version)
-        version_dict['data'] = json.loads(version_dict['data'])
-        return version_dict
-    return None
+    if not version:
+        conn.close()
+        return None
+    
+    version_dict = dict(version)
+    version_dict['data'] = bid_edits.load_version_data(conn, bid_id, version_number)
+    conn.close()
+    return version_dict
 
 def calculate_bid_totals(bid_id):
-    """Recalculate bid totals based on items"""
-    conn = get_db_connection()
-    items = get_bid_items(bid_id)
+    """Recalculate bid totals from all of its items
     
-    labor_cost = 0
-    material_cost = 0
-    other_cost = 0
-    
-    for item in items:
-        if item['item_type'] == 'Labor':
-            labor_cost += item['total_price']
-        elif item['item_type'] == 'Material':
-            material_cost += item['total_price']
-        else:
-            other_cost += item['total_price']
+    Item changes made through save_bid_items and add_bid_item/update_bid_item/
+    delete_bid_item keep the totals current incrementally; this full
+    recalculation is for repairing totals that have drifted.
+    """
+    conn = get_db_connection()
+    totals = conn.execute('''
+        SELECT
+            COALESCE(SUM(CASE WHEN item_type = 'Labor' THEN total_price END), 0) AS labor_cost,
+            COALESCE(SUM(CASE WHEN item_type = 'Material' THEN total_price END), 0) AS material_cost,
+            COALESCE(SUM(CASE WHEN item_type NOT IN ('Labor', 'Material') OR item_type IS NULL
+                              THEN total_price END), 0) AS other_cost
+        FROM bid_items WHERE bid_id = ?
+    ''', (bid_id,)).fetchone()
     
+    labor_cost = totals['labor_cost']
+    material_cost = totals['material_cost']
+    other_cost = totals['other_cost']
     total_amount = labor_cost + material_cost + other_cost
     
     # Update bid with calculated values
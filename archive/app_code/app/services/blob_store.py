@@ -0,0 +1,159 @@
+"""
+Content-addressed blob storage.
+
+Uploaded files are stored once per distinct content under the SHA-256 of
+their bytes, so the same COI, W-9 or plan set uploaded for several vendors
+or projects shares one file. The hash is computed while the upload is
+streamed to disk, and the blobs table counts the documents referencing each
+blob; a blob's file is removed when its last reference is released.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIRECTORY = 'blobs'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _blob_root(upload_folder=None):
+    return os.path.join(upload_folder or current_app.config['UPLOAD_FOLDER'], BLOB_DIRECTORY)
+
+def blob_relative_path(content_hash, extension=''):
+    """Path of a blob relative to the upload folder, fanned out by hash prefix"""
+    suffix = f".{extension.lower()}" if extension else ''
+    return os.path.join(BLOB_DIRECTORY, content_hash[:2], f"{content_hash}{suffix}")
+
+def _connect(database):
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _stream_to_temp(stream, directory):
+    """Copy a stream to a temp file in directory, hashing as it goes"""
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+def store_blob(stream, extension='', content_type=None, database=None, upload_folder=None):
+    """Store a stream's content and take a reference to it
+
+    Returns (blob, created): the blobs row as a dict and whether the bytes
+    were new. When the content was already stored, the upload is discarded
+    and the existing blob's reference count is incremented.
+    """
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    root = _blob_root(upload_folder)
+    os.makedirs(root, exist_ok=True)
+    temp_path, content_hash, size = _stream_to_temp(stream, root)
+
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        # Serialize writers so a blob can't be released while it's being re-referenced
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute("SELECT * FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+            if existing and os.path.exists(os.path.join(upload_folder, existing['path'])):
+                conn.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE hash = ?", (content_hash,))
+                created = False
+                os.remove(temp_path)
+            else:
+                path = blob_relative_path(content_hash, extension)
+                full_path = os.path.join(upload_folder, path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temp_path, full_path)
+                conn.execute('''
+                    INSERT INTO blobs (hash, path, size, content_type, ref_count)
+                    VALUES (?, ?, ?, ?, 1)
+                    ON CONFLICT(hash) DO UPDATE SET path = excluded.path, ref_count = ref_count + 1
+                ''', (content_hash, path, size, content_type))
+                created = True
+            blob = dict(conn.execute("SELECT * FROM blobs WHERE hash = ?", (content_hash,)).fetchone())
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    finally:
+        conn.close()
+
+    return blob, created
+
+def add_reference(content_hash, database=None):
+    """Take another reference to an existing blob; returns False if it doesn't exist"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        cursor = conn.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE hash = ?", (content_hash,))
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+def release_blob(content_hash, database=None, upload_folder=None):
+    """Drop a reference to a blob, deleting its file with the last reference
+
+    Returns True if the blob was deleted.
+    """
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = ? AND ref_count > 0",
+                (content_hash,)
+            )
+            blob = conn.execute(
+                "SELECT path FROM blobs WHERE hash = ? AND ref_count = 0", (content_hash,)
+            ).fetchone()
+            if blob:
+                conn.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+                # Delete while still holding the write lock, so a concurrent upload of
+                # the same content can't be written to this path and then removed
+                _delete_blob_files(upload_folder, blob['path'], content_hash)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return blob is not None
+
+def _delete_blob_files(upload_folder, path, content_hash):
+    """Remove a blob and any files derived from it (image thumbnails etc.)"""
+    directory = os.path.dirname(os.path.join(upload_folder, path))
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith(content_hash):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError as e:
+                logger.error(f"Error deleting blob file {filename}: {str(e)}")
+
+def get_blob(content_hash, database=None):
+    """Get a blob record by hash"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        row = conn.execute("SELECT * FROM blobs WHERE hash = ?", (content_hash,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
@@ -3,18 +3,27 @@ Mock clients service for testing.
 In a real application, this would handle client data operations.
 """
 from app.db import get_db
+from app.services.acl import id_filter
 
-def get_all_clients(limit=50, offset=0, search=None):
-    """Get all clients with optional filtering"""
+def get_all_clients(limit=50, offset=0, search=None, client_ids=None):
+    """Get all clients with optional filtering, limited to client_ids if given"""
     db = get_db()
     query = "SELECT * FROM clients"
     params = []
     
+    where_clauses = []
     if search:
-        query += " WHERE name LIKE ? OR contact_name LIKE ? OR email LIKE ?"
+        where_clauses.append("(name LIKE ? OR contact_name LIKE ? OR email LIKE ?)")
         search_term = f"%{search}%"
         params.extend([search_term, search_term, search_term])
     
+    if client_ids is not None:
+        where_clauses.append("id IN (SELECT value FROM json_each(?))")
+        params.append(id_filter(client_ids))
+    
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    
     query += " ORDER BY name LIMIT ? OFFSET ?"
     params.extend([limit, offset])
     
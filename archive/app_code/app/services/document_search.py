@@ -0,0 +1,266 @@
+"""
+Document content extraction and full-text search.
+
+Text is extracted from PDF, DOCX, XLSX and plain-text uploads in a background
+process pool and stored in an SQLite FTS5 index alongside the document's name
+and description. Searches are answered from the index with BM25 ranking and
+highlighted snippets instead of scanning documents.
+"""
+import html
+import logging
+import os
+import re
+import sqlite3
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:  # PDF text extraction is skipped without PyPDF2
+    PdfReader = None
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # XLSX text extraction is skipped without openpyxl
+    load_workbook = None
+
+logger = logging.getLogger(__name__)
+
+# Extracted text beyond this is not indexed
+MAX_INDEXED_CHARS = 2 * 1024 * 1024
+INDEX_WORKERS = int(os.getenv('DOCUMENT_INDEX_WORKERS', '2'))
+SNIPPET_TOKENS = 16
+
+# Column weights for bm25(): name, description, content
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+TEXT_EXTENSIONS = ('txt', 'csv', 'md', 'rtf')
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Private-use markers for snippet highlights, swapped for <mark> after escaping
+_HIGHLIGHT_START = '\ue000'
+_HIGHLIGHT_END = '\ue001'
+
+_executor = None
+
+def ensure_search_index(conn):
+    """Create the full-text index table if it doesn't exist"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS document_search USING fts5(
+            name, description, content,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+
+def _connect(database):
+    conn = sqlite3.connect(database, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _extract_pdf(file_path):
+    if PdfReader is None:
+        return ''
+    reader = PdfReader(file_path)
+    return '\n'.join(page.extract_text() or '' for page in reader.pages)
+
+def _extract_docx(file_path):
+    with zipfile.ZipFile(file_path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    paragraphs = []
+    for paragraph in root.iter(f'{WORD_NAMESPACE}p'):
+        paragraphs.append(''.join(node.text or '' for node in paragraph.iter(f'{WORD_NAMESPACE}t')))
+    return '\n'.join(p for p in paragraphs if p)
+
+def _extract_xlsx(file_path):
+    if load_workbook is None:
+        return ''
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        lines = []
+        for sheet in workbook.worksheets:
+            lines.append(sheet.title)
+            for row in sheet.iter_rows(values_only=True):
+                values = [str(value) for value in row if value is not None]
+                if values:
+                    lines.append(' '.join(values))
+        return '\n'.join(lines)
+    finally:
+        workbook.close()
+
+def _extract_text_file(file_path):
+    with open(file_path, encoding='utf-8', errors='replace') as f:
+        return f.read(MAX_INDEXED_CHARS)
+
+EXTRACTORS = {
+    'pdf': _extract_pdf,
+    'docx': _extract_docx,
+    'xlsx': _extract_xlsx,
+    **{extension: _extract_text_file for extension in TEXT_EXTENSIONS}
+}
+
+def extract_text(file_path):
+    """Extract the searchable text of a file, or '' for unsupported types"""
+    extension = file_path.rsplit('.', 1)[-1].lower()
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        return ''
+    return extractor(file_path)[:MAX_INDEXED_CHARS]
+
+def index_document(database, document_id, file_path=None, name=None, description=None):
+    """Extract a document's text and store it in the search index
+
+    Runs in a worker process. A missing or unreadable file is indexed by
+    name and description only.
+    """
+    content = ''
+    if file_path:
+        try:
+            content = extract_text(file_path)
+        except Exception as e:
+            logger.warning(f"Could not extract text from {file_path}: {str(e)}")
+
+    conn = _connect(database)
+    try:
+        with conn:
+            ensure_search_index(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO document_search (rowid, name, description, content) VALUES (?, ?, ?, ?)",
+                (document_id, name or '', description or '', content)
+            )
+    finally:
+        conn.close()
+    return len(content)
+
+def update_indexed_fields(document_id, name=None, description=None, database=None):
+    """Update the indexed name and description without re-extracting the file"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        with conn:
+            ensure_search_index(conn)
+            if name is not None:
+                conn.execute("UPDATE document_search SET name = ? WHERE rowid = ?", (name, document_id))
+            if description is not None:
+                conn.execute("UPDATE document_search SET description = ? WHERE rowid = ?", (description, document_id))
+    finally:
+        conn.close()
+
+def remove_from_index(document_id, database=None):
+    """Remove a document from the search index"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        with conn:
+            ensure_search_index(conn)
+            conn.execute("DELETE FROM document_search WHERE rowid = ?", (document_id,))
+    finally:
+        conn.close()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=INDEX_WORKERS)
+    return _executor
+
+def _log_result(document_id):
+    def callback(future):
+        error = future.exception()
+        if error:
+            logger.error(f"Error indexing document {document_id}: {str(error)}")
+    return callback
+
+def queue_document_indexing(document_id, file_path, name=None, description=None, database=None):
+    """Index a document in the background; returns the Future"""
+    database = database or current_app.config['DATABASE']
+    future = _get_executor().submit(index_document, database, document_id, file_path, name, description)
+    future.add_done_callback(_log_result(document_id))
+    return future
+
+def build_match_query(query):
+    """Turn user input into an FTS5 query: every word must match, the last as a prefix"""
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def _highlight(snippet):
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    escaped = html.escape(snippet or '')
+    return Markup(escaped.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>'))
+
+def search_documents(query, limit=50, offset=0, project_id=None, database=None):
+    """Ranked full-text search over document names, descriptions and contents
+
+    Returns document rows with 'score' (lower is better) and 'snippet', an
+    HTML-safe excerpt of the best matching column with the matches marked.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    sql = '''
+        SELECT d.*, c.name AS client_name, p.name AS project_name,
+               bm25(document_search, ?, ?, ?) AS score,
+               snippet(document_search, -1, ?, ?, '…', ?) AS snippet
+        FROM document_search
+        JOIN documents d ON d.id = document_search.rowid
+        LEFT JOIN clients c ON d.client_id = c.id
+        LEFT JOIN projects p ON d.project_id = p.id
+        WHERE document_search MATCH ?
+    '''
+    params = list(RANK_WEIGHTS) + [_HIGHLIGHT_START, _HIGHLIGHT_END, SNIPPET_TOKENS, match]
+    if project_id is not None:
+        sql += " AND d.project_id = ?"
+        params.append(project_id)
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        ensure_search_index(conn)
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['snippet'] = _highlight(result['snippet'])
+        results.append(result)
+    return results
+
+def resolve_upload_path(file_path):
+    """Absolute path of a stored document file"""
+    if os.path.isabs(file_path):
+        return file_path
+    if file_path.startswith('uploads/'):
+        file_path = file_path[8:]
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], file_path)
+
+@click.command('reindex-documents')
+@with_appcontext
+def reindex_documents_command():
+    """Rebuild the document search index from every stored document."""
+    database = current_app.config['DATABASE']
+    conn = _connect(database)
+    try:
+        documents = conn.execute("SELECT id, name, description, file_path FROM documents").fetchall()
+    finally:
+        conn.close()
+
+    futures = [
+        queue_document_indexing(d['id'], resolve_upload_path(d['file_path']), d['name'], d['description'], database)
+        for d in documents
+    ]
+    failed = sum(1 for future in futures if future.exception() is not None)
+    click.echo(f"Indexed {len(futures) - failed} documents, {failed} failed.")
+
+def init_app(app):
+    """Register the document index command with the Flask app."""
+    app.cli.add_command(reindex_documents_command)
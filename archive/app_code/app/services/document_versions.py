@@ -0,0 +1,362 @@
+"""
+Chunk-deduplicated document version storage.
+
+Each version of a document is split into content-defined chunks, so an edit
+to a drawing or spec only changes the chunks around the edit and the rest of
+the file lines up with chunks already stored for earlier versions. Chunks
+are stored once under their SHA-256 (zlib-compressed when that helps) and
+reference counted; a version is the ordered list of its chunk hashes and is
+reassembled from them on download.
+
+A document's current version is its content-addressed blob, which search,
+image derivatives and exports read directly, so it has no chunks. It is
+chunked by archive_version when a newer version replaces it, and the blob
+is released; no version is kept in both stores.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import zlib
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+CHUNK_DIRECTORY = 'chunks'
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+READ_SIZE = 1024 * 1024
+# Chunk references are taken and chunk files written this many chunks per transaction
+CHUNK_BATCH_SIZE = 64
+
+# Chunk boundaries fall where the bytes, mapped through a fixed table to 16
+# classes, spell out the anchor. The match is found with bytes.translate and
+# bytes.find, which run in C, and happens about once every 64 KB (16 ** 4).
+_CLASS_TABLE = bytes(hashlib.sha256(bytes([b])).digest()[0] & 0x0F for b in range(256))
+_ANCHOR = bytes([3, 14, 1, 5])
+
+def _connect(database):
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def split_chunks(stream, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE):
+    """Split a stream into content-defined chunks"""
+    buffer = b''
+    classes = b''
+    position = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - position < max_size:
+            data = stream.read(READ_SIZE)
+            eof = not data
+            buffer = buffer[position:] + data
+            classes = classes[position:] + data.translate(_CLASS_TABLE)
+            position = 0
+            continue
+
+        remaining = len(buffer) - position
+        if not remaining:
+            return
+        if remaining <= min_size:
+            end = len(buffer)
+        else:
+            limit = position + min(max_size, remaining)
+            anchor = classes.find(_ANCHOR, position + min_size - len(_ANCHOR), limit)
+            end = anchor + len(_ANCHOR) if anchor != -1 else limit
+        yield buffer[position:end]
+        position = end
+
+def _chunk_path(upload_folder, chunk_hash):
+    return os.path.join(upload_folder, CHUNK_DIRECTORY, chunk_hash[:2], chunk_hash)
+
+def _write_chunk(upload_folder, chunk_hash, data):
+    """Write a chunk file, compressed if that saves space; returns (size, compressed)"""
+    compressed = zlib.compress(data, 6)
+    is_compressed = len(compressed) < len(data) * 0.9
+    payload = compressed if is_compressed else data
+
+    path = _chunk_path(upload_folder, chunk_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+    return len(payload), is_compressed
+
+def _store_batch(conn, upload_folder, batch):
+    """Take a reference to each chunk in the batch, writing chunks not yet stored
+
+    The reference is taken in the same write transaction that checks for the
+    file, so a concurrent release can't delete a chunk that's being reused.
+    Returns the number of bytes written.
+    """
+    written = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for chunk_hash, data in batch:
+            row = conn.execute(
+                "SELECT hash FROM document_chunks WHERE hash = ?", (chunk_hash,)
+            ).fetchone()
+            if row and os.path.exists(_chunk_path(upload_folder, chunk_hash)):
+                conn.execute(
+                    "UPDATE document_chunks SET ref_count = ref_count + 1 WHERE hash = ?", (chunk_hash,)
+                )
+                continue
+            stored_size, compressed = _write_chunk(upload_folder, chunk_hash, data)
+            written += stored_size
+            conn.execute('''
+                INSERT INTO document_chunks (hash, size, stored_size, compressed, ref_count)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT(hash) DO UPDATE SET
+                    stored_size = excluded.stored_size,
+                    compressed = excluded.compressed,
+                    ref_count = ref_count + 1
+            ''', (chunk_hash, len(data), stored_size, compressed))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return written
+
+def _release_chunks(conn, upload_folder, chunk_hashes):
+    """Drop one reference per listed chunk, deleting chunks that are no longer used
+
+    Must be called inside a write transaction.
+    """
+    counts = {}
+    for chunk_hash in chunk_hashes:
+        counts[chunk_hash] = counts.get(chunk_hash, 0) + 1
+    conn.executemany(
+        "UPDATE document_chunks SET ref_count = MAX(ref_count - ?, 0) WHERE hash = ?",
+        [(count, chunk_hash) for chunk_hash, count in counts.items()]
+    )
+    unused = [
+        row['hash'] for row in conn.execute(
+            "SELECT hash FROM document_chunks WHERE ref_count = 0 AND hash IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(counts)),)
+        )
+    ]
+    for chunk_hash in unused:
+        conn.execute("DELETE FROM document_chunks WHERE hash = ?", (chunk_hash,))
+        try:
+            os.remove(_chunk_path(upload_folder, chunk_hash))
+        except FileNotFoundError:
+            pass
+    return len(unused)
+
+def _store_stream(conn, upload_folder, stream):
+    """Chunk a stream into the chunk store, taking a reference to every chunk
+
+    Returns (chunk_hashes, content_hash, file_size, bytes_written). If the
+    stream can't be stored completely, the references taken are given back.
+    """
+    content_hash = hashlib.sha256()
+    chunk_hashes = []
+    referenced = []
+    file_size = 0
+    bytes_written = 0
+    try:
+        batch = []
+        for data in split_chunks(stream):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            content_hash.update(data)
+            file_size += len(data)
+            chunk_hashes.append(chunk_hash)
+            batch.append((chunk_hash, data))
+            if len(batch) >= CHUNK_BATCH_SIZE:
+                bytes_written += _store_batch(conn, upload_folder, batch)
+                referenced.extend(h for h, _ in batch)
+                batch = []
+        if batch:
+            bytes_written += _store_batch(conn, upload_folder, batch)
+            referenced.extend(h for h, _ in batch)
+    except Exception:
+        _give_back(conn, upload_folder, referenced)
+        raise
+    return chunk_hashes, content_hash.hexdigest(), file_size, bytes_written
+
+def _give_back(conn, upload_folder, chunk_hashes):
+    """Release the references taken for chunks that ended up unused"""
+    if chunk_hashes:
+        conn.execute("BEGIN IMMEDIATE")
+        _release_chunks(conn, upload_folder, chunk_hashes)
+        conn.execute("COMMIT")
+
+def _insert_version(conn, document_id, content_hash, file_size, chunks, uploaded_by, change_notes):
+    """Add the next version row for a document; returns the row as a dict"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version_number = conn.execute(
+            "SELECT COALESCE(MAX(version_number), 0) + 1 FROM document_versions WHERE document_id = ?",
+            (document_id,)
+        ).fetchone()[0]
+        cursor = conn.execute('''
+            INSERT INTO document_versions (
+                document_id, version_number, content_hash, file_size,
+                chunks, uploaded_by, change_notes
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (document_id, version_number, content_hash, file_size, chunks, uploaded_by, change_notes))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return dict(conn.execute("SELECT * FROM document_versions WHERE id = ?", (cursor.lastrowid,)).fetchone())
+
+def save_version(document_id, stream, uploaded_by=None, change_notes=None, database=None, upload_folder=None):
+    """Store a new version of a document from a stream, as chunks
+
+    Returns the version record, including bytes_written: the bytes that
+    actually had to be stored after reusing chunks from earlier versions.
+    """
+    database = database or current_app.config['DATABASE']
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+
+    conn = _connect(database)
+    try:
+        chunk_hashes, content_hash, file_size, bytes_written = _store_stream(conn, upload_folder, stream)
+        try:
+            version = _insert_version(
+                conn, document_id, content_hash, file_size, json.dumps(chunk_hashes), uploaded_by, change_notes
+            )
+        except Exception:
+            _give_back(conn, upload_folder, chunk_hashes)
+            raise
+    finally:
+        conn.close()
+
+    version['bytes_written'] = bytes_written
+    return version
+
+def add_blob_version(document_id, content_hash, file_size, uploaded_by=None, change_notes=None, database=None):
+    """Record a document's new current version, whose content is the blob content_hash
+
+    The version has no chunks: its content is the document's blob, and the
+    reference to that blob belongs to the document. archive_version moves it
+    into the chunk store once a newer version replaces it.
+    """
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        return _insert_version(conn, document_id, content_hash, file_size, None, uploaded_by, change_notes)
+    finally:
+        conn.close()
+
+def archive_version(version, stream, database=None, upload_folder=None):
+    """Chunk a blob-backed version that is being replaced, so it no longer needs the blob
+
+    stream is the blob's content. Returns the bytes written, 0 if the
+    version was already stored as chunks.
+    """
+    if version['chunks'] is not None:
+        return 0
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        chunk_hashes, content_hash, _, bytes_written = _store_stream(conn, upload_folder, stream)
+        if content_hash != version['content_hash']:
+            _give_back(conn, upload_folder, chunk_hashes)
+            raise ValueError(f"Content of version {version['version_number']} doesn't match its hash")
+        updated = conn.execute(
+            "UPDATE document_versions SET chunks = ? WHERE id = ? AND chunks IS NULL",
+            (json.dumps(chunk_hashes), version['id'])
+        ).rowcount
+        if not updated:
+            # Archived concurrently; keep that copy
+            _give_back(conn, upload_folder, chunk_hashes)
+            return 0
+    finally:
+        conn.close()
+    return bytes_written
+
+def get_versions(document_id, database=None):
+    """Versions of a document, oldest first, without their chunk lists"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        rows = conn.execute('''
+            SELECT id, document_id, version_number, content_hash, file_size,
+                   uploaded_by, change_notes, created_at
+            FROM document_versions WHERE document_id = ?
+            ORDER BY version_number
+        ''', (document_id,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def get_version(document_id, version_number=None, database=None):
+    """A version record (the latest if version_number is None), or None"""
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        if version_number is None:
+            row = conn.execute(
+                "SELECT * FROM document_versions WHERE document_id = ? ORDER BY version_number DESC LIMIT 1",
+                (document_id,)
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT * FROM document_versions WHERE document_id = ? AND version_number = ?",
+                (document_id, version_number)
+            ).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def read_version(version, database=None, upload_folder=None):
+    """Reassemble a version's content, yielding it chunk by chunk
+
+    The current version of a document is read from its blob.
+    """
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        if version['chunks'] is None:
+            blob = conn.execute("SELECT path FROM blobs WHERE hash = ?", (version['content_hash'],)).fetchone()
+            if blob is None:
+                raise FileNotFoundError(f"Blob {version['content_hash']} not found")
+        else:
+            compressed = {
+                row['hash']: row['compressed'] for row in conn.execute(
+                    "SELECT hash, compressed FROM document_chunks WHERE hash IN (SELECT value FROM json_each(?))",
+                    (version['chunks'],)
+                )
+            }
+    finally:
+        conn.close()
+
+    if version['chunks'] is None:
+        with open(os.path.join(upload_folder, blob['path']), 'rb') as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    return
+                yield data
+
+    for chunk_hash in json.loads(version['chunks']):
+        with open(_chunk_path(upload_folder, chunk_hash), 'rb') as f:
+            data = f.read()
+        yield zlib.decompress(data) if compressed.get(chunk_hash) else data
+
+def delete_versions(document_id, database=None, upload_folder=None):
+    """Delete every version of a document, releasing its chunks; returns chunks deleted"""
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    conn = _connect(database or current_app.config['DATABASE'])
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            chunk_hashes = []
+            for row in conn.execute(
+                "SELECT chunks FROM document_versions WHERE document_id = ? AND chunks IS NOT NULL", (document_id,)
+            ):
+                chunk_hashes.extend(json.loads(row['chunks']))
+            conn.execute("DELETE FROM document_versions WHERE document_id = ?", (document_id,))
+            deleted = _release_chunks(conn, upload_folder, chunk_hashes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return deleted
@@ -1,5 +1,4 @@
 from app.services.supabase import supabase
-import uuid
 import os
 import mimetypes
 from datetime import datetime
@@ -7,6 +6,16 @@ from werkzeug.utils import secure_filename
 from flask import current_app
 import werkzeug
 from app.services.utils import generate_document_id, generate_folder_name
+from app.services.images import queue_image_processing, strip_metadata
+from app.services.blob_store import store_blob, release_blob
+from app.services.zip_export import file_entry
+from app.services.document_versions import (
+    save_version, add_blob_version, archive_version, get_version, delete_versions
+)
+from app.services.document_search import (
+    queue_document_indexing, update_indexed_fields, remove_from_index,
+    resolve_upload_path, search_documents
+)
 from app.db import get_db
 
 # File Storage Structure as defined in the JSON guide
@@ -28,6 +37,14 @@ ALLOWED_FILE_TYPES = {
     'presentations': ['ppt', 'pptx', 'odp']
 }
 
+# What a document can be uploaded for -> its documents column
+DOCUMENT_ENTITY_COLUMNS = {
+    'project': 'project_id',
+    'client': 'client_id',
+    'vendor': 'vendor_id',
+    'subcontractor': 'subcontractor_id'
+}
+
 # Maps file extensions to icon classes
 FILE_TYPE_ICONS = {
     # Images
@@ -172,24 +189,35 @@ def get_entity_documents(entity_type, entity_id):
     query = f"SELECT * FROM documents WHERE {entity_type}_id = ? ORDER BY created_at DESC"
     return db.execute(query, (entity_id,)).fetchall()
 
-def save_uploaded_file(file, directory):
-    """Save an uploaded file to disk"""
-    # Create a unique filename
+def save_uploaded_file(file):
+    """Save an uploaded file to content-addressed storage
+    
+    Identical content is stored once; uploading it again only adds a
+    reference to the existing blob. Photos have EXIF stripped before they
+    are hashed, since a stored blob is never rewritten.
+    """
     filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
+    extension = filename.rsplit('.', 1)[1] if '.' in filename else ''
+    content_type = file.content_type if hasattr(file, 'content_type') else None
+    
+    stream = strip_metadata(file.stream, extension)
+    blob, created = store_blob(stream, extension, content_type)
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], blob['path'])
     
-    # Save the file
-    file_path = os.path.join(directory, unique_filename)
-    file.save(file_path)
+    # Thumbnails and web-size copies are made in the background, once per blob
+    if created:
+        queue_image_processing(file_path)
     
     return {
         'original_name': filename,
-        'saved_name': unique_filename,
+        'saved_name': os.path.basename(blob['path']),
         'path': file_path,
-        'size': os.path.getsize(file_path),
-        'type': file.content_type if hasattr(file, 'content_type') else None
+        'size': blob['size'],
+        'type': content_type,
+        'content_hash': blob['hash'],
+        'deduplicated': not created
     }
-    
+
 def create_document(document_data):
     """Create a new document record"""
     db = get_db()
@@ -197,8 +225,8 @@ def create_document(document_data):
         """
         INSERT INTO documents 
         (name, file_path, file_type, file_size, project_id, client_id, 
-         description, version, created_by_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+         vendor_id, subcontractor_id, description, version, created_by_id, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             document_data['name'],
@@ -207,14 +235,116 @@ def create_document(document_data):
             document_data['file_size'],
             document_data.get('project_id'),
             document_data.get('client_id'),
+            document_data.get('vendor_id'),
+            document_data.get('subcontractor_id'),
             document_data.get('description'),
             document_data.get('version', '1.0'),
-            document_data.get('created_by_id')
+            document_data.get('created_by_id'),
+            document_data.get('content_hash')
         )
     )
     db.commit()
+    
+    # Text extraction and indexing happen in the background
+    queue_document_indexing(
+        cursor.lastrowid,
+        resolve_upload_path(document_data['file_path']),
+        document_data['name'],
+        document_data.get('description')
+    )
     return cursor.lastrowid
 
+def create_uploaded_document(file, entity_type, entity_id, description=None, created_by_id=None):
+    """Store an uploaded file and create its document for a project, client, vendor or subcontractor
+    
+    The stored blob is also recorded as the document's version 1. Returns
+    the new document's id. If the document can't be created, the reference
+    taken on the stored blob is released.
+    """
+    column = DOCUMENT_ENTITY_COLUMNS.get(entity_type)
+    if column is None:
+        raise ValueError(f"Unknown document entity type: {entity_type}")
+    
+    saved = save_uploaded_file(file)
+    try:
+        document_id = create_document({
+            'name': saved['original_name'],
+            'file_path': os.path.relpath(saved['path'], current_app.config['UPLOAD_FOLDER']),
+            'file_type': saved['type'],
+            'file_size': saved['size'],
+            column: entity_id,
+            'description': description,
+            'created_by_id': created_by_id,
+            'content_hash': saved['content_hash']
+        })
+    except Exception:
+        release_blob(saved['content_hash'])
+        raise
+    
+    # Downloads fall back to the blob for documents without versions, so a
+    # failure here doesn't lose the upload
+    try:
+        add_blob_version(document_id, saved['content_hash'], saved['size'],
+                         uploaded_by=created_by_id, change_notes='Original upload')
+    except Exception as e:
+        current_app.logger.error(f"Error recording version 1 of document {document_id}: {str(e)}")
+    
+    return document_id
+
+def add_document_version(document, file, uploaded_by=None, change_notes=None):
+    """Store an uploaded file as a document's new current version
+    
+    The document moves to the new file's blob, so search, image derivatives
+    and project exports follow the latest version. The version it replaces
+    is moved into the chunk store and its blob reference released. Returns
+    the new version record.
+    """
+    document_id = document['id']
+    previous_path = resolve_upload_path(document['file_path']) if document['file_path'] else None
+    
+    # Documents from before versions were kept get their original as version 1
+    previous = get_version(document_id)
+    if previous is None and previous_path and os.path.exists(previous_path):
+        with open(previous_path, 'rb') as f:
+            save_version(document_id, f, uploaded_by=document['created_by_id'], change_notes='Original upload')
+    
+    saved = save_uploaded_file(file)
+    try:
+        if previous is not None and previous['chunks'] is None:
+            with open(previous_path, 'rb') as f:
+                archive_version(previous, f)
+        version = add_blob_version(document_id, saved['content_hash'], saved['size'],
+                                   uploaded_by=uploaded_by, change_notes=change_notes)
+    except Exception:
+        release_blob(saved['content_hash'])
+        raise
+    
+    db = get_db()
+    db.execute(
+        """
+        UPDATE documents
+        SET file_path = ?, file_type = ?, file_size = ?, content_hash = ?, version = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """,
+        (
+            os.path.relpath(saved['path'], current_app.config['UPLOAD_FOLDER']),
+            saved['type'],
+            saved['size'],
+            saved['content_hash'],
+            f"{version['version_number']}.0",
+            document_id
+        )
+    )
+    db.commit()
+    
+    # The replaced blob and its derivatives go with its last reference
+    if document['content_hash']:
+        release_blob(document['content_hash'])
+    
+    queue_document_indexing(document_id, saved['path'], document['name'], document['description'])
+    return version
+
 def update_document(document_id, update_data):
     """Update document information"""
     db = get_db()
@@ -238,6 +368,9 @@ def update_document(document_id, update_data):
         params
     )
     db.commit()
+    
+    if 'name' in update_data or 'description' in update_data:
+        update_indexed_fields(document_id, update_data.get('name'), update_data.get('description'))
     return True
 
 def delete_document(document_id):
@@ -251,6 +384,13 @@ def delete_document(document_id):
     db = get_db()
     db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
     db.commit()
+    remove_from_index(document_id)
+    delete_versions(document_id)
+    
+    # Release the shared blob; its file goes with the last document using it
+    if document['content_hash']:
+        release_blob(document['content_hash'])
+        return True
     
     # Delete the file if it exists
     file_path = document['file_path']
@@ -325,22 +465,11 @@ def count_documents_by_entity(entity_type, entity_id=None):
         print(f"Error counting documents: {str(e)}")
         return 0
 
-def search_documents_by_content(query):
-    """Search documents by content (mock implementation)"""
-    # Note: In a real implementation, this would use a full-text search engine
-    # or a database with text search capabilities.
-    # For now, we'll just search in the name and description.
+def search_documents_by_content(query, limit=50, offset=0, project_id=None):
+    """Search document names, descriptions and extracted text, best matches first"""
     if not query:
         return []
-        
-    query = query.lower()
-    all_docs = get_all_documents()
-    
-    return [
-        doc for doc in all_docs 
-        if query in doc.get('name', '').lower() or 
-           query in doc.get('description', '').lower()
-    ]
+    return search_documents(query, limit=limit, offset=offset, project_id=project_id)
 
 def get_document_categories():
     """Get document category statistics"""
@@ -393,6 +522,57 @@ def check_file_exists(entity_type, entity_id, filename):
     file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], entity_type, str(entity_id), filename)
     return os.path.exists(file_path)
 
+def get_project_folder_name(project):
+    """Folder name for a project, following FOLDER_STRUCTURE['projectFolder']"""
+    from app.services.clients import get_client_by_id
+    
+    client = get_client_by_id(project['client_id']) if project.get('client_id') else None
+    customer_id = client.get('id', 'CUST-UNKNOWN') if client else 'CUST-UNKNOWN'
+    return generate_folder_name(customer_id, project.get('id', 'PROJ-UNKNOWN'), project.get('name', 'Unnamed Project'))
+
+def _unique_entry_name(name, used):
+    """Add a counter to a ZIP entry name that is already taken"""
+    if name not in used:
+        used.add(name)
+        return name
+    root, extension = os.path.splitext(name)
+    counter = 2
+    while f"{root} ({counter}){extension}" in used:
+        counter += 1
+    name = f"{root} ({counter}){extension}"
+    used.add(name)
+    return name
+
+def get_project_export_entries(project):
+    """ZIP entries for a project's document folder
+    
+    Files stored in the project's folder keep their place in it, including
+    the FOLDER_STRUCTURE subfolders, and the project's documents held
+    elsewhere (such as content-addressed blobs) are added under their
+    original names. Entries are produced lazily, one directory at a time.
+    """
+    folder_name = get_project_folder_name(project)
+    project_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'projects', folder_name)
+    used = set()
+    seen_paths = set()
+    
+    for directory, _, filenames in os.walk(project_folder):
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            relative = os.path.relpath(path, project_folder).replace(os.sep, '/')
+            seen_paths.add(os.path.realpath(path))
+            yield file_entry(_unique_entry_name(f"{folder_name}/{relative}", used), path)
+    
+    for document in get_entity_documents('project', project['id']):
+        if not document['file_path']:
+            continue
+        path = resolve_upload_path(document['file_path'])
+        if os.path.realpath(path) in seen_paths or not os.path.exists(path):
+            continue
+        seen_paths.add(os.path.realpath(path))
+        name = secure_filename(document['name']) or os.path.basename(path)
+        yield file_entry(_unique_entry_name(f"{folder_name}/{name}", used), path)
+
 def is_allowed_file(filename):
     """Check if the file type is allowed"""
     if '.' not in filename:
@@ -1,24 +1,153 @@
 """
-Mock email service for testing.
-In a real application, this would connect to an email service provider.
+Email service.
+
+Messages are sent over SMTP when SMTP_HOST is configured; otherwise sends are
+mocked and only logged. Bulk sends (month-end invoices, payment receipts)
+should go through queue_email(), which batches them over pooled connections
+with rate limiting and retries.
 """
 import os
+import threading
+from email.message import EmailMessage
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from dotenv import load_dotenv
 import smtplib
+import logging
 from datetime import datetime
+from app.services.mail_queue import SMTPConnectionPool, MailQueue, MailStatusStore
+
+logger = logging.getLogger("email_service")
 
 # Load environment variables
 load_dotenv()
 
+# SMTP configuration
+SMTP_HOST = os.getenv('SMTP_HOST')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', 'billing@akcllc.com')
+
+# Mail queue configuration
+MAIL_QUEUE_WORKERS = int(os.getenv('MAIL_QUEUE_WORKERS', '2'))
+MAIL_QUEUE_BATCH_SIZE = int(os.getenv('MAIL_QUEUE_BATCH_SIZE', '50'))
+MAIL_RATE_LIMIT = float(os.getenv('MAIL_RATE_LIMIT', '10'))  # messages per second
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', '5'))
+MAIL_STATUS_DB = os.getenv('MAIL_STATUS_DB', 'instance/email_messages.sqlite')
+
+_smtp_pool = None
+_mail_queue = None
+_init_lock = threading.Lock()
+
+def get_smtp_pool():
+    """Get the shared SMTP connection pool, or None if SMTP is not configured"""
+    global _smtp_pool
+    if not SMTP_HOST:
+        return None
+    with _init_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool(
+                SMTP_HOST,
+                SMTP_PORT,
+                username=SMTP_USERNAME,
+                password=SMTP_PASSWORD,
+                use_tls=SMTP_USE_TLS,
+                max_size=MAIL_QUEUE_WORKERS
+            )
+    return _smtp_pool
+
+def get_mail_queue():
+    """Get the shared outbound mail queue, starting it on first use"""
+    global _mail_queue
+    pool = get_smtp_pool()
+    if pool is None:
+        return None
+    with _init_lock:
+        if _mail_queue is None:
+            status_dir = os.path.dirname(MAIL_STATUS_DB)
+            if status_dir:
+                os.makedirs(status_dir, exist_ok=True)
+            _mail_queue = MailQueue(
+                pool,
+                store=MailStatusStore(MAIL_STATUS_DB),
+                workers=MAIL_QUEUE_WORKERS,
+                batch_size=MAIL_QUEUE_BATCH_SIZE,
+                rate_limit=MAIL_RATE_LIMIT,
+                max_attempts=MAIL_MAX_ATTEMPTS
+            )
+            _mail_queue.start()
+    return _mail_queue
+
+def build_message(to, subject, html_content, text_content=None, attachments=None, sender=None):
+    """Build a MIME message with HTML and plain-text bodies and optional attachments
+
+    Attachments may be a single {'filename', 'content', 'content_type'} dict, a
+    list of them, or raw PDF bytes.
+    """
+    message = EmailMessage()
+    message['From'] = sender or MAIL_DEFAULT_SENDER
+    message['To'] = to if isinstance(to, str) else ', '.join(to)
+    message['Subject'] = subject
+    message.set_content(text_content or 'This message requires an HTML-capable email client.')
+    message.add_alternative(html_content, subtype='html')
+
+    if attachments:
+        if isinstance(attachments, (bytes, bytearray)):
+            attachments = [{'filename': 'attachment.pdf', 'content': bytes(attachments)}]
+        elif isinstance(attachments, dict):
+            attachments = [attachments]
+        for attachment in attachments:
+            content_type = attachment.get('content_type', 'application/pdf')
+            maintype, subtype = content_type.split('/', 1)
+            message.add_attachment(
+                attachment['content'],
+                maintype=maintype,
+                subtype=subtype,
+                filename=attachment.get('filename', 'attachment')
+            )
+    return message
+
 def send_email(to, subject, html_content, text_content=None, attachments=None):
     """
-    Mock function to send an email
+    Send an email immediately over a pooled SMTP connection.
+    Falls back to a mock send when SMTP is not configured.
+    """
+    pool = get_smtp_pool()
+    if pool is None:
+        print(f"Mock: Email sent to {to} with subject '{subject}'")
+        return True
+
+    message = build_message(to, subject, html_content, text_content, attachments)
+    try:
+        with pool.connection() as conn:
+            conn.send(message)
+        return True
+    except Exception as e:
+        logger.error(f"Error sending email to {to}: {str(e)}")
+        return False
+
+def queue_email(to, subject, html_content, text_content=None, attachments=None):
+    """
+    Queue an email for batched delivery and return its message id.
+    Sends immediately (mocked) and returns None when SMTP is not configured.
     """
-    print(f"Mock: Email sent to {to} with subject '{subject}'")
-    return True
+    mail_queue = get_mail_queue()
+    if mail_queue is None:
+        send_email(to, subject, html_content, text_content, attachments)
+        return None
+
+    message = build_message(to, subject, html_content, text_content, attachments)
+    return mail_queue.enqueue(message)
+
+def get_email_status(message_id):
+    """Get the delivery status of a queued email"""
+    mail_queue = get_mail_queue()
+    if mail_queue is None or not message_id:
+        return None
+    return mail_queue.status(message_id)
 
 def send_document_share_email(recipient_email, document_name, download_link, sender_name, message=None):
     """
@@ -37,11 +166,9 @@ def send_document_share_email(recipient_email, document_name, download_link, sen
     """
     return send_email(recipient_email, subject, html_content)
 
-def send_invoice_email(recipient_email, invoice_data, pdf_attachment=None):
-    """
-    Mock function to send an invoice email
-    """
-    subject = f"Invoice #{invoice_data.get('invoice_number', 'Unknown')} from AKC LLC Construction"
+def _invoice_email_content(invoice_data, subject=None):
+    """Build the subject and HTML body for an invoice email"""
+    subject = subject or f"Invoice #{invoice_data.get('invoice_number', 'Unknown')} from AKC LLC Construction"
     html_content = f"""
     <html>
     <body>
@@ -51,12 +178,10 @@ def send_invoice_email(recipient_email, invoice_data, pdf_attachment=None):
     </body>
     </html>
     """
-    return send_email(recipient_email, subject, html_content, attachments=pdf_attachment)
+    return subject, html_content
 
-def send_payment_receipt_email(recipient_email, payment_data, invoice_data):
-    """
-    Mock function to send a payment receipt email
-    """
+def _payment_receipt_email_content(payment_data, invoice_data):
+    """Build the subject and HTML body for a payment receipt email"""
     subject = f"Payment Receipt for Invoice #{invoice_data.get('invoice_number', 'Unknown')}"
     html_content = f"""
     <html>
@@ -69,8 +194,36 @@ def send_payment_receipt_email(recipient_email, payment_data, invoice_data):
     </body>
     </html>
     """
+    return subject, html_content
+
+def send_invoice_email(recipient_email, invoice_data, pdf_attachment=None):
+    """
+    Send an invoice email
+    """
+    subject, html_content = _invoice_email_content(invoice_data)
+    return send_email(recipient_email, subject, html_content, attachments=pdf_attachment)
+
+def queue_invoice_email(recipient_email, invoice_data, pdf_attachment=None, subject=None):
+    """
+    Queue an invoice email (or, with subject, a reminder) for batched delivery; returns the message id
+    """
+    subject, html_content = _invoice_email_content(invoice_data, subject)
+    return queue_email(recipient_email, subject, html_content, attachments=pdf_attachment)
+
+def send_payment_receipt_email(recipient_email, payment_data, invoice_data):
+    """
+    Send a payment receipt email
+    """
+    subject, html_content = _payment_receipt_email_content(payment_data, invoice_data)
     return send_email(recipient_email, subject, html_content)
 
+def queue_payment_receipt_email(recipient_email, payment_data, invoice_data):
+    """
+    Queue a payment receipt email for batched delivery; returns the message id
+    """
+    subject, html_content = _payment_receipt_email_content(payment_data, invoice_data)
+    return queue_email(recipient_email, subject, html_content)
+
 def send_project_update_email(to, project, update_type, update_details=None):
     """
     Mock function to send a project update email
@@ -0,0 +1,326 @@
+"""
+Image derivative service functions.
+
+Uploaded photos are resized into a thumbnail and a web-sized copy, re-encoded
+as WebP with EXIF (including GPS location) removed, so pages and the mobile
+viewer can load a size that fits the screen instead of the camera original.
+Processing runs in a process pool so uploads don't wait on image encoding.
+
+Originals are stored content-addressed and never rewritten, so EXIF is
+stripped from an upload by strip_metadata before it is hashed and stored.
+That happens on the request, so it rewrites the file's metadata segments
+rather than decoding the image.
+"""
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it originals are served as-is
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Derivative name -> longest edge in pixels
+IMAGE_DERIVATIVES = {
+    'thumb': 320,
+    'web': 1600
+}
+DERIVATIVE_FORMAT = 'webp'
+DERIVATIVE_QUALITY = {
+    'thumb': 70,
+    'web': 80
+}
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# Stripped uploads are kept in memory up to this size, then spill to disk
+STRIP_SPOOL_SIZE = 8 * 1024 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION_TAG = 0x0112
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Text chunks that carry XMP or raw EXIF in a PNG
+PNG_METADATA_KEYWORDS = (b'XML:com.adobe.xmp', b'Raw profile type exif', b'Raw profile type APP1')
+
+_executor = None
+
+def is_image_file(file_path):
+    """Check whether a file is an image type we make derivatives for"""
+    return file_path.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+def derivative_path(file_path, size):
+    """Path of a derivative, stored next to the original"""
+    root, _ = os.path.splitext(file_path)
+    return f"{root}.{size}.{DERIVATIVE_FORMAT}"
+
+def _prepare(image):
+    """Apply the EXIF orientation and convert to a mode WebP can store"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+def _exif_orientation(exif):
+    """The Orientation tag of TIFF-layout EXIF data, or 1 if it has none"""
+    if exif.startswith(EXIF_HEADER):
+        exif = exif[len(EXIF_HEADER):]
+    byte_order = {b'II': '<', b'MM': '>'}.get(exif[:2])
+    if byte_order is None:
+        return 1
+    try:
+        ifd, = struct.unpack(byte_order + 'I', exif[4:8])
+        count, = struct.unpack(byte_order + 'H', exif[ifd:ifd + 2])
+        for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+            tag, kind = struct.unpack(byte_order + 'HH', exif[entry:entry + 4])
+            if tag == ORIENTATION_TAG and kind == 3:
+                orientation, = struct.unpack(byte_order + 'H', exif[entry + 8:entry + 10])
+                return orientation if 1 <= orientation <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+def _orientation_exif(orientation):
+    """TIFF-layout EXIF holding nothing but the orientation"""
+    return b'MM\x00\x2a' + struct.pack('>IHHHIHHI', 8, 1, ORIENTATION_TAG, 3, 1, orientation, 0, 0)
+
+def _jpeg_pieces(stream, start):
+    """A JPEG without its APP1 (EXIF, XMP) and APP13 (IPTC) segments"""
+    pieces = [b'\xff\xd8']
+    insert_at = 1
+    orientation = 1
+    dropped = False
+    position = start + 2
+    while True:
+        stream.seek(position)
+        header = stream.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        length, = struct.unpack('>H', header[2:])
+        if length < 2:
+            return None
+        if marker == 0xDA:
+            # Start of scan: the compressed image data follows, copied as-is
+            pieces.append((position, None))
+            break
+        if marker in (0xE1, 0xED):
+            data = stream.read(length - 2)
+            if marker == 0xE1 and data.startswith(EXIF_HEADER):
+                orientation = _exif_orientation(data)
+            dropped = True
+        else:
+            if marker == 0xE0 and len(pieces) == 1:
+                # EXIF goes after a JFIF header
+                insert_at = 2
+            pieces.append((position, length + 2))
+        position += length + 2
+
+    if not dropped:
+        return None
+    if orientation != 1:
+        exif = EXIF_HEADER + _orientation_exif(orientation)
+        pieces.insert(insert_at, b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif)
+    return pieces
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def _png_pieces(stream, start):
+    """A PNG without its eXIf chunk and XMP or raw EXIF text chunks"""
+    pieces = [PNG_SIGNATURE]
+    orientation = 1
+    dropped = False
+    position = start + len(PNG_SIGNATURE)
+    while True:
+        stream.seek(position)
+        header = stream.read(8)
+        if len(header) < 8:
+            return None
+        length, kind = struct.unpack('>I4s', header)
+        if kind == b'eXIf':
+            orientation = _exif_orientation(stream.read(length))
+            dropped = True
+        elif kind in (b'tEXt', b'zTXt', b'iTXt') and stream.read(80).split(b'\x00', 1)[0] in PNG_METADATA_KEYWORDS:
+            dropped = True
+        else:
+            pieces.append((position, length + 12))
+        position += length + 12
+        if kind == b'IEND':
+            break
+
+    if not dropped:
+        return None
+    if orientation != 1:
+        # After IHDR, which must come first
+        pieces.insert(2, _png_chunk(b'eXIf', _orientation_exif(orientation)))
+    return pieces
+
+def _webp_pieces(stream, start):
+    """A WebP without its EXIF and XMP chunks"""
+    stream.seek(start)
+    header = stream.read(12)
+    if len(header) < 12 or header[8:] != b'WEBP':
+        return None
+    end = start + 8 + struct.unpack('<I', header[4:8])[0]
+    pieces = []
+    vp8x = None
+    orientation = 1
+    dropped = set()
+    position = start + 12
+    while position + 8 <= end:
+        stream.seek(position)
+        kind, size = struct.unpack('<4sI', stream.read(8))
+        if kind == b'EXIF':
+            orientation = _exif_orientation(stream.read(size))
+            dropped.add(kind)
+        elif kind == b'XMP ':
+            dropped.add(kind)
+        elif kind == b'VP8X':
+            vp8x = bytearray(stream.read(size))
+            pieces.append(vp8x)
+        else:
+            pieces.append((position, 8 + size + (size & 1)))
+        position += 8 + size + (size & 1)
+
+    if not dropped or vp8x is None:
+        return None
+    vp8x[:0] = b'VP8X' + struct.pack('<I', len(vp8x))
+    # The extended header flags which metadata chunks are present
+    if b'XMP ' in dropped:
+        vp8x[8] &= ~0x04
+    if orientation != 1:
+        exif = _orientation_exif(orientation)
+        pieces.append(b'EXIF' + struct.pack('<I', len(exif)) + exif)
+    else:
+        vp8x[8] &= ~0x08
+    size = 4 + sum(len(piece) if isinstance(piece, (bytes, bytearray)) else piece[1] for piece in pieces)
+    return [b'RIFF' + struct.pack('<I', size) + b'WEBP'] + pieces
+
+def _write_pieces(stream, pieces):
+    """Write byte strings and (offset, length) ranges of the stream to a new file"""
+    stripped = tempfile.SpooledTemporaryFile(max_size=STRIP_SPOOL_SIZE)
+    for piece in pieces:
+        if isinstance(piece, (bytes, bytearray)):
+            stripped.write(piece)
+            continue
+        offset, length = piece
+        stream.seek(offset)
+        if length is None:
+            shutil.copyfileobj(stream, stripped)
+            continue
+        while length > 0:
+            block = stream.read(min(length, COPY_BLOCK_SIZE))
+            if not block:
+                break
+            stripped.write(block)
+            length -= len(block)
+    stripped.seek(0)
+    return stripped
+
+def strip_metadata(stream, extension):
+    """The upload to store for an image: a copy without EXIF if it has any
+
+    The metadata segments (EXIF, XMP and IPTC) are dropped and the rest of
+    the file is copied byte for byte, so the image is never decoded or
+    re-encoded. Only the orientation survives, in an EXIF block of its own,
+    so the photo still displays upright. Returns the stream itself, rewound,
+    for anything that isn't a JPEG, PNG or WebP carrying such metadata.
+    """
+    if extension.lower() not in IMAGE_EXTENSIONS:
+        return stream
+
+    start = stream.tell()
+    signature = stream.read(12)
+    pieces = None
+    try:
+        if signature.startswith(b'\xff\xd8'):
+            pieces = _jpeg_pieces(stream, start)
+        elif signature.startswith(PNG_SIGNATURE):
+            pieces = _png_pieces(stream, start)
+        elif signature.startswith(b'RIFF') and signature[8:] == b'WEBP':
+            pieces = _webp_pieces(stream, start)
+    except struct.error:
+        # Truncated or malformed; store it as uploaded
+        pieces = None
+
+    if pieces is None:
+        stream.seek(start)
+        return stream
+    return _write_pieces(stream, pieces)
+
+def process_image(file_path):
+    """Create the derivatives for an image
+
+    Runs in a worker process. The original is only read. Returns a dict of
+    derivative name -> path.
+    """
+    if Image is None:
+        return {}
+
+    derivatives = {}
+    with Image.open(file_path) as original:
+        image = _prepare(original)
+
+    for size, max_edge in IMAGE_DERIVATIVES.items():
+        derivative = image.copy()
+        derivative.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        path = derivative_path(file_path, size)
+        derivative.save(path, DERIVATIVE_FORMAT.upper(), quality=DERIVATIVE_QUALITY[size], method=4)
+        derivatives[size] = path
+
+    return derivatives
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+def _log_result(file_path):
+    def callback(future):
+        error = future.exception()
+        if error:
+            logger.error(f"Error processing image {file_path}: {str(error)}")
+    return callback
+
+def queue_image_processing(file_path):
+    """Process an uploaded image in the background; returns the Future, or None"""
+    if Image is None:
+        logger.warning("Pillow is not installed; image derivatives are disabled")
+        return None
+    if not is_image_file(file_path):
+        return None
+
+    future = _get_executor().submit(process_image, file_path)
+    future.add_done_callback(_log_result(file_path))
+    return future
+
+def best_image_path(file_path, size=None):
+    """The derivative to serve for a requested size, falling back to the original
+
+    size is a derivative name or a width in pixels; a width picks the
+    smallest derivative at least that wide. Derivatives that haven't been
+    generated yet fall back to the next larger size, then the original.
+    """
+    if not size or not is_image_file(file_path):
+        return file_path
+
+    if str(size).isdigit():
+        width = int(size)
+    elif size in IMAGE_DERIVATIVES:
+        width = IMAGE_DERIVATIVES[size]
+    else:
+        return file_path
+
+    candidates = sorted((edge, name) for name, edge in IMAGE_DERIVATIVES.items() if edge >= width)
+    for _, name in candidates:
+        path = derivative_path(file_path, name)
+        if os.path.exists(path):
+            return path
+    return file_path
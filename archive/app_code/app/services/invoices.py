@@ -389,50 +389,84 @@ def get_invoice_payments(invoice_id):
     
     return [dict(payment) for payment in payments]
 
+def _apply_payment_amount(conn, invoice_id, amount):
+    """Add amount (negative to reverse) to an invoice's running payment total
+    
+    A single UPDATE so concurrent payments can't lose each other's writes;
+    balance, status and paid date follow the same rules as
+    recalculate_invoice_totals.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    conn.execute('''
+        UPDATE invoices SET
+            amount_paid = amount_paid + :amount,
+            balance_due = total_amount - (amount_paid + :amount),
+            status = CASE
+                WHEN status = 'Draft' THEN status
+                WHEN total_amount - (amount_paid + :amount) <= 0 THEN 'Paid'
+                WHEN amount_paid + :amount > 0 THEN 'Partially Paid'
+                WHEN due_date < :today THEN 'Overdue'
+                WHEN status IN ('Paid', 'Partially Paid') THEN 'Sent'
+                ELSE status
+            END,
+            paid_date = CASE
+                WHEN status != 'Draft' AND total_amount - (amount_paid + :amount) <= 0
+                    THEN COALESCE(paid_date, :today)
+                WHEN total_amount - (amount_paid + :amount) > 0 THEN NULL
+                ELSE paid_date
+            END,
+            updated_at = :now
+        WHERE id = :invoice_id
+    ''', {
+        'amount': amount,
+        'today': today,
+        'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'invoice_id': invoice_id
+    })
+
 def record_payment(payment_data):
-    """Record a payment for an invoice"""
+    """Record a payment for an invoice
+    
+    If payment_data has an idempotency_key that was already used, the
+    original payment's id is returned and nothing is applied again.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    invoice_id = payment_data.get('invoice_id')
+    amount = float(payment_data.get('amount', 0))
+    idempotency_key = payment_data.get('idempotency_key') or None
     
-    # Insert the payment
+    # Insert the payment; a repeated idempotency key hits the unique index and is ignored
     cursor.execute('''
-        INSERT INTO payments (
+        INSERT OR IGNORE INTO payments (
             invoice_id, amount, payment_date, payment_method,
-            reference_number, notes, created_by_id, created_at, updated_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            reference_number, notes, idempotency_key, created_by_id, created_at, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
-        payment_data.get('invoice_id'),
-        payment_data.get('amount', 0),
+        invoice_id,
+        amount,
         payment_data.get('payment_date', datetime.now().strftime('%Y-%m-%d')),
         payment_data.get('payment_method', 'Check'),
         payment_data.get('reference_number'),
         payment_data.get('notes'),
+        idempotency_key,
         payment_data.get('created_by_id'),
         datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     ))
     
-    payment_id = cursor.lastrowid
-    
-    # Update invoice amount_paid
-    invoice_id = payment_data.get('invoice_id')
-    amount = float(payment_data.get('amount', 0))
-    
-    # Get current amount paid
-    current_amount_paid = cursor.execute(
-        "SELECT amount_paid FROM invoices WHERE id = ?", (invoice_id,)
-    ).fetchone()['amount_paid']
-    
-    new_amount_paid = current_amount_paid + amount
+    if cursor.rowcount == 0:
+        existing = cursor.execute(
+            "SELECT id FROM payments WHERE invoice_id = ? AND idempotency_key = ?",
+            (invoice_id, idempotency_key)
+        ).fetchone()
+        conn.close()
+        return existing['id'] if existing else None
     
-    # Update invoice with new payment amount
-    cursor.execute(
-        "UPDATE invoices SET amount_paid = ?, updated_at = ? WHERE id = ?",
-        (new_amount_paid, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), invoice_id)
-    )
+    payment_id = cursor.lastrowid
     
-    # Recalculate totals
-    recalculate_invoice_totals(conn, invoice_id)
+    # Post the payment to the invoice's running total in the same transaction
+    _apply_payment_amount(conn, invoice_id, amount)
     
     conn.commit()
     conn.close()
@@ -450,33 +484,33 @@ def delete_payment(payment_id):
         conn.close()
         return False
     
-    invoice_id = payment['invoice_id']
-    amount = payment['amount']
-    
-    # Get current amount paid
-    current_amount_paid = cursor.execute(
-        "SELECT amount_paid FROM invoices WHERE id = ?", (invoice_id,)
-    ).fetchone()['amount_paid']
-    
-    new_amount_paid = max(0, current_amount_paid - amount)
-    
-    # Update invoice with new payment amount
-    cursor.execute(
-        "UPDATE invoices SET amount_paid = ?, updated_at = ? WHERE id = ?",
-        (new_amount_paid, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), invoice_id)
-    )
-    
-    # Delete the payment
+    # Delete the payment; only the request that actually deleted it reverses the amount
     cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
+    if cursor.rowcount == 0:
+        conn.close()
+        return False
     
-    # Recalculate totals
-    recalculate_invoice_totals(conn, invoice_id)
+    _apply_payment_amount(conn, payment['invoice_id'], -payment['amount'])
     
     conn.commit()
     conn.close()
     
     return True
 
+def reconcile_invoice_payments(invoice_id):
+    """Reset an invoice's running payment total to the sum of its payments"""
+    conn = get_db_connection()
+    conn.execute(
+        """UPDATE invoices SET amount_paid = (
+               SELECT COALESCE(SUM(amount), 0) FROM payments WHERE invoice_id = ?
+           ) WHERE id = ?""",
+        (invoice_id, invoice_id)
+    )
+    # Re-derive balance and status from the corrected total
+    _apply_payment_amount(conn, invoice_id, 0)
+    conn.commit()
+    conn.close()
+
 # Invoice Status Operations
 def mark_invoice_as_sent(invoice_id):
     """Mark an invoice as sent"""
@@ -621,53 +655,44 @@ def get_monthly_revenue(year=None, month=None):
     return [dict(row) for row in results]
 
 # Email Functions
-def send_invoice_email(invoice_id, email_type='new'):
-    """Send invoice email to client"""
-    from app.services.email import send_invoice_email as send_email
+def send_invoice_email(invoice_id, email_type='new', payment_id=None):
+    """Queue an invoice email to the client
+    
+    Messages go through the mail queue, so month-end runs of invoices and
+    receipts are batched over pooled SMTP connections rather than sent one
+    connection at a time. Receipts are for payment_id, or the latest payment
+    if it isn't given. Returns False if there is nothing to send or the
+    message couldn't be queued.
+    """
+    from app.services.email import queue_invoice_email, queue_payment_receipt_email
     
     invoice = get_invoice_by_id(invoice_id)
-    if not invoice:
+    if not invoice or not invoice.get('client_email'):
         return False
+    
+    try:
+        if email_type == 'receipt':
+            payments = get_invoice_payments(invoice_id)
+            if payment_id is not None:
+                payments = [p for p in payments if p['id'] == payment_id]
+            if not payments:
+                return False
+            queue_payment_receipt_email(invoice['client_email'], payments[0], invoice)
+            return True
         
-    # Get items
-    items = get_invoice_items(invoice_id)
+        subject = None
+        if email_type == 'reminder':
+            days_overdue = (datetime.now().date() - datetime.strptime(invoice['due_date'], '%Y-%m-%d').date()).days
+            subject = f"Reminder: Invoice #{invoice['invoice_number']} is {days_overdue} days overdue"
+        queue_invoice_email(invoice['client_email'], invoice, subject=subject)
+    except Exception as e:
+        current_app.logger.error(f"Error queueing {email_type} email for invoice {invoice_id}: {str(e)}")
+        return False
     
-    # Determine email type and subject
+    # Queued; the mail queue retries delivery and keeps its status
     if email_type == 'new':
-        subject = f"Invoice #{invoice['invoice_number']} from AKC LLC Construction"
-        template = 'invoice_new'
-    elif email_type == 'reminder':
-        days_overdue = (datetime.now().date() - datetime.strptime(invoice['due_date'], '%Y-%m-%d').date()).days
-        subject = f"Reminder: Invoice #{invoice['invoice_number']} is {days_overdue} days overdue"
-        template = 'invoice_reminder'
-    elif email_type == 'receipt':
-        subject = f"Payment Receipt for Invoice #{invoice['invoice_number']}"
-        template = 'invoice_receipt'
-    else:
-        subject = f"Invoice #{invoice['invoice_number']} from AKC LLC Construction"
-        template = 'invoice_generic'
-    
-    # Send email
-    result = send_email(
-        invoice['client_email'],
-        subject,
-        template,
-        {
-            'invoice': invoice,
-            'invoice_items': items,
-            'client': {
-                'name': invoice['client_name'],
-                'email': invoice['client_email'],
-                'address': invoice['client_address'],
-                'phone': invoice['client_phone']
-            }
-        }
-    )
-    
-    # If email sent successfully, update invoice
-    if result and email_type == 'new':
         mark_invoice_as_sent(invoice_id)
-    elif result and email_type == 'reminder':
+    elif email_type == 'reminder':
         conn = get_db_connection()
         conn.execute(
             "UPDATE invoices SET last_reminder_date = ?, updated_at = ? WHERE id = ?",
@@ -676,7 +701,7 @@ def send_invoice_email(invoice_id, email_type='new'):
         conn.commit()
         conn.close()
     
-    return result
+    return True
 
 def get_invoices():
     try:
@@ -0,0 +1,169 @@
+"""
+Minimal in-process SMTP server for tests and benchmarks.
+
+Accepts the subset of SMTP that smtplib uses (EHLO/HELO, MAIL, RCPT, DATA,
+RSET, NOOP, QUIT), keeps received messages in memory, and can inject
+latency, temporary failures and rejected recipients.
+"""
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Handles one SMTP client connection"""
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        server = self.server.owner
+        server._connection_opened()
+        self._reply("220 localhost Local SMTP ready")
+        mail_from = None
+        rcpt_tos = []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            verb = command.split(' ', 1)[0].upper()
+            argument = command[len(verb):].strip()
+
+            if verb == 'EHLO':
+                self._reply("250-localhost")
+                self._reply("250-8BITMIME")
+                self._reply("250 SMTPUTF8")
+            elif verb == 'HELO':
+                self._reply("250 localhost")
+            elif verb == 'MAIL':
+                mail_from = _extract_address(argument)
+                rcpt_tos = []
+                self._reply("250 OK")
+            elif verb == 'RCPT':
+                address = _extract_address(argument)
+                if address in server.reject_recipients:
+                    self._reply(f"550 No such user <{address}>")
+                else:
+                    rcpt_tos.append(address)
+                    self._reply("250 OK")
+            elif verb == 'DATA':
+                if not rcpt_tos:
+                    self._reply("503 Need RCPT command")
+                    continue
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                if data is None:
+                    return
+                code = server._accept(mail_from, rcpt_tos, data)
+                if code == 250:
+                    self._reply("250 OK queued")
+                else:
+                    self._reply(f"{code} Temporary failure, try again later")
+                mail_from = None
+                rcpt_tos = []
+            elif verb == 'RSET':
+                mail_from = None
+                rcpt_tos = []
+                self._reply("250 OK")
+            elif verb == 'NOOP':
+                self._reply("250 OK")
+            elif verb == 'QUIT':
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+    def _read_data(self) -> Optional[bytes]:
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line)
+
+
+def _extract_address(argument: str) -> str:
+    """Pull the address out of 'FROM:<a@b>' / 'TO:<a@b>' arguments"""
+    start = argument.find('<')
+    end = argument.find('>', start)
+    if start != -1 and end != -1:
+        return argument[start + 1:end]
+    return argument.split(':', 1)[-1].strip()
+
+
+class _ThreadingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class LocalSMTPServer:
+    """In-memory SMTP server bound to localhost
+
+    Usage:
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool('127.0.0.1', server.port)
+            ...
+            assert len(server.messages) == 1
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 fail_next: int = 0, fail_code: int = 451, reject_recipients=None):
+        self.host = host
+        self.latency = latency
+        self.fail_next = fail_next
+        self.fail_code = fail_code
+        self.reject_recipients = set(reject_recipients or [])
+        self.messages: List[Dict[str, Any]] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingSMTPServer((host, port), _SMTPHandler)
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> 'LocalSMTPServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> 'LocalSMTPServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    def _connection_opened(self) -> None:
+        with self._lock:
+            self.connections += 1
+
+    def _accept(self, mail_from: str, rcpt_tos: List[str], data: bytes) -> int:
+        """Store a message, or return a temporary failure code if one is pending"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return self.fail_code
+            self.messages.append({
+                'mail_from': mail_from,
+                'rcpt_tos': list(rcpt_tos),
+                'data': data
+            })
+        return 250
@@ -0,0 +1,462 @@
+"""
+Outbound mail queue with pooled SMTP connections.
+
+Messages are persisted with a delivery status, sent in batches over reused
+SMTP connections by a bounded number of worker threads, rate limited, and
+retried with exponential backoff when the failure is transient.
+"""
+import heapq
+import logging
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+from email.message import Message
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("mail_queue")
+
+# Message statuses
+STATUS_QUEUED = 'queued'
+STATUS_RETRYING = 'retrying'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+PENDING_STATUSES = (STATUS_QUEUED, STATUS_RETRYING)
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Return True if a send failure is worth retrying later"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    # Dropped connections, timeouts and socket errors
+    return isinstance(exc, OSError)
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    """Return True if the failure means the SMTP connection is no longer usable"""
+    if isinstance(exc, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+        return False
+    return isinstance(exc, OSError)
+
+
+class PooledSMTPConnection:
+    """An SMTP connection checked out of a pool"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def send(self, message: Message) -> None:
+        """Send one message over this connection"""
+        try:
+            self.smtp.send_message(message)
+        except Exception as e:
+            if is_connection_error(e):
+                self.broken = True
+            raise
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        """Close the connection, ignoring errors from an already dead socket"""
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Bounded pool of reusable SMTP connections"""
+
+    def __init__(self, host: str, port: int = 25, username: Optional[str] = None,
+                 password: Optional[str] = None, use_tls: bool = False, use_ssl: bool = False,
+                 timeout: float = 30, max_size: int = 4, max_messages_per_connection: int = 100,
+                 max_idle_seconds: float = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_idle_seconds = max_idle_seconds
+        self.connections_opened = 0
+        self._idle: List[PooledSMTPConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self) -> PooledSMTPConnection:
+        """Open and authenticate a new SMTP connection"""
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls and not self.use_ssl:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or '')
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.connections_opened += 1
+        logger.debug(f"Opened SMTP connection to {self.host}:{self.port}")
+        return PooledSMTPConnection(smtp)
+
+    def _checkout(self) -> PooledSMTPConnection:
+        """Take an idle connection if one is still fresh, otherwise open a new one"""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if time.monotonic() - conn.last_used > self.max_idle_seconds:
+                conn.close()
+                continue
+            return conn
+
+    def _checkin(self, conn: PooledSMTPConnection) -> None:
+        """Return a connection to the pool, or close it if it should be retired"""
+        if conn.broken or conn.sent >= self.max_messages_per_connection:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a batch"""
+        self._slots.acquire()
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+            except Exception:
+                conn.broken = True
+                raise
+            finally:
+                self._checkin(conn)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RateLimiter:
+    """Token bucket limiting sends per second across all workers"""
+
+    def __init__(self, rate: Optional[float], burst: Optional[int] = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a send is allowed"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class MailStatusStore:
+    """SQLite-backed record of every queued message and its delivery status"""
+
+    def __init__(self, database: str = ':memory:'):
+        self.database = database
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        with self._lock:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS email_messages (
+                    id TEXT PRIMARY KEY,
+                    recipient TEXT NOT NULL,
+                    subject TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    next_attempt_at TEXT,
+                    payload BLOB,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    sent_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_email_messages_status ON email_messages(status);
+            ''')
+            self._conn.commit()
+
+    def _execute(self, query: str, params: tuple) -> None:
+        with self._lock:
+            self._conn.execute(query, params)
+            self._conn.commit()
+
+    def add(self, message_id: str, message: Message) -> None:
+        """Persist a newly queued message"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._execute('''
+            INSERT INTO email_messages (
+                id, recipient, subject, status, attempts, payload, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, 0, ?, ?, ?)
+        ''', (message_id, message.get('To', ''), message.get('Subject'), STATUS_QUEUED,
+              message.as_bytes(), now, now))
+
+    def mark_sent(self, message_id: str, attempts: int) -> None:
+        """Record a successful delivery and drop the stored payload"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._execute('''
+            UPDATE email_messages SET status = ?, attempts = ?, last_error = NULL,
+                next_attempt_at = NULL, payload = NULL, sent_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', (STATUS_SENT, attempts, now, now, message_id))
+
+    def mark_retry(self, message_id: str, attempts: int, error: str, delay: float) -> None:
+        """Record a transient failure and when the next attempt is due"""
+        now = datetime.now()
+        next_attempt = now + timedelta(seconds=delay)
+        self._execute('''
+            UPDATE email_messages SET status = ?, attempts = ?, last_error = ?,
+                next_attempt_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', (STATUS_RETRYING, attempts, error, next_attempt.strftime('%Y-%m-%d %H:%M:%S'),
+              now.strftime('%Y-%m-%d %H:%M:%S'), message_id))
+
+    def mark_failed(self, message_id: str, attempts: int, error: str) -> None:
+        """Record a permanent failure"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._execute('''
+            UPDATE email_messages SET status = ?, attempts = ?, last_error = ?,
+                next_attempt_at = NULL, updated_at = ?
+            WHERE id = ?
+        ''', (STATUS_FAILED, attempts, error, now, message_id))
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Get the status record for a message"""
+        with self._lock:
+            row = self._conn.execute(
+                '''SELECT id, recipient, subject, status, attempts, last_error,
+                          next_attempt_at, created_at, updated_at, sent_at
+                   FROM email_messages WHERE id = ?''',
+                (message_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Get messages that were queued but never delivered, e.g. before a restart"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, attempts, payload FROM email_messages WHERE status IN (?, ?) ORDER BY created_at",
+                PENDING_STATUSES
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Get the number of messages in each status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) as count FROM email_messages GROUP BY status"
+            ).fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _QueuedMessage:
+    __slots__ = ('id', 'message', 'attempts')
+
+    def __init__(self, message_id: str, message: Message, attempts: int = 0):
+        self.id = message_id
+        self.message = message
+        self.attempts = attempts
+
+
+class MailQueue:
+    """Batches queued messages over pooled SMTP connections with retries"""
+
+    def __init__(self, pool: SMTPConnectionPool, store: Optional[MailStatusStore] = None,
+                 workers: int = 2, batch_size: int = 50, rate_limit: Optional[float] = None,
+                 max_attempts: int = 5, retry_delay: float = 2.0, max_retry_delay: float = 300.0):
+        self.pool = pool
+        self.store = store or MailStatusStore()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._ready = deque()
+        self._delayed = []
+        self._sequence = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+
+    def enqueue(self, message: Message, message_id: Optional[str] = None) -> str:
+        """Persist a message and queue it for delivery; returns its message id"""
+        message_id = message_id or str(uuid.uuid4())
+        self.store.add(message_id, message)
+        with self._cond:
+            self._ready.append(_QueuedMessage(message_id, message))
+            self._cond.notify()
+        return message_id
+
+    def status(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Get the delivery status of a queued message"""
+        return self.store.get(message_id)
+
+    def start(self) -> None:
+        """Reload undelivered messages and start the worker threads"""
+        if self._running:
+            return
+        with self._cond:
+            queued_ids = {item.id for item in self._ready}
+            queued_ids.update(item.id for _, _, item in self._delayed)
+            for row in self.store.pending():
+                if row['id'] in queued_ids or row['payload'] is None:
+                    continue
+                message = message_from_bytes(row['payload'], policy=policy.SMTP)
+                self._ready.append(_QueuedMessage(row['id'], message, row['attempts']))
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"mail-queue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message is sent or has permanently failed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._ready or self._delayed or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the workers; undelivered messages stay in the store for the next start"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.pool.close()
+
+    def _next_batch(self) -> List[_QueuedMessage]:
+        """Wait for ready messages, promoting retries whose backoff has elapsed"""
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                if self._ready:
+                    batch = []
+                    while self._ready and len(batch) < self.batch_size:
+                        batch.append(self._ready.popleft())
+                    self._in_flight += len(batch)
+                    return batch
+                wait = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(wait)
+            return []
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                logger.error(f"Unexpected error in mail queue worker: {str(e)}")
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+
+    def _send_batch(self, batch: List[_QueuedMessage]) -> None:
+        """Send a batch over one pooled connection"""
+        pending = deque(batch)
+        try:
+            with self.pool.connection() as conn:
+                while pending:
+                    item = pending.popleft()
+                    self.rate_limiter.acquire()
+                    item.attempts += 1
+                    try:
+                        conn.send(item.message)
+                    except Exception as e:
+                        self._handle_failure(item, e)
+                        if conn.broken:
+                            break
+                        continue
+                    self.store.mark_sent(item.id, item.attempts)
+        except Exception as e:
+            # Could not connect; every message in the batch counts as an attempt
+            logger.warning(f"SMTP connection failed: {str(e)}")
+            while pending:
+                item = pending.popleft()
+                item.attempts += 1
+                self._handle_failure(item, e)
+            return
+
+        # The connection dropped mid-batch; requeue the rest without charging an attempt
+        if pending:
+            with self._cond:
+                self._ready.extendleft(reversed(pending))
+                self._cond.notify_all()
+
+    def _handle_failure(self, item: _QueuedMessage, exc: BaseException) -> None:
+        """Schedule a retry with exponential backoff, or mark the message failed"""
+        error = f"{type(exc).__name__}: {exc}"
+        if is_transient_error(exc) and item.attempts < self.max_attempts:
+            delay = min(self.max_retry_delay, self.retry_delay * (2 ** (item.attempts - 1)))
+            delay *= random.uniform(0.5, 1.0)
+            self.store.mark_retry(item.id, item.attempts, error, delay)
+            with self._cond:
+                self._sequence += 1
+                heapq.heappush(self._delayed, (time.monotonic() + delay, self._sequence, item))
+                self._cond.notify_all()
+            logger.info(f"Retrying email {item.id} in {delay:.1f}s after: {error}")
+        else:
+            self.store.mark_failed(item.id, item.attempts, error)
+            logger.error(f"Email {item.id} to {item.message.get('To')} failed: {error}")
@@ -6,6 +6,7 @@ from app.services.utils import generate_project_id, generate_id
 from datetime import datetime, timedelta
 import json
 from app.db import get_db
+from app.services.acl import id_filter, invalidate_user_access, invalidate_project_access, remove_project
 
 # Project status constants
 PROJECT_STATUSES = ['Planning', 'In Progress', 'On Hold', 'Completed', 'Cancelled']
@@ -26,8 +27,8 @@ def is_valid_status_transition(current_status, new_status):
     """Check if a status transition is valid"""
     return new_status in PROJECT_STATUS_TRANSITIONS.get(current_status, [])
 
-def get_all_projects(limit=50, offset=0, status=None, client_id=None):
-    """Get all projects with optional filtering"""
+def get_all_projects(limit=50, offset=0, status=None, client_id=None, project_ids=None):
+    """Get all projects with optional filtering, limited to project_ids if given"""
     db = get_db()
     query = """
         SELECT p.*, c.name as client_name
@@ -45,6 +46,10 @@ def get_all_projects(limit=50, offset=0, status=None, client_id=None):
         where_clauses.append("p.client_id = ?")
         params.append(client_id)
     
+    if project_ids is not None:
+        where_clauses.append("p.id IN (SELECT value FROM json_each(?))")
+        params.append(id_filter(project_ids))
+    
     if where_clauses:
         query += " WHERE " + " AND ".join(where_clauses)
     
@@ -100,6 +105,8 @@ def create_project(project_data):
         )
     )
     db.commit()
+    # The creator can now see the project
+    invalidate_user_access([project_data.get('created_by_id')])
     return cursor.lastrowid
 
 def update_project(project_id, project_data):
@@ -130,10 +137,13 @@ def update_project(project_id, project_data):
         )
     )
     db.commit()
+    # The client may have changed, which changes which clients members can see
+    invalidate_project_access(project_id)
     return True
 
 def delete_project(project_id):
     """Delete a project"""
+    remove_project(project_id)
     db = get_db()
     db.execute("DELETE FROM projects WHERE id = ?", (project_id,))
     db.commit()
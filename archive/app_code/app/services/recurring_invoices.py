@@ -0,0 +1,332 @@
+"""
+Recurring invoice generation.
+
+Finds recurring_invoices schedules whose next_issue_date has arrived and
+generates their invoices from the schedule's template, a batch of schedules
+per transaction. Each generated invoice records the schedule and period it
+was issued for under a unique index, and next_issue_date is only advanced if
+it still holds the value that was read, so re-running after a crash or
+running on several instances at once never issues a period twice.
+"""
+import calendar
+import json
+import logging
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+logger = logging.getLogger(__name__)
+
+# Schedules processed per transaction
+RECURRING_BATCH_SIZE = 500
+
+# Months between issues for each frequency; weekly is handled separately
+FREQUENCY_MONTHS = {
+    'monthly': 1,
+    'quarterly': 3,
+    'yearly': 12
+}
+
+DEFAULT_PAYMENT_TERMS_DAYS = 30
+DEFAULT_TERMS = "Payment due within 30 days of invoice date."
+
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def _add_months(start, months, day):
+    """Add months to a date, keeping the anchor day where the month allows it"""
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+def next_issue_date(schedule, issue_date):
+    """The issue date after issue_date for a schedule's frequency
+
+    Monthly, quarterly and yearly schedules stay anchored to the start date's
+    day of month, so a schedule starting on the 31st issues on the last day of
+    shorter months and returns to the 31st afterwards.
+    """
+    frequency = (schedule['frequency'] or '').lower()
+    if frequency == 'weekly':
+        return issue_date + timedelta(days=7)
+    if frequency not in FREQUENCY_MONTHS:
+        raise ValueError(f"Unknown recurring invoice frequency: {schedule['frequency']}")
+    anchor_day = _parse_date(schedule['start_date']).day
+    return _add_months(issue_date, FREQUENCY_MONTHS[frequency], anchor_day)
+
+def due_periods(schedule, as_of):
+    """Issue dates that are due for a schedule up to and including as_of"""
+    end_date = _parse_date(schedule['end_date']) if schedule['end_date'] else None
+    periods = []
+    issue_date = _parse_date(schedule['next_issue_date'])
+    while issue_date <= as_of and (end_date is None or issue_date <= end_date):
+        periods.append(issue_date)
+        issue_date = next_issue_date(schedule, issue_date)
+    return periods, issue_date
+
+def _load_templates(conn, template_ids):
+    """Template content by id, plus the default template under None"""
+    templates = {}
+    default = conn.execute(
+        "SELECT content FROM invoice_templates WHERE is_default = 1 ORDER BY id LIMIT 1"
+    ).fetchone()
+    templates[None] = json.loads(default['content']) if default else {}
+
+    template_ids = [template_id for template_id in template_ids if template_id is not None]
+    if template_ids:
+        placeholders = ', '.join('?' for _ in template_ids)
+        rows = conn.execute(
+            f"SELECT id, content FROM invoice_templates WHERE id IN ({placeholders})",
+            template_ids
+        ).fetchall()
+        for row in rows:
+            templates[row['id']] = json.loads(row['content'])
+    return templates
+
+def _resolve_template(schedule_data, templates):
+    """Merge the default template, the referenced template and the schedule's own data"""
+    resolved = dict(templates[None])
+    template_id = schedule_data.get('template_id')
+    if template_id is not None:
+        resolved.update(templates.get(template_id, {}))
+    resolved.update(schedule_data)
+    return resolved
+
+def _build_invoice(schedule, template, issue_date):
+    """Invoice row values and item rows for one period of a schedule"""
+    items = []
+    subtotal = 0
+    taxable_amount = 0
+    for sort_order, item in enumerate(template.get('items', [])):
+        quantity = float(item.get('quantity', 1))
+        unit_price = float(item.get('unit_price', 0))
+        amount = float(item['amount']) if item.get('amount') else quantity * unit_price
+        taxable = bool(item.get('taxable', True))
+        items.append((
+            item.get('description', ''),
+            quantity,
+            unit_price,
+            amount,
+            item.get('type', 'Service'),
+            item.get('sort_order', sort_order),
+            taxable
+        ))
+        subtotal += amount
+        if taxable:
+            taxable_amount += amount
+
+    tax_rate = float(template.get('tax_rate') or 0)
+    tax_amount = taxable_amount * tax_rate / 100
+    discount_amount = float(template.get('discount_amount') or 0)
+    total_amount = subtotal + tax_amount - discount_amount
+    payment_terms_days = int(template.get('payment_terms_days', DEFAULT_PAYMENT_TERMS_DAYS))
+
+    invoice = {
+        'invoice_number': f"INV-{issue_date.strftime('%Y%m%d')}-R{schedule['id']:04d}",
+        'client_id': schedule['client_id'],
+        'project_id': schedule['project_id'],
+        # Auto-send invoices are marked sent once their email is queued
+        'status': 'Draft',
+        'issue_date': issue_date.isoformat(),
+        'due_date': (issue_date + timedelta(days=payment_terms_days)).isoformat(),
+        'subtotal': subtotal,
+        'tax_rate': tax_rate,
+        'tax_amount': tax_amount,
+        'discount_amount': discount_amount,
+        'total_amount': total_amount,
+        'balance_due': total_amount,
+        'notes': template.get('notes'),
+        'terms': template.get('terms') or DEFAULT_TERMS,
+        'footer': template.get('footer'),
+        'payment_instructions': template.get('payment_instructions'),
+        'sent_date': None,
+        'created_by_id': schedule['created_by_id'],
+        'recurring_invoice_id': schedule['id'],
+        'recurring_period': issue_date.isoformat()
+    }
+    return invoice, items
+
+INVOICE_COLUMNS = (
+    'invoice_number', 'client_id', 'project_id', 'status', 'issue_date', 'due_date',
+    'subtotal', 'tax_rate', 'tax_amount', 'discount_amount', 'total_amount', 'balance_due',
+    'notes', 'terms', 'footer', 'payment_instructions', 'sent_date', 'created_by_id',
+    'recurring_invoice_id', 'recurring_period'
+)
+
+def _insert_invoice(conn, invoice, items, now):
+    """Insert an invoice unless this schedule period was already issued; returns the id or None"""
+    columns = INVOICE_COLUMNS + ('created_at', 'updated_at')
+    # Only the period's unique index is a conflict to skip; any other constraint
+    # failure raises and fails the schedule
+    cursor = conn.execute(
+        f"INSERT INTO invoices ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+        "ON CONFLICT (recurring_invoice_id, recurring_period) DO NOTHING",
+        [invoice[column] for column in INVOICE_COLUMNS] + [now, now]
+    )
+    if cursor.rowcount == 0:
+        return None
+
+    invoice_id = cursor.lastrowid
+    conn.executemany('''
+        INSERT INTO invoice_items (
+            invoice_id, description, quantity, unit_price, amount,
+            type, sort_order, taxable, created_at, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(invoice_id,) + item + (now, now) for item in items])
+    return invoice_id
+
+def _process_schedule(conn, schedule, templates, as_of, now):
+    """Issue every due period of one schedule and advance it past as_of
+
+    Returns the issued invoice ids, with None for periods that were already
+    issued, or None if another run had already advanced the schedule.
+    """
+    periods, following = due_periods(schedule, as_of)
+    schedule_data = json.loads(schedule['template_data']) if schedule['template_data'] else {}
+    template = _resolve_template(schedule_data, templates)
+
+    issued = []
+    for issue_date in periods:
+        invoice, items = _build_invoice(schedule, template, issue_date)
+        issued.append(_insert_invoice(conn, invoice, items, now))
+
+    end_date = _parse_date(schedule['end_date']) if schedule['end_date'] else None
+    active = 0 if end_date is not None and following > end_date else 1
+    last_issued = periods[-1].isoformat() if periods else schedule['last_issued_date']
+
+    # Only advance from the value that was read; if another run got here first, leave it
+    cursor = conn.execute('''
+        UPDATE recurring_invoices SET
+            next_issue_date = ?,
+            last_issued_date = ?,
+            active = ?,
+            updated_at = ?
+        WHERE id = ? AND next_issue_date = ?
+    ''', (following.isoformat(), last_issued, active, now, schedule['id'], schedule['next_issue_date']))
+    if cursor.rowcount != 1:
+        return None
+    return issued
+
+def generate_recurring_invoices(database=None, as_of=None, batch_size=RECURRING_BATCH_SIZE):
+    """Generate invoices for every recurring schedule due on or before as_of
+
+    Schedules are read in (next_issue_date, id) order from the due-schedule
+    index and processed batch_size at a time, each batch in one write
+    transaction. A schedule that fails is rolled back on its own, logged, and
+    left due for the next run.
+
+    Invoices are created as drafts. Returns a summary with the schedules
+    processed, new invoice ids, the ids of new invoices from auto_send
+    schedules (for the caller to email; see send_auto_send_invoices),
+    periods skipped because they were already issued, and failed schedule
+    ids.
+    """
+    database = database or current_app.config['DATABASE']
+    as_of = _parse_date(as_of) if as_of else date.today()
+    result = {
+        'schedules': 0,
+        'invoice_ids': [],
+        'auto_send_ids': [],
+        'skipped': 0,
+        'failed': []
+    }
+
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    cursor_key = ('', 0)
+    try:
+        while True:
+            # BEGIN IMMEDIATE takes the write lock up front, so concurrent runs queue
+            # behind each other instead of reading the same schedules
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                schedules = conn.execute('''
+                    SELECT * FROM recurring_invoices
+                    WHERE active = 1 AND next_issue_date <= ? AND (next_issue_date, id) > (?, ?)
+                    ORDER BY next_issue_date, id
+                    LIMIT ?
+                ''', (as_of.isoformat(), cursor_key[0], cursor_key[1], batch_size)).fetchall()
+                if not schedules:
+                    conn.execute("COMMIT")
+                    break
+
+                template_ids = {
+                    json.loads(s['template_data']).get('template_id')
+                    for s in schedules if s['template_data']
+                }
+                templates = _load_templates(conn, template_ids)
+                now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+                for schedule in schedules:
+                    conn.execute("SAVEPOINT schedule")
+                    try:
+                        issued = _process_schedule(conn, schedule, templates, as_of, now)
+                        if issued is None:
+                            conn.execute("ROLLBACK TO SAVEPOINT schedule")
+                        conn.execute("RELEASE SAVEPOINT schedule")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO SAVEPOINT schedule")
+                        conn.execute("RELEASE SAVEPOINT schedule")
+                        logger.error(f"Error generating recurring invoice {schedule['id']}: {str(e)}")
+                        result['failed'].append(schedule['id'])
+                        continue
+
+                    if issued is None:
+                        continue
+                    result['schedules'] += 1
+                    for invoice_id in issued:
+                        if invoice_id is None:
+                            result['skipped'] += 1
+                        else:
+                            result['invoice_ids'].append(invoice_id)
+                            if schedule['auto_send']:
+                                result['auto_send_ids'].append(invoice_id)
+
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            last = schedules[-1]
+            cursor_key = (last['next_issue_date'], last['id'])
+    finally:
+        conn.close()
+
+    return result
+
+def send_auto_send_invoices(invoice_ids):
+    """Queue the emails for auto-send invoices, marking each sent once queued
+
+    Returns the ids that couldn't be queued (no client email, or the queue
+    failed); those stay drafts for someone to send by hand.
+    """
+    from app.services.invoices import send_invoice_email
+
+    return [invoice_id for invoice_id in invoice_ids if not send_invoice_email(invoice_id)]
+
+@click.command('generate-recurring-invoices')
+@click.option('--as-of', default=None, help='Generate invoices due on or before this date (YYYY-MM-DD).')
+@click.option('--batch-size', default=RECURRING_BATCH_SIZE, show_default=True, help='Schedules per transaction.')
+@with_appcontext
+def generate_recurring_invoices_command(as_of, batch_size):
+    """Generate invoices for due recurring invoice schedules."""
+    result = generate_recurring_invoices(as_of=as_of, batch_size=batch_size)
+    unsent = send_auto_send_invoices(result['auto_send_ids'])
+    click.echo(
+        f"Processed {result['schedules']} schedules: {len(result['invoice_ids'])} invoices created, "
+        f"{result['skipped']} already issued, {len(result['failed'])} failed."
+    )
+    click.echo(f"Queued {len(result['auto_send_ids']) - len(unsent)} invoice emails.")
+    if unsent:
+        click.echo(f"Left as drafts, could not be emailed: {', '.join(str(i) for i in unsent)}")
+
+def init_app(app):
+    """Register the recurring invoice command with the Flask app."""
+    app.cli.add_command(generate_recurring_invoices_command)
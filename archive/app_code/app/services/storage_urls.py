@@ -0,0 +1,84 @@
+"""
+URL resolution for Supabase Storage objects.
+
+Public object URLs follow a fixed pattern, so they are built locally without
+calling the storage API. Signed URLs are requested in batches, one call for
+all the files a page needs, and cached until shortly before they expire, so
+a document list with hundreds of rows costs at most one storage request.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+SIGNED_URL_EXPIRES_IN = 3600
+# Signed URLs are refreshed this long before they expire, so a page never links an expired URL
+SIGNED_URL_REFRESH_MARGIN = 300
+SIGNED_URL_CACHE_SIZE = 10000
+
+def public_url(supabase_url, bucket, file_name):
+    """Public URL of a storage object, built without an API call"""
+    return f"{supabase_url.rstrip('/')}/storage/v1/object/public/{quote(bucket)}/{quote(file_name.lstrip('/'))}"
+
+class SignedUrlCache:
+    """Thread-safe LRU cache of signed URLs, keyed by (bucket, path, expires_in)"""
+
+    def __init__(self, max_size=SIGNED_URL_CACHE_SIZE, refresh_margin=SIGNED_URL_REFRESH_MARGIN, clock=time.monotonic):
+        self.max_size = max_size
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, bucket, file_names, sign, expires_in=SIGNED_URL_EXPIRES_IN):
+        """Signed URLs for file_names, signing only those not cached
+
+        sign(bucket, paths, expires_in) is called at most once, with every
+        uncached path, and must return a dict of path -> URL. Returns a dict
+        of file name -> URL; files that couldn't be signed are left out.
+        """
+        now = self.clock()
+        urls = {}
+        missing = []
+        with self._lock:
+            for file_name in dict.fromkeys(file_names):
+                key = (bucket, file_name, expires_in)
+                cached = self._urls.get(key)
+                if cached and cached[1] > now:
+                    self._urls.move_to_end(key)
+                    urls[file_name] = cached[0]
+                else:
+                    missing.append(file_name)
+
+        if not missing:
+            return urls
+
+        signed = sign(bucket, missing, expires_in)
+        valid_until = now + max(expires_in - self.refresh_margin, 0)
+        with self._lock:
+            for file_name, url in signed.items():
+                self._urls[(bucket, file_name, expires_in)] = (url, valid_until)
+                self._urls.move_to_end((bucket, file_name, expires_in))
+                urls[file_name] = url
+            while len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+        return urls
+
+    def get(self, bucket, file_name, sign, expires_in=SIGNED_URL_EXPIRES_IN):
+        """Signed URL for one file, or None if it couldn't be signed"""
+        return self.get_many(bucket, [file_name], sign, expires_in).get(file_name)
+
+    def invalidate(self, bucket, file_name=None):
+        """Forget cached URLs for a file, or for a whole bucket"""
+        with self._lock:
+            for key in [k for k in self._urls if k[0] == bucket and (file_name is None or k[1] == file_name)]:
+                del self._urls[key]
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+signed_url_cache = SignedUrlCache()
@@ -13,6 +13,7 @@ import jwt
 import logging
 from functools import wraps
 from typing import Dict, List, Any, Optional, Union, Callable
+from app.services.storage_urls import public_url, signed_url_cache, SIGNED_URL_EXPIRES_IN
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -629,28 +630,39 @@ def get_table_data(table_name, columns="*", filters=None, limit=None):
         return []
 
 # Storage functions for document management
+# Buckets already confirmed to exist, so uploads don't probe storage every time
+_known_buckets = set()
+
+def ensure_storage_bucket(supabase, bucket):
+    """Create a storage bucket if it doesn't exist, checking once per process"""
+    if bucket in _known_buckets:
+        return
+    try:
+        supabase.storage.get_bucket(bucket)
+    except Exception:
+        supabase.storage.create_bucket(bucket)
+    _known_buckets.add(bucket)
+
 def upload_file_to_storage(bucket, file_path, file_name, content_type=None):
-    """Upload a file to Supabase Storage"""
+    """Upload a file to Supabase Storage
+    
+    The open file is handed to the storage client, which streams it in the
+    multipart request body instead of reading it all into memory first.
+    """
     try:
         supabase = get_supabase_client()
         if supabase is None and DEV_MODE:
             logger.warning(f"Warning: Mock file upload to {bucket}")
             return {"key": file_name, "status": "mocked"}
-            
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
         
-        # Create the bucket if it doesn't exist
-        try:
-            supabase.storage.get_bucket(bucket)
-        except:
-            supabase.storage.create_bucket(bucket)
+        ensure_storage_bucket(supabase, bucket)
         
-        response = supabase.storage.from_(bucket).upload(
-            path=file_name,
-            file=file_data,
-            file_options={"content-type": content_type} if content_type else None
-        )
+        with open(file_path, 'rb') as f:
+            response = supabase.storage.from_(bucket).upload(
+                path=file_name,
+                file=f,
+                file_options={"content-type": content_type} if content_type else None
+            )
         return response
     except Exception as e:
         logger.error(f"Error uploading file to storage: {e}")
@@ -658,18 +670,43 @@ def upload_file_to_storage(bucket, file_path, file_name, content_type=None):
             raise
         return None
 
-def get_file_url(bucket, file_name):
-    """Get a public URL for a file in Supabase Storage"""
+def _sign_storage_urls(bucket, file_names, expires_in):
+    """Sign a batch of storage paths in one API call; returns path -> URL"""
+    supabase = get_supabase_client()
+    response = supabase.storage.from_(bucket).create_signed_urls(list(file_names), expires_in)
+    urls = {}
+    for item in response:
+        url = item.get('signedURL') or item.get('signedUrl')
+        if item.get('error') or not url:
+            logger.warning(f"Could not sign {bucket}/{item.get('path')}: {item.get('error')}")
+            continue
+        if url.startswith('/'):
+            url = f"{SUPABASE_URL.rstrip('/')}/storage/v1{url}"
+        urls[item['path']] = url
+    return urls
+
+def get_file_urls(bucket, file_names, signed=False, expires_in=SIGNED_URL_EXPIRES_IN):
+    """Get URLs for many files in Supabase Storage; returns file name -> URL
+    
+    Public URLs are built locally. Signed URLs come from the cache, with
+    every uncached file signed in a single storage request.
+    """
+    file_names = list(file_names)
     try:
         supabase = get_supabase_client()
         if supabase is None and DEV_MODE:
-            logger.warning(f"Warning: Mock file URL from {bucket}")
-            return f"/mock_storage/{bucket}/{file_name}"
-            
-        response = supabase.storage.from_(bucket).get_public_url(file_name)
-        return response
+            logger.warning(f"Warning: Mock file URLs from {bucket}")
+            return {name: f"/mock_storage/{bucket}/{name}" for name in file_names}
+        
+        if not signed:
+            return {name: public_url(SUPABASE_URL, bucket, name) for name in file_names}
+        return signed_url_cache.get_many(bucket, file_names, _sign_storage_urls, expires_in)
     except Exception as e:
-        logger.error(f"Error getting file URL: {e}")
+        logger.error(f"Error getting file URLs: {e}")
         if not DEV_MODE:
             raise
-        return None 
\ No newline at end of file
+        return {}
+
+def get_file_url(bucket, file_name, signed=False, expires_in=SIGNED_URL_EXPIRES_IN):
+    """Get a public (or signed) URL for a file in Supabase Storage"""
+    return get_file_urls(bucket, [file_name], signed, expires_in).get(file_name)
@@ -1,6 +1,7 @@
 from flask import request, session, g, current_app
 import re
 from app.services.users import get_user_by_id, USER_ROLES, can_access_role
+from app.services.acl import get_access
 
 def get_user_role():
     """Get the role of the current user
@@ -31,6 +32,18 @@ def get_current_user():
         return get_user_by_id(session['user_id'])
     return None
 
+def current_access():
+    """Get the current user's precomputed access, built at most once per request
+    
+    Returns:
+        AccessControl: Role permissions and accessible project and client ids
+    """
+    if 'access' not in g:
+        role = get_user_role()
+        permissions = USER_ROLES[role]['permissions'] if role in USER_ROLES else []
+        g.access = get_access(session.get('user_id'), role, permissions)
+    return g.access
+
 def has_permission(permission):
     """Check if the current user has a specific permission
     
@@ -40,10 +53,7 @@ def has_permission(permission):
     Returns:
         bool: True if the user has the permission, False otherwise
     """
-    role = get_user_role()
-    if role in USER_ROLES:
-        return permission in USER_ROLES[role]['permissions']
-    return False
+    return current_access().has_permission(permission)
 
 def is_mobile_device(user_agent=None):
     """Determine if the request is coming from a mobile device
@@ -134,7 +144,9 @@ def render_appropriate_template(template_name, **context):
         'is_mobile': getattr(g, 'is_mobile', is_mobile_device()),
         'user_role': get_user_role(),
         'current_user': get_current_user(),
-        'has_permission': has_permission
+        'has_permission': has_permission,
+        'can_edit_project': can_edit_project,
+        'can_access_client': can_access_client
     })
     
     return render_template(template_path, **context)
@@ -164,7 +176,9 @@ def get_user_dashboard_url():
 
 def can_edit_project(project_id):
     """Check if the current user can edit a specific project
-    This is a placeholder for a more sophisticated permission system
+    
+    Admins and project managers can edit any project, foremen the projects
+    they're members of, and other roles none.
     
     Args:
         project_id (str): The project ID to check
@@ -172,41 +186,29 @@ def can_edit_project(project_id):
     Returns:
         bool: True if the user can edit the project, False otherwise
     """
-    # In a real system, this would check if the user is assigned to the project
-    # or has the necessary role to edit any project
-    
-    role = get_user_role()
-    
-    # Admin and project managers can edit any project
-    if role in ['admin', 'project_manager']:
-        return True
-    
-    # Foremen can only edit their assigned projects
-    if role == 'foreman':
-        # Here we would check if the foreman is assigned to this project
-        # For now, just return True for simplicity
-        return True
+    return current_access().can_edit_project(project_id)
+
+def can_access_project(project_id):
+    """Check if the current user can view a specific project
     
-    # Field workers can't edit projects
-    return False
+    Args:
+        project_id (str): The project ID to check
+        
+    Returns:
+        bool: True if the user can view the project, False otherwise
+    """
+    return current_access().can_access_project(project_id)
 
 def can_access_client(client_id):
     """Check if the current user can access a specific client
     
+    Admins, project managers and accountants can access any client, other
+    roles the clients of their projects.
+    
     Args:
         client_id (str): The client ID to check
         
     Returns:
         bool: True if the user can access the client, False otherwise
     """
-    # In a real system, this would check if the user is associated with the client
-    # or has the necessary role to access any client
-    
-    role = get_user_role()
-    
-    # Admin and project managers can access any client
-    if role in ['admin', 'project_manager', 'accountant']:
-        return True
-    
-    # Other roles typically don't need client access
-    return False 
\ No newline at end of file
+    return current_access().can_access_client(client_id)
@@ -0,0 +1,156 @@
+"""
+Streaming ZIP archives.
+
+Builds a ZIP on the fly and yields it as it is written, so a download can
+start immediately and never needs a temp file. The next few entries are
+read concurrently in worker threads while the current one is written, each
+through a small bounded queue, so memory stays at roughly
+workers x prefetch chunks x chunk size however large the archive is.
+"""
+import io
+import logging
+import os
+import queue
+import threading
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+ZIP_FETCH_WORKERS = 4
+ZIP_PREFETCH_CHUNKS = 4
+
+# Already-compressed formats are stored rather than deflated again
+STORED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'pdf', 'zip', 'docx', 'xlsx', 'pptx',
+    'mp4', 'mov', 'mp3', '7z', 'rar', 'gz'
+}
+
+ZipEntry = namedtuple('ZipEntry', ['name', 'open', 'modified'], defaults=[None])
+
+_DONE = object()
+
+def file_chunks(path, chunk_size=ZIP_CHUNK_SIZE):
+    """Read a file in chunks"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def file_entry(name, path):
+    """A ZIP entry for a file on disk"""
+    return ZipEntry(
+        name,
+        lambda: file_chunks(path),
+        datetime.fromtimestamp(os.path.getmtime(path))
+    )
+
+class _ZipSink:
+    """Unseekable write target that hands written bytes back to the generator"""
+
+    def __init__(self):
+        self._buffer = []
+        self._position = 0
+
+    def write(self, data):
+        self._buffer.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation('seek')
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._buffer)
+        self._buffer = []
+        return data
+
+def _put(chunks, item, stop):
+    """Put into a bounded queue, giving up if the download was abandoned"""
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _fetch(entry, chunks, stop):
+    try:
+        for chunk in entry.open():
+            if not _put(chunks, chunk, stop):
+                return
+        _put(chunks, _DONE, stop)
+    except Exception as e:
+        _put(chunks, e, stop)
+
+def _zip_info(entry):
+    modified = entry.modified or datetime.now()
+    info = zipfile.ZipInfo(entry.name, date_time=modified.timetuple()[:6])
+    extension = entry.name.rsplit('.', 1)[-1].lower() if '.' in entry.name else ''
+    info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return info
+
+def stream_zip(entries, workers=ZIP_FETCH_WORKERS, prefetch_chunks=ZIP_PREFETCH_CHUNKS):
+    """Yield a ZIP archive of entries as bytes chunks
+
+    entries is an iterable of ZipEntry; each entry's open() returns an
+    iterator of bytes. Entries are written in order while up to `workers`
+    upcoming entries are fetched in parallel.
+    """
+    entries = iter(entries)
+    stop = threading.Event()
+    pending = deque()
+    sink = _ZipSink()
+
+    def schedule(pool):
+        entry = next(entries, None)
+        if entry is not None:
+            chunks = queue.Queue(maxsize=prefetch_chunks)
+            pool.submit(_fetch, entry, chunks, stop)
+            pending.append((entry, chunks))
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zip-fetch')
+    try:
+        for _ in range(workers):
+            schedule(pool)
+
+        with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+            while pending:
+                entry, chunks = pending.popleft()
+                schedule(pool)
+                with archive.open(_zip_info(entry), 'w', force_zip64=True) as out:
+                    while True:
+                        chunk = chunks.get()
+                        if chunk is _DONE:
+                            break
+                        if isinstance(chunk, Exception):
+                            logger.error(f"Error reading {entry.name} for ZIP export: {str(chunk)}")
+                            raise chunk
+                        out.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        # Central directory, written when the archive closes
+        data = sink.drain()
+        if data:
+            yield data
+    finally:
+        # Unblock and stop the fetchers if the client went away mid-download
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
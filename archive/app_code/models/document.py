@@ -45,6 +45,7 @@ class Document:
         is_public (bool): Whether the document is publicly accessible.
         created_at (datetime): When the document was created.
         updated_at (datetime): When the document was last updated.
+        content_hash (str): SHA-256 of the file content, identifying its shared blob.
     """
     
     def __init__(
@@ -65,7 +66,8 @@ class Document:
         version: int = 1,
         is_public: bool = False,
         created_at: datetime = None,
-        updated_at: datetime = None
+        updated_at: datetime = None,
+        content_hash: str = None
     ):
         self.id = id
         self.name = name
@@ -84,6 +86,7 @@ class Document:
         self.is_public = is_public
         self.created_at = created_at or datetime.now()
         self.updated_at = updated_at or datetime.now()
+        self.content_hash = content_hash
     
     @property
     def file_extension(self) -> Optional[str]:
@@ -128,6 +131,7 @@ class Document:
             'file_path': self.file_path,
             'file_type': self.file_type,
             'file_size': self.file_size,
+            'content_hash': self.content_hash,
             'document_type': self.document_type.value if isinstance(self.document_type, DocumentType) else self.document_type,
             'project_id': self.project_id,
             'client_id': self.client_id,
@@ -151,6 +155,7 @@ class Document:
             file_path=data.get('file_path'),
             file_type=data.get('file_type'),
             file_size=data.get('file_size', 0),
+            content_hash=data.get('content_hash'),
             document_type=data.get('document_type', DocumentType.OTHER),
             project_id=data.get('project_id'),
             client_id=data.get('client_id'),
@@ -178,6 +183,9 @@ class DocumentVersion:
         uploaded_by (str): The ID of the user who uploaded this version.
         change_notes (str): Notes about what changed in this version.
         created_at (datetime): When this version was created.
+        content_hash (str): SHA-256 of this version's full content. It names the
+            blob holding the current version, and the content earlier versions
+            reassemble to from their chunks.
     """
     
     def __init__(
@@ -189,7 +197,8 @@ class DocumentVersion:
         file_size: int,
         uploaded_by: str = None,
         change_notes: str = None,
-        created_at: datetime = None
+        created_at: datetime = None,
+        content_hash: str = None
     ):
         self.id = id
         self.document_id = document_id
@@ -199,6 +208,7 @@ class DocumentVersion:
         self.uploaded_by = uploaded_by
         self.change_notes = change_notes
         self.created_at = created_at or datetime.now()
+        self.content_hash = content_hash
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert the document version to a dictionary."""
@@ -208,6 +218,7 @@ class DocumentVersion:
             'version_number': self.version_number,
             'file_path': self.file_path,
             'file_size': self.file_size,
+            'content_hash': self.content_hash,
             'uploaded_by': self.uploaded_by,
             'change_notes': self.change_notes,
             'created_at': self.created_at.isoformat() if self.created_at else None
@@ -222,6 +233,7 @@ class DocumentVersion:
             version_number=data.get('version_number', 1),
             file_path=data.get('file_path'),
             file_size=data.get('file_size', 0),
+            content_hash=data.get('content_hash'),
             uploaded_by=data.get('uploaded_by'),
             change_notes=data.get('change_notes'),
             created_at=datetime.fromisoformat(data.get('created_at')) if data.get('created_at') else None
@@ -270,22 +282,35 @@ class DocumentService:
         pass
     
     @staticmethod
-    def upload_new_version(document_id: str, file, change_notes: str = None) -> Optional[Document]:
-        """Upload a new version of a document."""
-        # Implementation would depend on your database access layer and file storage system
-        pass
+    def upload_new_version(document_id: str, file, change_notes: str = None, uploaded_by: str = None) -> Optional[Document]:
+        """Upload a new version of a document.
+        
+        The new file becomes the document's current content. The version it
+        replaces is kept as content-defined chunks shared with the other
+        versions, so only the parts of the file that changed take up space.
+        """
+        from app.services.documents import add_document_version, get_document as get_document_record
+        
+        record = get_document_record(document_id)
+        if not record:
+            return None
+        add_document_version(record, file, uploaded_by=uploaded_by, change_notes=change_notes)
+        return Document.from_dict(dict(get_document_record(document_id)))
     
     @staticmethod
     def get_document_versions(document_id: str) -> List[DocumentVersion]:
         """Get all versions of a document."""
-        # Implementation would depend on your database access layer
-        pass
+        from app.services.document_versions import get_versions
+        
+        return [DocumentVersion.from_dict(version) for version in get_versions(document_id)]
     
     @staticmethod
     def get_document_version(document_id: str, version_number: int) -> Optional[DocumentVersion]:
         """Get a specific version of a document."""
-        # Implementation would depend on your database access layer
-        pass
+        from app.services.document_versions import get_version
+        
+        version = get_version(document_id, version_number)
+        return DocumentVersion.from_dict(version) if version else None
     
     @staticmethod
     def search_documents(search_term: str) -> List[Document]:
@@ -68,7 +68,8 @@ CREATE TABLE IF NOT EXISTS public.bid_versions (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     bid_id UUID NOT NULL REFERENCES public.bids(id) ON DELETE CASCADE,
     version_number INTEGER NOT NULL,
-    data JSONB NOT NULL, -- JSON serialized bid data
+    data JSONB NOT NULL, -- JSON serialized bid data, or a diff against the previous version
+    is_snapshot BOOLEAN NOT NULL DEFAULT TRUE, -- FALSE if data is a diff
     created_by_id UUID,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
@@ -136,6 +137,7 @@ CREATE INDEX IF NOT EXISTS idx_purchases_date ON public.purchases(date);
 CREATE INDEX IF NOT EXISTS idx_recurring_invoices_client_id ON public.recurring_invoices(client_id);
 CREATE INDEX IF NOT EXISTS idx_recurring_invoices_project_id ON public.recurring_invoices(project_id);
 CREATE INDEX IF NOT EXISTS idx_recurring_invoices_next_issue_date ON public.recurring_invoices(next_issue_date);
+CREATE INDEX IF NOT EXISTS idx_recurring_invoices_due ON public.recurring_invoices(next_issue_date, id) WHERE active;
 
 -- Indexes for bid_versions
 CREATE INDEX IF NOT EXISTS idx_bid_versions_bid_id ON public.bid_versions(bid_id);
@@ -0,0 +1,6 @@
+-- Store bid versions as diffs between periodic full snapshots.
+-- Existing rows hold full bid data, so they default to snapshots.
+alter table bid_versions add column is_snapshot integer not null default 1;
+
+create unique index if not exists idx_bid_versions_bid_version
+    on bid_versions(bid_id, version_number);
@@ -0,0 +1,15 @@
+-- Store uploaded files once per distinct content. Documents reference a blob
+-- by its SHA-256 hash and ref_count tracks how many documents use it.
+-- Existing documents keep their file_path and a NULL content_hash.
+create table if not exists blobs (
+    hash text primary key,
+    path text not null,
+    size integer not null,
+    content_type text,
+    ref_count integer not null default 0,
+    created_at timestamp not null default current_timestamp
+);
+
+alter table documents add column content_hash text references blobs (hash);
+
+create index if not exists idx_documents_content_hash on documents (content_hash);
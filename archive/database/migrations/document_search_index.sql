@@ -0,0 +1,6 @@
+-- Full-text index of document names, descriptions and extracted file text.
+-- rowid is the documents.id; populate it with `flask reindex-documents`.
+create virtual table if not exists document_search using fts5(
+    name, description, content,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
@@ -0,0 +1,8 @@
+-- Documents uploaded for vendors and subcontractors. Vendors and
+-- subcontractors are kept in Supabase, so these are plain ids rather than
+-- foreign keys.
+alter table documents add column vendor_id text;
+alter table documents add column subcontractor_id text;
+
+create index if not exists idx_documents_vendor_id on documents (vendor_id);
+create index if not exists idx_documents_subcontractor_id on documents (subcontractor_id);
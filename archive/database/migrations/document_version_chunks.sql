@@ -0,0 +1,24 @@
+-- Store document versions as lists of content-defined chunks, so revisions
+-- of the same file share every chunk the edit didn't touch. A document's
+-- current version has no chunks; its content is the blob with its
+-- content_hash until a newer version replaces it.
+create table if not exists document_versions (
+    id integer primary key autoincrement,
+    document_id integer not null references documents (id),
+    version_number integer not null,
+    content_hash text not null,
+    file_size integer not null,
+    chunks text,
+    uploaded_by integer references users (id),
+    change_notes text,
+    created_at timestamp not null default current_timestamp,
+    unique (document_id, version_number)
+);
+
+create table if not exists document_chunks (
+    hash text primary key,
+    size integer not null,
+    stored_size integer not null,
+    compressed boolean not null default 0,
+    ref_count integer not null default 0
+);
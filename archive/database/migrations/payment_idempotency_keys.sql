@@ -0,0 +1,6 @@
+-- Let clients attach an idempotency key to a payment so a double-submitted
+-- or retried payment is only recorded once. NULL keys are not deduplicated.
+alter table payments add column idempotency_key text;
+
+create unique index if not exists idx_payments_idempotency_key
+    on payments(invoice_id, idempotency_key);
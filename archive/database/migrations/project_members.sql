@@ -0,0 +1,23 @@
+-- Project membership for access control. Foremen and field workers see
+-- the projects they're members of (or created), and the clients of those
+-- projects. acl_version is bumped whenever a user's memberships change so
+-- cached access is rebuilt on their next request.
+create table if not exists project_members (
+    project_id integer not null references projects (id),
+    user_id integer not null references users (id),
+    role text not null default 'member',
+    created_at timestamp not null default current_timestamp,
+    primary key (project_id, user_id)
+);
+
+create index if not exists idx_project_members_user_id on project_members (user_id);
+
+alter table users add column acl_version integer not null default 0;
+
+-- Existing assignments become memberships, so foremen and field workers
+-- keep the projects they're assigned tasks on or log time to
+insert or ignore into project_members (project_id, user_id)
+select project_id, assigned_to_id from tasks
+where project_id is not null and assigned_to_id is not null
+union
+select project_id, user_id from time_entries where project_id is not null;
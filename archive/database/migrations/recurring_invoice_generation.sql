@@ -0,0 +1,11 @@
+-- Track which recurring schedule and period each generated invoice covers,
+-- so regenerating a period is a no-op.
+alter table invoices add column recurring_invoice_id integer references recurring_invoices(id);
+alter table invoices add column recurring_period date;
+
+create unique index if not exists idx_invoices_recurring_period
+    on invoices(recurring_invoice_id, recurring_period);
+
+-- Due-schedule lookup used by the generator
+create index if not exists idx_recurring_invoices_due
+    on recurring_invoices(next_issue_date, id) where active = 1;
@@ -56,7 +56,8 @@ CREATE TABLE IF NOT EXISTS bid_versions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     bid_id INTEGER NOT NULL,
     version_number INTEGER NOT NULL,
-    data TEXT NOT NULL, -- JSON serialized bid data
+    data TEXT NOT NULL, -- JSON serialized bid data, or a diff against the previous version
+    is_snapshot INTEGER NOT NULL DEFAULT 1, -- 1 if data is a full snapshot, 0 if it is a diff
     created_by_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (bid_id) REFERENCES bids (id) ON DELETE CASCADE,
@@ -68,4 +69,5 @@ CREATE INDEX IF NOT EXISTS idx_bids_client_id ON bids(client_id);
 CREATE INDEX IF NOT EXISTS idx_bids_project_id ON bids(project_id);
 CREATE INDEX IF NOT EXISTS idx_bids_status ON bids(status);
 CREATE INDEX IF NOT EXISTS idx_bid_items_bid_id ON bid_items(bid_id);
-CREATE INDEX IF NOT EXISTS idx_bid_versions_bid_id ON bid_versions(bid_id); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_bid_versions_bid_id ON bid_versions(bid_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bid_versions_bid_version ON bid_versions(bid_id, version_number);
@@ -21,11 +21,14 @@ CREATE TABLE IF NOT EXISTS invoices (
     sent_date DATE,
     paid_date DATE,
     last_reminder_date DATE,
+    recurring_invoice_id INTEGER, -- schedule this invoice was generated from
+    recurring_period DATE, -- issue date of the schedule period it covers
     created_by_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (client_id) REFERENCES clients (id),
     FOREIGN KEY (project_id) REFERENCES projects (id),
+    FOREIGN KEY (recurring_invoice_id) REFERENCES recurring_invoices (id),
     FOREIGN KEY (created_by_id) REFERENCES users (id)
 );
 
@@ -54,6 +57,7 @@ CREATE TABLE IF NOT EXISTS payments (
     payment_method TEXT,
     reference_number TEXT,
     notes TEXT,
+    idempotency_key TEXT, -- client-supplied key so a resubmitted payment is recorded once
     created_by_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -101,5 +105,8 @@ CREATE INDEX IF NOT EXISTS idx_invoices_project_id ON invoices(project_id);
 CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status);
 CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items(invoice_id);
 CREATE INDEX IF NOT EXISTS idx_payments_invoice_id ON payments(invoice_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_idempotency_key ON payments(invoice_id, idempotency_key);
 CREATE INDEX IF NOT EXISTS idx_recurring_invoices_client_id ON recurring_invoices(client_id);
-CREATE INDEX IF NOT EXISTS idx_recurring_invoices_next_issue_date ON recurring_invoices(next_issue_date); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_recurring_invoices_next_issue_date ON recurring_invoices(next_issue_date);
+CREATE INDEX IF NOT EXISTS idx_recurring_invoices_due ON recurring_invoices(next_issue_date, id) WHERE active = 1;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_recurring_period ON invoices(recurring_invoice_id, recurring_period);
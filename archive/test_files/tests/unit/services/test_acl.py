@@ -0,0 +1,102 @@
+"""
+Unit tests for precomputed access control
+"""
+import os
+import sqlite3
+import pytest
+from app.services.acl import (
+    get_access, add_project_member, remove_project_member, invalidate_project_access,
+    remove_project, backfill_project_members, get_project_members, clear_cache
+)
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'app_code', 'app', 'schema.sql')
+FOREMAN_PERMISSIONS = ['view_assigned_projects', 'log_time', 'assign_tasks']
+
+@pytest.fixture
+def database(tmp_path):
+    """Create an application database with two clients' projects"""
+    database = str(tmp_path / 'app.sqlite')
+    conn = sqlite3.connect(database)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.executescript('''
+        INSERT INTO users (id, username, email, password, role) VALUES (10, 'foreman', 'f@example.com', 'x', 'foreman');
+        INSERT INTO clients (id, name) VALUES (1, 'Hillside Homes'), (2, 'Riverside Dental');
+        INSERT INTO projects (id, name, client_id) VALUES (100, 'Kitchen remodel', 1), (200, 'Office buildout', 2);
+    ''')
+    conn.commit()
+    conn.close()
+    clear_cache()
+    yield database
+    clear_cache()
+
+def test_admin_access_is_unrestricted(database):
+    """Test that admins can reach every project and client without a membership lookup"""
+    access = get_access(1, 'admin', ['manage_users'], database=database)
+
+    assert access.project_ids is None and access.client_ids is None
+    assert access.can_edit_project('200') and access.can_access_client(2)
+    assert access.has_permission('manage_users') and not access.has_permission('log_time')
+
+def test_foreman_access_follows_membership(database):
+    """Test that a foreman reaches member projects and their clients only"""
+    add_project_member(100, 10, 'foreman', database=database)
+
+    access = get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database)
+
+    assert access.project_ids == {'100'} and access.client_ids == {'1'}
+    assert access.can_edit_project(100) and not access.can_edit_project(200)
+    assert access.can_access_client('1') and not access.can_access_client('2')
+    assert access.has_permission('log_time')
+
+def test_access_cached_until_membership_changes(database):
+    """Test that access is reused and rebuilt after membership changes"""
+    first = get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database)
+    assert get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database) is first
+    assert first.project_ids == frozenset()
+
+    add_project_member(200, 10, database=database)
+    assert get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database).project_ids == {'200'}
+
+    # Another worker's change only shows up through acl_version
+    conn = sqlite3.connect(database)
+    conn.execute("UPDATE projects SET client_id = 1 WHERE id = 200")
+    conn.commit()
+    conn.close()
+    invalidate_project_access(200, database=database)
+    assert get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database).client_ids == {'1'}
+
+    remove_project_member(200, 10, database=database)
+    assert get_access(10, 'foreman', FOREMAN_PERMISSIONS, database=database).project_ids == frozenset()
+
+def test_remove_project_drops_memberships(database):
+    """Test that deleting a project removes it from members' access"""
+    add_project_member(100, 10, database=database)
+    assert get_access(10, 'field_worker', ['log_time'], database=database).project_ids == {'100'}
+
+    remove_project(100, database=database)
+
+    access = get_access(10, 'field_worker', ['log_time'], database=database)
+    assert access.project_ids == frozenset()
+    assert not access.can_edit_project(100)
+
+def test_backfill_from_assignments(database):
+    """Test that task assignments and time entries become memberships, once"""
+    add_project_member(100, 10, 'foreman', database=database)
+    assert get_access(10, 'field_worker', ['log_time'], database=database).project_ids == {'100'}
+    conn = sqlite3.connect(database)
+    conn.executescript('''
+        INSERT INTO users (id, username, email, password, role) VALUES (11, 'fieldworker', 'fw@example.com', 'x', 'field_worker');
+        INSERT INTO tasks (project_id, name, assigned_to_id) VALUES (100, 'Demolition', 10), (200, 'Framing', 10);
+        INSERT INTO time_entries (user_id, project_id, date, hours) VALUES (11, 200, '2025-03-01', 8);
+    ''')
+    conn.commit()
+    conn.close()
+
+    assert backfill_project_members(database=database) == 2
+    assert backfill_project_members(database=database) == 0
+
+    assert get_access(10, 'field_worker', ['log_time'], database=database).project_ids == {'100', '200'}
+    assert get_access(11, 'field_worker', ['log_time'], database=database).client_ids == {'2'}
+    # Existing project roles are kept
+    assert [m['role'] for m in get_project_members(100, database=database)] == ['foreman']
@@ -0,0 +1,159 @@
+"""
+Unit tests for bid item edits and bid versions
+"""
+import os
+import sqlite3
+import pytest
+from app.services.bid_edits import (
+    BID_VERSION_SNAPSHOT_INTERVAL, add_item, apply_bid_diff, delete_item, diff_bid_data,
+    load_version_data, record_version, sync_items, update_item
+)
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'database', 'sql', 'create_bids_tables.sql')
+
+@pytest.fixture
+def conn(tmp_path):
+    """Create a bid database from the schema, with one empty bid"""
+    conn = sqlite3.connect(str(tmp_path / 'bids.sqlite'))
+    conn.row_factory = sqlite3.Row
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO bids (id, name, proposal_date) VALUES (1, 'Kitchen remodel', '2025-03-01')")
+    yield conn
+    conn.close()
+
+def get_bid(conn):
+    return conn.execute("SELECT * FROM bids WHERE id = 1").fetchone()
+
+def get_items(conn):
+    return conn.execute("SELECT * FROM bid_items WHERE bid_id = 1 ORDER BY id").fetchall()
+
+def summed_totals(conn):
+    """The totals a full recalculation would give"""
+    totals = {'labor_cost': 0, 'material_cost': 0, 'overhead_cost': 0}
+    for item in get_items(conn):
+        column = {'Labor': 'labor_cost', 'Material': 'material_cost'}.get(item['item_type'], 'overhead_cost')
+        totals[column] += item['total_price']
+    totals['total_amount'] = sum(totals.values())
+    return totals
+
+def assert_totals_current(conn):
+    bid = get_bid(conn)
+    for column, value in summed_totals(conn).items():
+        assert bid[column] == pytest.approx(value), column
+
+def test_item_edits_adjust_totals(conn):
+    """Test that adding, changing and deleting items keeps the totals equal to a full recalculation"""
+    labor_id = add_item(conn, 1, {'item_type': 'Labor', 'description': 'Demolition', 'quantity': 8, 'unit_cost': 50})
+    material_id = add_item(conn, 1, {'item_type': 'Material', 'description': 'Cabinets', 'quantity': 2,
+                                     'unit_cost': 400, 'markup_percentage': 25})
+    add_item(conn, 1, {'item_type': 'Permit', 'description': 'Permit', 'total_price': 150})
+    assert get_bid(conn)['total_amount'] == pytest.approx(400 + 1000 + 150)
+    assert_totals_current(conn)
+
+    material = conn.execute("SELECT * FROM bid_items WHERE id = ?", (material_id,)).fetchone()
+    assert update_item(conn, material, {'quantity': 3})
+    assert get_bid(conn)['material_cost'] == pytest.approx(1500)
+    assert_totals_current(conn)
+
+    # Moving an item to another type moves its price between columns
+    labor = conn.execute("SELECT * FROM bid_items WHERE id = ?", (labor_id,)).fetchone()
+    update_item(conn, labor, {'item_type': 'Material'})
+    assert get_bid(conn)['labor_cost'] == pytest.approx(0)
+    assert_totals_current(conn)
+
+    labor = conn.execute("SELECT * FROM bid_items WHERE id = ?", (labor_id,)).fetchone()
+    assert not update_item(conn, labor, dict(labor))
+
+    delete_item(conn, labor)
+    assert get_bid(conn)['total_amount'] == pytest.approx(1500 + 150)
+    assert_totals_current(conn)
+
+def test_sync_items_writes_only_changes(conn):
+    """Test that saving the editor's item list adds, updates and deletes only what changed"""
+    first = add_item(conn, 1, {'description': 'Framing', 'quantity': 10, 'unit_cost': 40})
+    add_item(conn, 1, {'description': 'Drywall', 'quantity': 5, 'unit_cost': 30})
+    third = add_item(conn, 1, {'item_type': 'Material', 'description': 'Lumber', 'quantity': 1, 'unit_cost': 900})
+    items = [dict(item) for item in get_items(conn)]
+    untouched_updated_at = items[0]['updated_at'] = '2000-01-01 00:00:00'
+    conn.execute("UPDATE bid_items SET updated_at = ? WHERE id = ?", (untouched_updated_at, first))
+
+    items[1]['quantity'] = 6
+    del items[2]
+    items.append({'id': 'new_1700000000000', 'item_type': 'Material', 'description': 'Screws',
+                  'quantity': 4, 'unit_cost': 12.5})
+
+    assert sync_items(conn, 1, items) == (1, 1, 1)
+
+    rows = {item['description']: item for item in get_items(conn)}
+    assert set(rows) == {'Framing', 'Drywall', 'Screws'}
+    assert rows['Framing']['updated_at'] == untouched_updated_at
+    assert rows['Drywall']['total_price'] == pytest.approx(180)
+    assert rows['Screws']['total_price'] == pytest.approx(50)
+    assert third not in {item['id'] for item in get_items(conn)}
+    assert_totals_current(conn)
+
+    assert sync_items(conn, 1, [dict(item) for item in get_items(conn)]) == (0, 0, 0)
+
+def test_diff_apply_round_trip():
+    """Test that applying a diff to the old data gives the new data"""
+    old = {
+        'name': 'Kitchen remodel', 'notes': 'Phase one', 'total_amount': 1500.0,
+        'items': [
+            {'id': 1, 'description': 'Framing', 'total_price': 400.0, 'notes': 'Walls'},
+            {'id': 2, 'description': 'Drywall', 'total_price': 150.0},
+            {'id': 3, 'description': 'Lumber', 'total_price': 950.0}
+        ]
+    }
+    new = {
+        'name': 'Kitchen and bath remodel', 'total_amount': 1630.0, 'status': 'Sent',
+        'items': [
+            {'id': 3, 'description': 'Lumber', 'total_price': 950.0},
+            {'id': 1, 'description': 'Framing', 'total_price': 480.0},
+            {'id': 4, 'description': 'Screws', 'total_price': 50.0}
+        ]
+    }
+
+    diff = diff_bid_data(old, new)
+
+    assert apply_bid_diff(old, diff) == new
+    assert diff['unset'] == ['notes']
+    assert diff['items']['deleted'] == [2]
+    assert diff['items']['added'] == [new['items'][2]]
+    assert set(diff['items']['changed']) == {'1'}
+    assert diff_bid_data(new, new) == {}
+
+def test_versions_rebuild_across_snapshots(conn):
+    """Test that every version rebuilds, with a full snapshot every BID_VERSION_SNAPSHOT_INTERVAL versions"""
+    expected = {}
+    version_count = BID_VERSION_SNAPSHOT_INTERVAL * 2 + 3
+    for version in range(1, version_count + 1):
+        add_item(conn, 1, {'description': f'Item {version}', 'quantity': version, 'unit_cost': 10})
+        if version % 3 == 0:
+            delete_item(conn, get_items(conn)[0])
+        assert record_version(conn, 1, changes={'notes': f'Revision {version}'}) == version
+
+        data = dict(get_bid(conn), notes=f'Revision {version}')
+        data['items'] = [dict(item) for item in conn.execute(
+            "SELECT * FROM bid_items WHERE bid_id = 1 ORDER BY sort_order ASC, id ASC"
+        ).fetchall()]
+        expected[version] = data
+
+    snapshots = [row['version_number'] for row in conn.execute(
+        "SELECT version_number FROM bid_versions WHERE bid_id = 1 AND is_snapshot = 1 ORDER BY version_number"
+    )]
+    assert snapshots == [1, BID_VERSION_SNAPSHOT_INTERVAL + 1, BID_VERSION_SNAPSHOT_INTERVAL * 2 + 1]
+
+    for version, data in expected.items():
+        assert load_version_data(conn, 1, version) == data
+
+    # A gap in the chain is reported rather than rebuilt wrongly
+    conn.execute("DELETE FROM bid_versions WHERE bid_id = 1 AND version_number = 5")
+    assert load_version_data(conn, 1, 4) == expected[4]
+    assert load_version_data(conn, 1, 6) is None
+    assert load_version_data(conn, 1, BID_VERSION_SNAPSHOT_INTERVAL + 2) == expected[BID_VERSION_SNAPSHOT_INTERVAL + 2]
+
+def test_record_version_missing_bid(conn):
+    """Test that recording a version of a missing bid saves nothing"""
+    assert record_version(conn, 99) is None
+    assert conn.execute("SELECT COUNT(*) FROM bid_versions").fetchone()[0] == 0
@@ -0,0 +1,76 @@
+"""
+Unit tests for content-addressed blob storage
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import pytest
+from app.services.blob_store import store_blob, release_blob, add_reference, get_blob
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'app_code', 'app', 'schema.sql')
+
+@pytest.fixture
+def storage(tmp_path):
+    """Create an application database and upload folder"""
+    database = str(tmp_path / 'app.sqlite')
+    conn = sqlite3.connect(database)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.close()
+    upload_folder = str(tmp_path / 'uploads')
+    os.makedirs(upload_folder)
+    return {'database': database, 'upload_folder': upload_folder}
+
+def test_store_hashes_content(storage):
+    """Test that a blob is stored under the SHA-256 of its content"""
+    content = b'%PDF-1.4 certificate of insurance'
+    blob, created = store_blob(io.BytesIO(content), 'PDF', 'application/pdf', **storage)
+
+    assert created
+    assert blob['hash'] == hashlib.sha256(content).hexdigest()
+    assert blob['path'].endswith(f"{blob['hash']}.pdf")
+    assert blob['size'] == len(content)
+    assert blob['ref_count'] == 1
+    with open(os.path.join(storage['upload_folder'], blob['path']), 'rb') as f:
+        assert f.read() == content
+
+def test_duplicates_share_one_file(storage):
+    """Test that identical uploads are stored once and reference counted"""
+    first, _ = store_blob(io.BytesIO(b'W-9'), 'pdf', **storage)
+    second, created = store_blob(io.BytesIO(b'W-9'), 'pdf', **storage)
+
+    assert not created
+    assert second['path'] == first['path']
+    assert second['ref_count'] == 2
+    blob_files = [f for _, _, files in os.walk(storage['upload_folder']) for f in files]
+    assert len(blob_files) == 1
+
+def test_release_deletes_with_last_reference(storage):
+    """Test that the file is only removed when the last reference is released"""
+    blob, _ = store_blob(io.BytesIO(b'plan set'), 'pdf', **storage)
+    assert add_reference(blob['hash'], database=storage['database'])
+    full_path = os.path.join(storage['upload_folder'], blob['path'])
+
+    assert not release_blob(blob['hash'], **storage)
+    assert os.path.exists(full_path)
+    assert release_blob(blob['hash'], **storage)
+    assert not os.path.exists(full_path)
+    assert get_blob(blob['hash'], database=storage['database']) is None
+
+def test_concurrent_duplicate_uploads(storage):
+    """Test that concurrent uploads of the same content leave one blob with every reference"""
+    threads = [
+        threading.Thread(target=store_blob, args=(io.BytesIO(b'same file'), 'txt'), kwargs=storage)
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    blob = get_blob(hashlib.sha256(b'same file').hexdigest(), database=storage['database'])
+    assert blob['ref_count'] == 10
+    blob_files = [f for _, _, files in os.walk(storage['upload_folder']) for f in files]
+    assert blob_files == [os.path.basename(blob['path'])]
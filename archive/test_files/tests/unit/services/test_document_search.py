@@ -0,0 +1,102 @@
+"""
+Unit tests for document content extraction and search
+"""
+import os
+import sqlite3
+import zipfile
+import pytest
+from app.services.document_search import (
+    extract_text, index_document, search_documents, remove_from_index,
+    update_indexed_fields, build_match_query
+)
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'app_code', 'app', 'schema.sql')
+
+@pytest.fixture
+def database(tmp_path):
+    """Create an application database from the schema"""
+    path = str(tmp_path / 'app.sqlite')
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.close()
+    return path
+
+def add_document(database, name, file_path, description=None):
+    conn = sqlite3.connect(database)
+    cursor = conn.execute(
+        "INSERT INTO documents (name, file_path, description) VALUES (?, ?, ?)",
+        (name, file_path, description)
+    )
+    conn.commit()
+    conn.close()
+    index_document(database, cursor.lastrowid, file_path, name, description)
+    return cursor.lastrowid
+
+def write_docx(path, paragraphs):
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ))
+
+def test_extract_docx_and_text(tmp_path):
+    """Test text extraction from Word and plain text files"""
+    docx = str(tmp_path / 'contract.docx')
+    write_docx(docx, ['Scope of work', 'Install drywall in unit 4'])
+    text_file = tmp_path / 'notes.txt'
+    text_file.write_text('Concrete pour scheduled')
+
+    assert extract_text(docx) == 'Scope of work\nInstall drywall in unit 4'
+    assert extract_text(str(text_file)) == 'Concrete pour scheduled'
+    assert extract_text(str(tmp_path / 'plan.dwg')) == ''
+
+def test_extract_xlsx(tmp_path):
+    """Test text extraction from spreadsheets"""
+    openpyxl = pytest.importorskip('openpyxl')
+    path = str(tmp_path / 'takeoff.xlsx')
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'Materials'
+    workbook.active.append(['Lumber', 24, None, 'pieces'])
+    workbook.save(path)
+
+    assert extract_text(path) == 'Materials\nLumber 24 pieces'
+
+def test_search_ranks_and_highlights(database, tmp_path):
+    """Test that content matches are found, names rank higher and snippets are escaped"""
+    spec = tmp_path / 'spec.txt'
+    spec.write_text('All <b>waterproofing</b> membranes must be inspected before backfill.')
+    other = tmp_path / 'other.txt'
+    other.write_text('Paint schedule for the lobby.')
+    spec_id = add_document(database, 'Foundation spec', str(spec))
+    named_id = add_document(database, 'Waterproofing warranty', str(other))
+
+    results = search_documents('waterproof', database=database)
+
+    assert [r['id'] for r in results] == [named_id, spec_id]
+    assert '<mark>waterproofing</mark>' in results[1]['snippet']
+    assert '&lt;b&gt;' in results[1]['snippet']
+
+def test_search_requires_every_term(database, tmp_path):
+    """Test that every search term must match"""
+    path = tmp_path / 'contract.txt'
+    path.write_text('Retainage of ten percent applies to the electrical subcontract.')
+    document_id = add_document(database, 'Contract', str(path))
+
+    assert [r['id'] for r in search_documents('electrical retainage', database=database)] == [document_id]
+    assert search_documents('electrical plumbing', database=database) == []
+    assert search_documents('"); DROP', database=database) == []
+    assert build_match_query('  ') is None
+
+def test_update_and_remove(database, tmp_path):
+    """Test that renamed documents are found by their new name and deleted ones are not"""
+    path = tmp_path / 'photo.txt'
+    path.write_text('')
+    document_id = add_document(database, 'Site photo', str(path))
+
+    update_indexed_fields(document_id, name='Roof inspection', database=database)
+    assert [r['id'] for r in search_documents('roof', database=database)] == [document_id]
+
+    remove_from_index(document_id, database=database)
+    assert search_documents('roof', database=database) == []
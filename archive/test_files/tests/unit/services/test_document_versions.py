@@ -0,0 +1,121 @@
+"""
+Unit tests for chunk-deduplicated document versions
+"""
+import io
+import os
+import random
+import sqlite3
+import pytest
+from app.services.blob_store import store_blob, release_blob
+from app.services.document_versions import (
+    split_chunks, save_version, add_blob_version, archive_version, get_versions, get_version,
+    read_version, delete_versions, CHUNK_MIN_SIZE, CHUNK_MAX_SIZE
+)
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'app_code', 'app', 'schema.sql')
+
+@pytest.fixture
+def storage(tmp_path):
+    """Create an application database and upload folder"""
+    database = str(tmp_path / 'app.sqlite')
+    conn = sqlite3.connect(database)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.close()
+    upload_folder = str(tmp_path / 'uploads')
+    os.makedirs(upload_folder)
+    return {'database': database, 'upload_folder': upload_folder}
+
+def random_bytes(size, seed):
+    return random.Random(seed).randbytes(size)
+
+def read_all(version, storage):
+    return b''.join(read_version(version, **storage))
+
+def test_split_chunks_bounds_and_resync():
+    """Test that chunks stay within bounds and realign after an insertion"""
+    data = random_bytes(4 * 1024 * 1024, 1)
+    chunks = list(split_chunks(io.BytesIO(data)))
+    edited = list(split_chunks(io.BytesIO(data[:500000] + b'REVISION B' + data[500000:])))
+
+    assert b''.join(chunks) == data
+    assert all(CHUNK_MIN_SIZE <= len(c) <= CHUNK_MAX_SIZE for c in chunks[:-1])
+    assert len(set(chunks) - set(edited)) <= 2
+
+def test_versions_share_unchanged_chunks(storage):
+    """Test that a revised file only stores the chunks around the edit"""
+    original = random_bytes(3 * 1024 * 1024, 2)
+    revised = original[:1000000] + b'Sheet A-101 revised' + original[1000000:]
+
+    first = save_version(7, io.BytesIO(original), change_notes='Issued for bid', **storage)
+    second = save_version(7, io.BytesIO(revised), change_notes='Addendum 1', **storage)
+
+    assert (first['version_number'], second['version_number']) == (1, 2)
+    assert first['bytes_written'] >= len(original)
+    assert second['bytes_written'] < len(original) // 5
+    assert read_all(get_version(7, 1, database=storage['database']), storage) == original
+    assert read_all(get_version(7, database=storage['database']), storage) == revised
+    assert [v['change_notes'] for v in get_versions(7, database=storage['database'])] == ['Issued for bid', 'Addendum 1']
+
+def test_compressible_versions(storage):
+    """Test that compressible chunks are stored compressed and read back intact"""
+    spec = b'Section 03 30 00 - Cast-in-place concrete\n' * 50000
+
+    version = save_version(3, io.BytesIO(spec), **storage)
+
+    assert version['bytes_written'] < len(spec) // 10
+    assert read_all(version, storage) == spec
+
+def test_delete_releases_only_unshared_chunks(storage):
+    """Test that deleting a document's versions keeps chunks other documents use"""
+    shared = random_bytes(1024 * 1024, 3)
+    save_version(1, io.BytesIO(shared), **storage)
+    save_version(2, io.BytesIO(shared + random_bytes(300000, 4)), **storage)
+
+    delete_versions(2, **storage)
+
+    assert get_versions(2, database=storage['database']) == []
+    assert read_all(get_version(1, database=storage['database']), storage) == shared
+    delete_versions(1, **storage)
+    conn = sqlite3.connect(storage['database'])
+    assert conn.execute("SELECT COUNT(*) FROM document_chunks").fetchone()[0] == 0
+    conn.close()
+    assert not [f for _, _, files in os.walk(storage['upload_folder']) for f in files]
+
+def chunk_count(storage):
+    conn = sqlite3.connect(storage['database'])
+    try:
+        return conn.execute("SELECT COUNT(*) FROM document_chunks").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_current_version_is_the_blob_until_replaced(storage):
+    """Test that the current version is read from its blob and chunked only when replaced"""
+    original = random_bytes(1024 * 1024, 5)
+    blob, _ = store_blob(io.BytesIO(original), 'pdf', **storage)
+
+    first = add_blob_version(9, blob['hash'], blob['size'], change_notes='Original upload',
+                             database=storage['database'])
+
+    assert first['chunks'] is None and first['version_number'] == 1
+    assert read_all(first, storage) == original
+    assert chunk_count(storage) == 0
+
+    with open(os.path.join(storage['upload_folder'], blob['path']), 'rb') as f:
+        assert archive_version(first, f, **storage) >= len(original)
+    release_blob(blob['hash'], **storage)
+
+    archived = get_version(9, 1, database=storage['database'])
+    assert read_all(archived, storage) == original
+    assert archive_version(archived, io.BytesIO(b''), **storage) == 0
+
+    # Content that doesn't match the version is rejected without keeping chunks
+    chunks = chunk_count(storage)
+    second = add_blob_version(9, 'f' * 64, 5, database=storage['database'])
+    with pytest.raises(ValueError):
+        archive_version(second, io.BytesIO(b'wrong'), **storage)
+    assert chunk_count(storage) == chunks
+    assert get_version(9, 2, database=storage['database'])['chunks'] is None
+
+    delete_versions(9, **storage)
+    assert chunk_count(storage) == 0
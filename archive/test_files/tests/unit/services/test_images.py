@@ -0,0 +1,123 @@
+"""
+Unit tests for image derivative service
+"""
+import io
+import os
+import pytest
+from app.services.images import (
+    process_image, queue_image_processing, derivative_path, best_image_path, strip_metadata
+)
+
+Image = pytest.importorskip('PIL.Image')
+ImageOps = pytest.importorskip('PIL.ImageOps')
+
+@pytest.fixture
+def photo(tmp_path):
+    """Create a large JPEG with EXIF orientation and GPS data"""
+    path = str(tmp_path / 'site_photo.jpg')
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees
+    exif[0x8825] = {1: 'N', 2: (39.0, 6.0, 0.0)}
+    Image.new('RGB', (4000, 3000), (120, 80, 40)).save(path, 'JPEG', exif=exif)
+    return path
+
+def test_process_image_creates_derivatives(photo):
+    """Test that derivatives are resized, rotated and saved as WebP"""
+    derivatives = process_image(photo)
+
+    assert set(derivatives) == {'thumb', 'web'}
+    with Image.open(derivatives['thumb']) as thumb:
+        assert thumb.format == 'WEBP'
+        assert thumb.size == (240, 320)
+    with Image.open(derivatives['web']) as web:
+        assert web.size == (1200, 1600)
+
+def test_process_image_leaves_original(photo):
+    """Test that derivatives have no EXIF and the stored original is never rewritten"""
+    with open(photo, 'rb') as f:
+        original_bytes = f.read()
+
+    derivatives = process_image(photo)
+
+    for path in derivatives.values():
+        with Image.open(path) as image:
+            assert not image.getexif()
+    with open(photo, 'rb') as f:
+        assert f.read() == original_bytes
+
+def test_strip_metadata(photo):
+    """Test that uploads are stripped of EXIF other than orientation, without re-encoding"""
+    with open(photo, 'rb') as f:
+        original_bytes = f.read()
+    with open(photo, 'rb') as upload:
+        stripped = strip_metadata(upload, 'jpg')
+        stripped_bytes = stripped.read()
+        stripped.seek(0)
+        with Image.open(stripped) as image:
+            assert dict(image.getexif()) == {0x0112: 6}
+            assert ImageOps.exif_transpose(image).size == (3000, 4000)
+
+    # The compressed image data is copied byte for byte
+    scan = original_bytes.index(b'\xff\xda')
+    assert stripped_bytes.endswith(original_bytes[scan:])
+
+@pytest.mark.parametrize('image_format', ['PNG', 'WEBP'])
+def test_strip_metadata_png_and_webp(image_format):
+    """Test that PNG and WebP uploads lose their EXIF and keep the orientation"""
+    exif = Image.Exif()
+    exif[0x0112] = 8
+    exif[0x8825] = {1: 'N', 2: (39.0, 6.0, 0.0)}
+    upload = io.BytesIO()
+    Image.new('RGB', (40, 30), (120, 80, 40)).save(upload, image_format, exif=exif, lossless=True)
+    upload.seek(0)
+
+    stripped = strip_metadata(upload, image_format.lower())
+    with Image.open(stripped) as image:
+        assert dict(image.getexif()) == {0x0112: 8}
+        assert image.load()[0, 0][:3] == (120, 80, 40)
+        assert ImageOps.exif_transpose(image).size == (30, 40)
+
+    # Upright photos have no EXIF left at all
+    exif[0x0112] = 1
+    upload = io.BytesIO()
+    Image.new('RGB', (40, 30)).save(upload, image_format, exif=exif, lossless=True)
+    upload.seek(0)
+    with Image.open(strip_metadata(upload, image_format.lower())) as image:
+        assert not image.getexif()
+
+def test_strip_metadata_stores_others_as_uploaded():
+    """Test that anything without EXIF, or not an image, is stored as uploaded"""
+    plain = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(plain, 'PNG')
+    plain.seek(0)
+    assert strip_metadata(plain, 'png') is plain
+    assert plain.tell() == 0
+
+    document = io.BytesIO(b'%PDF-1.4')
+    assert strip_metadata(document, 'pdf') is document
+    not_an_image = io.BytesIO(b'not an image')
+    assert strip_metadata(not_an_image, 'jpg') is not_an_image
+    assert not_an_image.read() == b'not an image'
+
+def test_best_image_path(photo):
+    """Test that the smallest fitting derivative is served, falling back to the original"""
+    assert best_image_path(photo, 'thumb') == photo
+
+    process_image(photo)
+    os.remove(derivative_path(photo, 'thumb'))
+
+    assert best_image_path(photo, 'thumb') == derivative_path(photo, 'web')
+    assert best_image_path(photo, '800') == derivative_path(photo, 'web')
+    assert best_image_path(photo, '4000') == photo
+    assert best_image_path(photo, None) == photo
+    assert best_image_path(photo, 'huge') == photo
+
+def test_queue_image_processing(photo, tmp_path):
+    """Test that images are processed in the pool and other files are ignored"""
+    document = str(tmp_path / 'contract.pdf')
+    open(document, 'w').close()
+
+    assert queue_image_processing(document) is None
+    future = queue_image_processing(photo)
+    assert set(future.result(timeout=60)) == {'thumb', 'web'}
+    assert os.path.exists(derivative_path(photo, 'web'))
@@ -0,0 +1,31 @@
+"""
+Unit tests for queueing invoice emails
+"""
+import importlib
+from unittest.mock import patch
+import pytest
+import app.services.supabase as supabase_service
+
+@pytest.fixture
+def invoices(monkeypatch):
+    """The invoices service, importable without a configured Supabase client"""
+    monkeypatch.setattr(supabase_service, 'supabase', None, raising=False)
+    return importlib.import_module('app.services.invoices')
+
+def test_send_invoice_email_queues(invoices):
+    """Test that invoice and receipt emails are queued rather than sent inline"""
+    invoice = {'id': 1, 'invoice_number': 'INV-1', 'client_email': 'client@example.com', 'due_date': '2025-01-31'}
+    payments = [{'id': 7, 'amount': 50.0}, {'id': 6, 'amount': 25.0}]
+    with patch('app.services.invoices.get_invoice_by_id', return_value=invoice), \
+         patch('app.services.invoices.get_invoice_payments', return_value=payments), \
+         patch('app.services.invoices.mark_invoice_as_sent') as mark_sent, \
+         patch('app.services.email.queue_invoice_email') as queue_invoice, \
+         patch('app.services.email.queue_payment_receipt_email') as queue_receipt:
+        assert invoices.send_invoice_email(1, 'new')
+        queue_invoice.assert_called_once_with('client@example.com', invoice, subject=None)
+        mark_sent.assert_called_once_with(1)
+
+        assert invoices.send_invoice_email(1, 'receipt', payment_id=6)
+        queue_receipt.assert_called_once_with('client@example.com', payments[1], invoice)
+
+        assert not invoices.send_invoice_email(1, 'receipt', payment_id=99)
@@ -0,0 +1,138 @@
+"""
+Unit tests for the outbound mail queue
+"""
+import pytest
+from unittest.mock import patch
+from app.services.email import build_message, queue_invoice_email
+from app.services.local_smtp import LocalSMTPServer
+from app.services.mail_queue import (
+    SMTPConnectionPool, MailQueue, MailStatusStore, RateLimiter,
+    STATUS_SENT, STATUS_FAILED
+)
+
+@pytest.fixture
+def smtp_server():
+    """Start a local SMTP server for the test"""
+    with LocalSMTPServer() as server:
+        yield server
+
+def make_queue(server, **kwargs):
+    pool = SMTPConnectionPool('127.0.0.1', server.port, max_size=kwargs.pop('max_size', 1))
+    kwargs.setdefault('workers', 1)
+    kwargs.setdefault('retry_delay', 0.01)
+    return MailQueue(pool, **kwargs)
+
+def make_message(n, to='client@example.com'):
+    return build_message(to, f'Invoice #{n}', f'<p>Invoice {n}</p>')
+
+def test_batch_reuses_one_connection(smtp_server):
+    """Test that a batch of messages is sent over a single SMTP connection"""
+    mail_queue = make_queue(smtp_server, batch_size=50)
+    ids = [mail_queue.enqueue(make_message(n)) for n in range(20)]
+    mail_queue.start()
+
+    assert mail_queue.flush(timeout=10)
+    mail_queue.stop()
+
+    assert len(smtp_server.messages) == 20
+    assert smtp_server.connections == 1
+    assert all(mail_queue.status(message_id)['status'] == STATUS_SENT for message_id in ids)
+
+def test_transient_failure_is_retried(smtp_server):
+    """Test that 4xx responses are retried with backoff until delivered"""
+    smtp_server.fail_next = 2
+    mail_queue = make_queue(smtp_server)
+    mail_queue.start()
+    message_id = mail_queue.enqueue(make_message(1))
+
+    assert mail_queue.flush(timeout=10)
+    mail_queue.stop()
+
+    status = mail_queue.status(message_id)
+    assert status['status'] == STATUS_SENT
+    assert status['attempts'] == 3
+    assert len(smtp_server.messages) == 1
+
+def test_permanent_failure_is_not_retried(smtp_server):
+    """Test that a rejected recipient fails without retries"""
+    smtp_server.reject_recipients.add('nobody@example.com')
+    mail_queue = make_queue(smtp_server)
+    mail_queue.start()
+    bad_id = mail_queue.enqueue(make_message(1, to='nobody@example.com'))
+    good_id = mail_queue.enqueue(make_message(2))
+
+    assert mail_queue.flush(timeout=10)
+    mail_queue.stop()
+
+    assert mail_queue.status(bad_id)['status'] == STATUS_FAILED
+    assert mail_queue.status(bad_id)['attempts'] == 1
+    assert mail_queue.status(good_id)['status'] == STATUS_SENT
+
+def test_gives_up_after_max_attempts(smtp_server):
+    """Test that a message is marked failed once it runs out of attempts"""
+    smtp_server.fail_next = 10
+    mail_queue = make_queue(smtp_server, max_attempts=3)
+    mail_queue.start()
+    message_id = mail_queue.enqueue(make_message(1))
+
+    assert mail_queue.flush(timeout=10)
+    mail_queue.stop()
+
+    status = mail_queue.status(message_id)
+    assert status['status'] == STATUS_FAILED
+    assert status['attempts'] == 3
+    assert '451' in status['last_error']
+
+def test_undelivered_messages_survive_restart(smtp_server, tmp_path):
+    """Test that messages queued before a restart are delivered on the next start"""
+    database = str(tmp_path / 'email_messages.sqlite')
+    first = make_queue(smtp_server, store=MailStatusStore(database))
+    message_id = first.enqueue(make_message(1))
+
+    second = make_queue(smtp_server, store=MailStatusStore(database))
+    second.start()
+    assert second.flush(timeout=10)
+    second.stop()
+
+    assert second.status(message_id)['status'] == STATUS_SENT
+    assert len(smtp_server.messages) == 1
+
+def test_rate_limiter():
+    """Test the token bucket rate limiter"""
+    now = [0.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(rate=2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        limiter.acquire()
+
+    # Two sends use the burst, the next two wait half a second each
+    assert sleeps == [pytest.approx(0.5), pytest.approx(0.5)]
+
+def test_build_message_attachments():
+    """Test building a message with a PDF attachment"""
+    message = build_message('client@example.com', 'Invoice', '<p>Hi</p>', attachments=b'%PDF-1.4')
+
+    attachments = list(message.iter_attachments())
+    assert message['To'] == 'client@example.com'
+    assert len(attachments) == 1
+    assert attachments[0].get_content_type() == 'application/pdf'
+
+def test_queue_invoice_email_uses_queue(smtp_server):
+    """Test that invoice emails, reminders included, go through the mail queue"""
+    mail_queue = make_queue(smtp_server)
+    invoice = {'invoice_number': 'INV-1', 'total_amount': 100.0, 'due_date': '2025-01-31'}
+    with patch('app.services.email.get_mail_queue', return_value=mail_queue):
+        first = queue_invoice_email('client@example.com', invoice)
+        reminder = queue_invoice_email('client@example.com', invoice, subject='Reminder: Invoice #INV-1 is 5 days overdue')
+    mail_queue.start()
+
+    assert mail_queue.flush(timeout=10)
+    mail_queue.stop()
+
+    assert mail_queue.status(first)['status'] == STATUS_SENT
+    assert mail_queue.status(reminder)['status'] == STATUS_SENT
+    assert smtp_server.connections == 1
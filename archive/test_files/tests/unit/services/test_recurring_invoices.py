@@ -0,0 +1,147 @@
+"""
+Unit tests for recurring invoice generation
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import date
+import pytest
+from app.services.recurring_invoices import generate_recurring_invoices, next_issue_date
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'database', 'sql', 'create_invoice_tables.sql')
+
+@pytest.fixture
+def database(tmp_path):
+    """Create an invoice database from the schema"""
+    path = str(tmp_path / 'invoices.sqlite')
+    conn = sqlite3.connect(path)
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.close()
+    return path
+
+def add_schedule(database, next_date, frequency='monthly', start_date=None, end_date=None,
+                 template_data=None, auto_send=0):
+    conn = sqlite3.connect(database)
+    cursor = conn.execute('''
+        INSERT INTO recurring_invoices (
+            client_id, frequency, start_date, end_date, next_issue_date, auto_send, template_data
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (1, frequency, start_date or next_date, end_date, next_date, auto_send,
+          json.dumps(template_data or {'items': [{'description': 'Maintenance', 'unit_price': 100}]})))
+    conn.commit()
+    conn.close()
+    return cursor.lastrowid
+
+def query(database, sql, params=()):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+def test_monthly_schedule_keeps_anchor_day():
+    """Test that monthly schedules clamp to short months and return to the anchor day"""
+    schedule = {'frequency': 'monthly', 'start_date': '2025-01-31'}
+    february = next_issue_date(schedule, date(2025, 1, 31))
+    march = next_issue_date(schedule, february)
+
+    assert february == date(2025, 2, 28)
+    assert march == date(2025, 3, 31)
+
+def test_generates_due_invoices_and_advances(database):
+    """Test that due periods are issued from the template and the schedule advances"""
+    schedule_id = add_schedule(database, '2025-01-15', template_data={
+        'tax_rate': 10,
+        'items': [{'description': 'Maintenance', 'quantity': 2, 'unit_price': 50}]
+    })
+    add_schedule(database, '2025-06-01')
+
+    result = generate_recurring_invoices(database, as_of='2025-03-20')
+
+    invoices = query(database, "SELECT * FROM invoices ORDER BY issue_date")
+    assert result['schedules'] == 1
+    assert [i['recurring_period'] for i in invoices] == ['2025-01-15', '2025-02-15', '2025-03-15']
+    assert invoices[0]['total_amount'] == pytest.approx(110)
+    assert len(query(database, "SELECT * FROM invoice_items")) == 3
+
+    schedule = query(database, "SELECT * FROM recurring_invoices WHERE id = ?", (schedule_id,))[0]
+    assert schedule['next_issue_date'] == '2025-04-15'
+    assert schedule['last_issued_date'] == '2025-03-15'
+
+def test_rerun_does_not_duplicate(database):
+    """Test that re-running, or re-running after a lost advance, issues nothing twice"""
+    schedule_id = add_schedule(database, '2025-01-01')
+    generate_recurring_invoices(database, as_of='2025-02-01')
+    assert generate_recurring_invoices(database, as_of='2025-02-01')['invoice_ids'] == []
+
+    # Simulate a crash after the invoices were written but before the schedule advanced
+    conn = sqlite3.connect(database)
+    conn.execute("UPDATE recurring_invoices SET next_issue_date = '2025-01-01' WHERE id = ?", (schedule_id,))
+    conn.commit()
+    conn.close()
+
+    result = generate_recurring_invoices(database, as_of='2025-02-01')
+    assert result['skipped'] == 2
+    assert len(query(database, "SELECT * FROM invoices")) == 2
+
+def test_constraint_failure_fails_schedule(database):
+    """Test that a constraint failure other than an already-issued period is not skipped silently"""
+    schedule_id = add_schedule(database, '2025-01-01')
+    conn = sqlite3.connect(database)
+    conn.execute("ALTER TABLE invoices ADD COLUMN approved_by_id INTEGER CHECK (approved_by_id IS NOT NULL)")
+    conn.close()
+
+    result = generate_recurring_invoices(database, as_of='2025-02-01')
+
+    schedule = query(database, "SELECT * FROM recurring_invoices WHERE id = ?", (schedule_id,))[0]
+    assert result['failed'] == [schedule_id]
+    assert result['skipped'] == 0
+    assert schedule['next_issue_date'] == '2025-01-01'
+
+def test_end_date_deactivates_schedule(database):
+    """Test that a schedule past its end date is deactivated"""
+    schedule_id = add_schedule(database, '2025-01-01', frequency='weekly', end_date='2025-01-20')
+
+    generate_recurring_invoices(database, as_of='2025-12-31')
+
+    schedule = query(database, "SELECT * FROM recurring_invoices WHERE id = ?", (schedule_id,))[0]
+    assert len(query(database, "SELECT * FROM invoices")) == 3
+    assert schedule['active'] == 0
+
+def test_batches_and_failures(database):
+    """Test that small batches cover every schedule and a bad schedule doesn't stop the run"""
+    for day in range(1, 11):
+        add_schedule(database, f'2025-01-{day:02d}')
+    bad_id = add_schedule(database, '2025-01-05', frequency='fortnightly')
+
+    result = generate_recurring_invoices(database, as_of='2025-01-31', batch_size=3)
+
+    assert result['schedules'] == 10
+    assert result['failed'] == [bad_id]
+    assert len(query(database, "SELECT * FROM invoices")) == 10
+
+def test_concurrent_runs(database):
+    """Test that runs on several threads issue each period exactly once"""
+    for day in range(1, 29):
+        add_schedule(database, f'2025-01-{day:02d}', auto_send=day % 2)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            generate_recurring_invoices(database, as_of='2025-03-31', batch_size=5)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    invoices = query(database, "SELECT * FROM invoices")
+    assert len(invoices) == 28 * 3
+    assert sum(len(r['invoice_ids']) for r in results) == 28 * 3
+    assert sum(len(r['auto_send_ids']) for r in results) == 14 * 3
+    # Nothing is marked sent until its email is queued
+    assert {invoice['status'] for invoice in invoices} == {'Draft'}
+    assert all(invoice['sent_date'] is None for invoice in invoices)
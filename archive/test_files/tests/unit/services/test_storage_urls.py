@@ -0,0 +1,69 @@
+"""
+Unit tests for storage URL resolution
+"""
+from app.services.storage_urls import SignedUrlCache, public_url
+
+class FakeSigner:
+    """Records sign calls and returns predictable URLs"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, bucket, paths, expires_in):
+        self.calls.append(list(paths))
+        return {path: f"https://storage/{bucket}/{path}?token={len(self.calls)}" for path in paths if path != 'missing.pdf'}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_public_url_is_built_locally():
+    """Test that public URLs are built from the project URL and quoted"""
+    url = public_url('https://example.supabase.co/', 'vendor_documents', 'vendor_docs/W-9 form.pdf')
+    assert url == 'https://example.supabase.co/storage/v1/object/public/vendor_documents/vendor_docs/W-9%20form.pdf'
+
+def test_signs_uncached_files_in_one_batch():
+    """Test that a page of files is signed in one call and served from cache afterwards"""
+    sign = FakeSigner()
+    cache = SignedUrlCache()
+    names = [f"doc-{i}.pdf" for i in range(200)]
+
+    first = cache.get_many('documents', names, sign)
+    second = cache.get_many('documents', names + ['new.pdf'], sign)
+
+    assert len(first) == 200
+    assert sign.calls[1] == ['new.pdf']
+    assert len(sign.calls) == 2
+    assert second['doc-5.pdf'] == first['doc-5.pdf']
+
+def test_refreshes_before_expiry():
+    """Test that URLs are re-signed once they are within the refresh margin of expiring"""
+    sign = FakeSigner()
+    clock = FakeClock()
+    cache = SignedUrlCache(refresh_margin=60, clock=clock)
+
+    url = cache.get('documents', 'coi.pdf', sign, expires_in=600)
+    clock.now += 539
+    assert cache.get('documents', 'coi.pdf', sign, expires_in=600) == url
+    clock.now += 2
+    assert cache.get('documents', 'coi.pdf', sign, expires_in=600) != url
+
+def test_unsigned_files_and_eviction():
+    """Test that failed files are retried and the cache stays within its size"""
+    sign = FakeSigner()
+    cache = SignedUrlCache(max_size=2)
+
+    assert cache.get('documents', 'missing.pdf', sign) is None
+    assert cache.get('documents', 'missing.pdf', sign) is None
+    assert len(sign.calls) == 2
+
+    cache.get_many('documents', ['a.pdf', 'b.pdf', 'c.pdf'], sign)
+    cache.get('documents', 'a.pdf', sign)
+    assert sign.calls[-1] == ['a.pdf']
+
+    cache.invalidate('documents')
+    cache.get('documents', 'c.pdf', sign)
+    assert sign.calls[-1] == ['c.pdf']
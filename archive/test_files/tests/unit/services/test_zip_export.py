@@ -0,0 +1,55 @@
+"""
+Unit tests for streaming ZIP export
+"""
+import io
+import zipfile
+import pytest
+from app.services.zip_export import ZipEntry, file_entry, stream_zip
+
+def chunks_of(data, size=1000):
+    return lambda: (data[i:i + size] for i in range(0, len(data), size))
+
+def test_stream_zip_round_trip(tmp_path):
+    """Test that the streamed archive contains every entry in order"""
+    estimate = tmp_path / 'estimate.txt'
+    estimate.write_text('Framing labor 120 hours\n' * 500)
+    entries = [
+        file_entry('CUST-1_PROJ-1_Remodel/Estimates/estimate.txt', str(estimate)),
+        ZipEntry('CUST-1_PROJ-1_Remodel/plans.pdf', chunks_of(bytes(range(256)) * 400)),
+        ZipEntry('CUST-1_PROJ-1_Remodel/empty.txt', lambda: iter([]))
+    ]
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(entries, workers=2, prefetch_chunks=2))))
+
+    assert archive.namelist() == [entry.name for entry in entries]
+    assert archive.testzip() is None
+    assert archive.read(entries[0].name) == estimate.read_bytes()
+    assert archive.read(entries[1].name) == bytes(range(256)) * 400
+    assert archive.getinfo(entries[1].name).compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo(entries[0].name).compress_type == zipfile.ZIP_DEFLATED
+
+def test_stream_zip_yields_incrementally():
+    """Test that output starts before later entries have been read"""
+    opened = []
+
+    def entry(name):
+        def open_entry():
+            opened.append(name)
+            return iter([b'x' * 10000])
+        return ZipEntry(name, open_entry)
+
+    stream = stream_zip((entry(f"file-{i}.bin") for i in range(50)), workers=2)
+    first = next(stream)
+
+    assert first.startswith(b'PK')
+    assert len(opened) < 50
+    stream.close()
+
+def test_stream_zip_read_error():
+    """Test that a failing entry aborts the stream"""
+    def broken():
+        yield b'partial'
+        raise OSError('storage unavailable')
+
+    with pytest.raises(OSError):
+        b''.join(stream_zip([ZipEntry('broken.txt', broken)]))
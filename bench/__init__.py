@@ -0,0 +1,4 @@
+"""
+Benchmarking tools: a local Supabase stand-in, its data generator and the
+benchmark suites that run against it. Nothing here is imported by the app.
+"""
@@ -0,0 +1,293 @@
+"""
+HTTP load test for the app's main pages.
+
+Virtual users each log in once and then request pages back to back for a
+fixed time, picking routes by weight and building each query string from
+that route's filter, sort and paging parameters, so a run covers the same
+mix of list views real users produce. Requests made during the warmup are
+not counted. Throughput and p50/p95/p99 latency are reported per route and
+written to a JSON file together with the settings and commit they were
+measured with; --compare prints each route's change against an earlier
+result file.
+
+    uvicorn app:app --port 8000                     # or gunicorn -c gunicorn.conf.py
+    python -m bench.load_test --base-url http://127.0.0.1:8000 --users 20 --duration 60
+    python -m bench.load_test ... --compare bench/results/load-20250301T120000Z.json
+
+Point the app at the Supabase stand-in (bench.stub_supabase) to measure
+against generated data instead of the mock lists.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+DEFAULT_USERNAME = os.getenv("LOAD_TEST_USERNAME", "admin@akc.org")
+DEFAULT_PASSWORD = os.getenv("LOAD_TEST_PASSWORD", "admin123")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+PERCENTILES = (50, 95, 99)
+# A route is flagged by --compare when its p95 grows by more than this
+REGRESSION_THRESHOLD = 0.10
+
+# Route -> (weight, {parameter: (chance it's sent, values)})
+ROUTES: Dict[str, Tuple[int, Dict[str, Tuple[float, list]]]] = {
+    "/dashboard": (4, {}),
+    "/projects": (3, {
+        "search": (0.2, ["renovation", "website", "acme", "office"]),
+        "status": (0.3, ["In Progress", "Planning", "Completed", "On Hold"]),
+        "sort": (0.4, ["name", "-name", "client", "date", "-date", "budget", "-budget", "progress"]),
+        "page": (0.3, [1, 2, 3]),
+    }),
+    "/time-logs": (3, {
+        "search_query": (0.2, ["electrical", "plumbing", "framing"]),
+        "status_filter": (0.3, ["Approved", "Pending", "Draft"]),
+        "project_filter": (0.2, [1, 2, 3]),
+        "page": (0.3, [1, 2]),
+    }),
+    "/expenses": (3, {
+        "search": (0.2, ["lumber", "permit", "lunch"]),
+        "category": (0.3, ["Materials", "Labor", "Equipment Rental", "Permits & Fees"]),
+        "project_id": (0.2, [1, 2, 3]),
+        "date_from": (0.2, ["2025-01-01", "2025-02-01"]),
+        "date_to": (0.2, ["2025-03-31", "2025-06-30"]),
+        "status": (0.3, ["Approved", "Pending Review", "Reimbursed"]),
+        "page": (0.3, [1, 2]),
+    }),
+    "/invoices": (2, {
+        "search": (0.2, ["INV", "renovation"]),
+        "status": (0.3, ["Draft", "Sent", "Paid", "Overdue"]),
+        "client_id": (0.2, [1, 2]),
+        "project_id": (0.1, [1, 2]),
+        "date_from": (0.2, ["2025-01-01"]),
+        "date_to": (0.2, ["2025-12-31"]),
+        "page": (0.2, [1, 2]),
+    }),
+    "/vendors": (3, {
+        "material_category": (0.3, ["Plumbing", "Electrical", "Concrete & Masonry", "Roofing"]),
+        "preferred_only": (0.2, ["true"]),
+        "status": (0.3, ["active", "inactive"]),
+    }),
+    "/customers": (2, {
+        "search": (0.3, ["acme", "tech", "smith"]),
+        "status": (0.3, ["Active", "Inactive"]),
+    }),
+    "/reports/time-summary": (1, {
+        "group_by": (0.9, ["project", "user", "task"]),
+        "date_from": (0.3, ["2025-01-01", "2025-03-01"]),
+        "date_to": (0.3, ["2025-03-31", "2025-12-31"]),
+        "project_id": (0.2, [1, 2, 3]),
+    }),
+}
+
+
+def build_params(rng: random.Random, options: Dict[str, Tuple[float, list]]) -> Dict[str, Any]:
+    return {name: rng.choice(values) for name, (chance, values) in options.items() if rng.random() < chance}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class RouteStats:
+    """Latencies, statuses and response sizes of one route's requests"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[int, int] = {}
+        self.errors = 0
+        self.bytes = 0
+
+    def add(self, seconds: float, status: int, size: int) -> None:
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+        if not 200 <= status < 300:
+            self.errors += 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        summary = {
+            "requests": count,
+            "errors": self.errors,
+            "throughput_rps": round(count / duration, 2) if duration else 0.0,
+            "mean_ms": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+            "max_ms": round(latencies[-1] * 1000, 2) if count else 0.0,
+            "avg_bytes": self.bytes // count if count else 0,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+        }
+        for pct in PERCENTILES:
+            summary[f"p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 2)
+        return summary
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> None:
+    response = await client.post("/login", data={"username": username, "password": password})
+    if response.status_code != 303 or response.headers.get("location", "").endswith("/login"):
+        raise RuntimeError(f"Login as {username} failed: {response.status_code}")
+
+
+async def fetch(client: httpx.AsyncClient, route: str, params: Dict[str, Any]) -> Tuple[int, int]:
+    """A page's status and size; 599 if no response came back"""
+    for attempt in range(2):
+        try:
+            response = await client.get(route, params=params)
+            return response.status_code, len(response.content)
+        except (httpx.ReadError, httpx.RemoteProtocolError):
+            # The server closed the kept-alive connection (as it does after an
+            # unhandled error) before this request reached it; browsers retry these
+            continue
+        except httpx.HTTPError:
+            break
+    return 599, 0
+
+
+async def virtual_user(base_url: str, username: str, password: str, rng: random.Random,
+                       stats: Dict[str, RouteStats], measure_from: float, stop_at: float,
+                       timeout: float) -> None:
+    routes = list(ROUTES)
+    weights = [ROUTES[route][0] for route in routes]
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, follow_redirects=False) as client:
+        await login(client, username, password)
+        while True:
+            route = rng.choices(routes, weights)[0]
+            params = build_params(rng, ROUTES[route][1])
+            start = time.perf_counter()
+            if start >= stop_at:
+                return
+            status, size = await fetch(client, route, params)
+            if start >= measure_from:
+                stats[route].add(time.perf_counter() - start, status, size)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run_load_test(base_url: str, users: int = 10, duration: float = 30.0, warmup: float = 5.0,
+                        seed: int = 1, username: str = DEFAULT_USERNAME, password: str = DEFAULT_PASSWORD,
+                        timeout: float = 30.0) -> Dict[str, Any]:
+    """Run the load test and return its results, ready to be written as JSON"""
+    stats = {route: RouteStats() for route in ROUTES}
+    started_at = datetime.now(timezone.utc)
+    now = time.perf_counter()
+    measure_from, stop_at = now + warmup, now + warmup + duration
+    await asyncio.gather(*(
+        virtual_user(base_url, username, password, random.Random(f"{seed}:{i}"), stats,
+                     measure_from, stop_at, timeout)
+        for i in range(users)
+    ))
+
+    overall = RouteStats()
+    for route_stats in stats.values():
+        overall.latencies += route_stats.latencies
+        overall.errors += route_stats.errors
+        overall.bytes += route_stats.bytes
+        for status, count in route_stats.statuses.items():
+            overall.statuses[status] = overall.statuses.get(status, 0) + count
+    return {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "base_url": base_url,
+            "users": users,
+            "duration_s": duration,
+            "warmup_s": warmup,
+            "seed": seed,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+        "overall": overall.summary(duration),
+        "routes": {route: route_stats.summary(duration) for route, route_stats in stats.items()},
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any],
+            threshold: float = REGRESSION_THRESHOLD) -> Tuple[List[str], List[str]]:
+    """Per-route comparison lines against an earlier result, and the routes whose p95 regressed"""
+    lines, regressions = [], []
+    for route, now in current["routes"].items():
+        before = previous.get("routes", {}).get(route)
+        if not before or not before["requests"] or not now["requests"]:
+            lines.append(f"{route:<24} no earlier result")
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = (now[key] - before[key]) / before[key] if before[key] else 0.0
+            changes.append(f"{key} {before[key]} -> {now[key]} ({change:+.0%})")
+        if before["p95_ms"] and (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] > threshold:
+            regressions.append(route)
+        lines.append(f"{route:<24} " + ", ".join(changes))
+    return lines, regressions
+
+
+def format_table(results: Dict[str, Any]) -> str:
+    header = f"{'route':<24}{'reqs':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    rows = [header, "-" * len(header)]
+    for route, s in list(results["routes"].items()) + [("overall", results["overall"])]:
+        rows.append(f"{route:<24}{s['requests']:>8}{s['errors']:>6}{s['throughput_rps']:>9}"
+                    f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    return "\n".join(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the app's main pages")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10, help="concurrent logged-in users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds run before measuring")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--username", default=DEFAULT_USERNAME)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--output", help="result file (default: bench/results/load-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"exit 1 if a route's p95 is more than {REGRESSION_THRESHOLD * 100:.0f}%% slower than --compare")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_load_test(
+        args.base_url, args.users, args.duration, args.warmup, args.seed, args.username, args.password
+    ))
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"load-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(format_table(results))
+    print(f"\nResults written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            lines, regressions = compare(results, json.load(f))
+        print(f"\nCompared with {args.compare}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\np95 regressions over {REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
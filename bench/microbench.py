@@ -0,0 +1,249 @@
+"""
+Microbenchmarks for the code every list page runs.
+
+Times url_for, the list filters and pagination, vendor insurance date
+parsing and the time summary grouping (services.listing) on fixed
+synthetic datasets at several sizes. The datasets are generated from a
+seed, so runs on different commits measure the same input. Each case
+reports ns/op (the best of several timeit repeats) and the peak bytes
+allocated during one call, from tracemalloc; CPython keeps no count of
+allocations, so the peak is the allocation figure reported. Results are
+written to a JSON file; --compare prints each case's change against an
+earlier result file.
+
+    python -m bench.microbench
+    python -m bench.microbench --scales 100,10000 --compare bench/results/micro-20250301T120000Z.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench.load_test import _git_commit
+from services.listing import (
+    paginate, filter_time_logs, filter_expenses, filter_invoices, with_insurance_dates, summarize_hours,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_SCALES = (100, 10_000, 100_000)
+# A case is flagged by --compare when its ns/op grows by more than this
+REGRESSION_THRESHOLD = 0.10
+
+WORDS = ["framing", "electrical", "plumbing", "drywall", "painting", "roofing", "lumber", "permit",
+         "concrete", "office", "warehouse", "retail", "renovation", "inspection", "cleanup", "delivery"]
+STATUSES = {
+    "time_log": ["Approved", "Pending", "Draft"],
+    "expense": ["Approved", "Pending Review", "Reimbursed", "Reconciled", "Rejected"],
+    "invoice": ["Draft", "Sent", "Paid", "Overdue", "Cancelled"],
+}
+CATEGORIES = ["Materials", "Labor", "Equipment Rental", "Permits & Fees", "Subcontractors", "Travel"]
+START = date(2025, 1, 1)
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _day(rng: random.Random) -> str:
+    return (START + timedelta(days=rng.randrange(365))).isoformat()
+
+
+def time_logs(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [{
+        "id": i, "date": _day(rng),
+        "project_id": (project := rng.randint(1, 50)), "project_name": f"Project {project} {WORDS[project % len(WORDS)]}",
+        "task_id": (task := rng.randint(1, 200)), "task_name": _text(rng, 2),
+        "user_id": (user := rng.randint(1, 25)), "user_name": f"User {user}",
+        "hours": rng.choice([0.5, 1.0, 2.0, 4.0, 6.0, 7.5, 8.0]), "billable": rng.random() < 0.8,
+        "status": rng.choice(STATUSES["time_log"]), "description": _text(rng, 6),
+    } for i in range(1, count + 1)]
+
+
+def expenses(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [{
+        "id": i, "date": _day(rng), "description": _text(rng, 5),
+        "vendor_name": f"Vendor {rng.randint(1, 100)}" if rng.random() < 0.9 else None,
+        "project_id": (project := rng.randint(1, 50)), "project_name": f"Project {project}",
+        "category": rng.choice(CATEGORIES), "status": rng.choice(STATUSES["expense"]),
+        "submitted_by": f"User {rng.randint(1, 25)}", "amount": round(rng.uniform(5, 5000), 2),
+    } for i in range(1, count + 1)]
+
+
+def invoices(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [{
+        "id": i, "invoice_number": f"INV-2025-{i:06d}", "issue_date": _day(rng),
+        "client_id": (client := rng.randint(1, 80)), "client_name": f"Client {client}",
+        "project_id": (project := rng.randint(1, 50)), "project_name": f"Project {project}",
+        "status": rng.choice(STATUSES["invoice"]), "notes": _text(rng, 4) if rng.random() < 0.5 else None,
+        "total_amount": round(rng.uniform(500, 50000), 2),
+    } for i in range(1, count + 1)]
+
+
+def vendors(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    def expiry():
+        roll = rng.random()
+        if roll < 0.1:
+            return None
+        if roll < 0.15:
+            return "not a date"
+        moment = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(730 * 86400))
+        return moment.isoformat().replace("+00:00", "Z") if roll < 0.6 else moment.isoformat()
+    return [{"id": str(i), "name": f"Vendor {i}", "status": "active", "insurance_expiry": expiry()}
+            for i in range(1, count + 1)]
+
+
+def datasets(scale: int, seed: int) -> Dict[str, List[Dict[str, Any]]]:
+    """The fixed datasets for one scale; the same seed always gives the same rows"""
+    return {name: make(scale, random.Random(f"{seed}:{name}:{scale}"))
+            for name, make in (("time_logs", time_logs), ("expenses", expenses),
+                               ("invoices", invoices), ("vendors", vendors))}
+
+
+def listing_cases(data: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Callable[[], Any]]:
+    logs, exp, inv = data["time_logs"], data["expenses"], data["invoices"]
+    middle = (len(logs) + 9) // 10 // 2 or 1
+    return {
+        "paginate.first": lambda: paginate(logs, 1),
+        "paginate.middle": lambda: paginate(logs, middle),
+        "filter_time_logs.none": lambda: filter_time_logs(logs),
+        "filter_time_logs.search": lambda: filter_time_logs(logs, "plumb"),
+        "filter_time_logs.all": lambda: filter_time_logs(logs, "plumb", "approved", 7),
+        "filter_expenses.search": lambda: filter_expenses(exp, "lumber"),
+        "filter_expenses.all": lambda: filter_expenses(exp, "lumber", "Materials", 7, "Approved", "2025-03-01", "2025-09-30"),
+        "filter_invoices.search": lambda: filter_invoices(inv, "renovation"),
+        "filter_invoices.all": lambda: filter_invoices(inv, "inv-2025", "Paid", 3, 7, "2025-03-01", "2025-09-30"),
+        "with_insurance_dates": lambda: with_insurance_dates(data["vendors"]),
+        "summarize_hours.project": lambda: summarize_hours(logs, "project"),
+        "summarize_hours.user": lambda: summarize_hours(logs, "user"),
+        "summarize_hours.task": lambda: summarize_hours(logs, "task"),
+    }
+
+
+def url_for_cases() -> Dict[str, Callable[[], Any]]:
+    # Importing app configures its logging and services; keep that quiet
+    logging.disable(logging.CRITICAL)
+    try:
+        from app import url_for
+    finally:
+        logging.disable(logging.NOTSET)
+    return {
+        "url_for.static": lambda: url_for("static", filename="css/style.css"),
+        "url_for.plain": lambda: url_for("time_logs"),
+        "url_for.one_arg": lambda: url_for("invoice_detail", invoice_id=42),
+        "url_for.path": lambda: url_for("estimates/7/edit"),
+        "url_for.unknown": lambda: url_for("no_such_page"),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int = 5) -> Dict[str, Any]:
+    """ns/op as the best of `repeat` timeit runs, and the peak bytes one call allocates"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number))
+
+    func()  # Leave one-off caches out of the allocation figure
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return {"ns_per_op": round(best / number * 1e9, 1), "loops": number, "peak_alloc_bytes": peak}
+
+
+def run_microbench(scales=DEFAULT_SCALES, seed: int = 1, repeat: int = 5) -> Dict[str, Any]:
+    """Run every case and return the results, ready to be written as JSON"""
+    started_at = datetime.now(timezone.utc)
+    cases: Dict[str, Dict[str, Any]] = {}
+    for name, func in url_for_cases().items():
+        cases[name] = measure(func, repeat)
+    for scale in scales:
+        data = datasets(scale, seed)
+        for name, func in listing_cases(data).items():
+            cases[f"{name}@{scale}"] = measure(func, repeat)
+    return {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "scales": list(scales),
+            "seed": seed,
+            "repeat": repeat,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+        "cases": cases,
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any],
+            threshold: float = REGRESSION_THRESHOLD) -> Tuple[List[str], List[str]]:
+    """Per-case comparison lines against an earlier result, and the cases whose ns/op regressed"""
+    lines, regressions = [], []
+    for name, now in current["cases"].items():
+        before = previous.get("cases", {}).get(name)
+        if not before or not before["ns_per_op"]:
+            lines.append(f"{name:<36} no earlier result")
+            continue
+        change = (now["ns_per_op"] - before["ns_per_op"]) / before["ns_per_op"]
+        if change > threshold:
+            regressions.append(name)
+        lines.append(f"{name:<36} ns/op {before['ns_per_op']} -> {now['ns_per_op']} ({change:+.0%}), "
+                     f"peak bytes {before['peak_alloc_bytes']} -> {now['peak_alloc_bytes']}")
+    return lines, regressions
+
+
+def format_table(results: Dict[str, Any]) -> str:
+    header = f"{'case':<36}{'ns/op':>14}{'peak bytes':>14}"
+    rows = [header, "-" * len(header)]
+    for name, s in results["cases"].items():
+        rows.append(f"{name:<36}{s['ns_per_op']:>14}{s['peak_alloc_bytes']:>14}")
+    return "\n".join(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmark url_for and the list page helpers")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated dataset sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="timeit repeats; the best is reported")
+    parser.add_argument("--output", help="result file (default: bench/results/micro-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"exit 1 if a case is more than {REGRESSION_THRESHOLD * 100:.0f}%% slower than --compare")
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    results = run_microbench(scales, args.seed, args.repeat)
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"micro-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(format_table(results))
+    print(f"\nResults written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            lines, regressions = compare(results, json.load(f))
+        print(f"\nCompared with {args.compare}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\nns/op regressions over {REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Seeded data generator for the Supabase stand-in.
+
+Creates the tables the app reads (customers, projects, vendors, materials,
+purchases, project_vendors, activity_log) with the same fields as app.py's
+mock rows, and fills them with generated rows split between the tables in
+fixed proportions. The same --seed and --rows always give the same data
+(vendor insurance dates are relative to the day it's seeded), so benchmark
+runs against a database are comparable.
+
+    python -m bench.seed --db /tmp/akc-bench.sqlite3 --rows 1000000
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from bench.stub_supabase import DEFAULT_DB, StubDatabase
+
+TABLES = {
+    "customers": {
+        "id": "integer", "name": "text", "contact_name": "text", "email": "text", "phone": "text",
+        "address": "text", "city": "text", "state": "text", "zip": "text", "status": "text",
+        "customer_since": "text", "payment_terms": "text", "credit_limit": "real", "notes": "text",
+        "created_at": "text", "updated_at": "text",
+    },
+    "projects": {
+        "id": "integer", "name": "text", "client_id": "integer", "client_name": "text", "status": "text",
+        "status_color": "text", "start_date": "text", "end_date": "text", "budget": "real", "spent": "real",
+        "remaining": "real", "description": "text", "manager": "text", "team": "json", "progress": "integer",
+        "created_at": "text", "updated_at": "text",
+    },
+    "vendors": {
+        "id": "integer", "name": "text", "vendor_type": "text", "contact_name": "text", "email": "text",
+        "phone": "text", "address": "json", "material_categories": "json", "lead_time_days": "integer",
+        "payment_terms": "text", "is_preferred": "boolean", "has_volume_discount": "boolean",
+        "quality_rating": "integer", "insurance_policy": "text", "insurance_expiry": "text",
+        "certifications": "json", "status": "text", "created_at": "text", "updated_at": "text",
+    },
+    "materials": {
+        "id": "integer", "vendor_id": "integer", "name": "text", "category": "text", "unit_price": "real",
+        "unit": "text", "min_order_quantity": "integer", "lead_time_days": "integer", "quantity": "integer",
+        "status": "text", "quality_rating": "integer", "delivery_status": "text", "updated_at": "text",
+    },
+    "purchases": {
+        "id": "integer", "vendor_id": "integer", "project_id": "integer", "description": "text",
+        "amount": "real", "date": "text", "category": "text", "status": "text", "invoice_number": "text",
+        "receipt_url": "text", "notes": "text", "created_at": "text", "updated_at": "text",
+    },
+    "project_vendors": {
+        "id": "integer", "project_id": "integer", "vendor_id": "integer", "status": "text", "created_at": "text",
+    },
+    "activity_log": {
+        "id": "integer", "type": "text", "description": "text", "created_at": "text",
+    },
+}
+
+# Share of the total rows each table gets; purchases and activity grow fastest in practice
+SHARES = {
+    "customers": 0.02, "projects": 0.05, "vendors": 0.02, "materials": 0.15,
+    "purchases": 0.45, "project_vendors": 0.08, "activity_log": 0.23,
+}
+
+# The foreign keys and the columns the app filters and sorts on
+INDEXES = {
+    "customers": [("status",), ("name",)],
+    "projects": [("client_id",), ("status",)],
+    "vendors": [("status",), ("is_preferred",)],
+    "materials": [("vendor_id",), ("category",)],
+    "purchases": [("vendor_id",), ("project_id",), ("status",)],
+    "project_vendors": [("vendor_id", "status"), ("project_id",)],
+    "activity_log": [("created_at",)],
+}
+
+MATERIAL_CATEGORIES = [
+    "Concrete & Masonry", "Lumber & Wood Products", "Steel & Metal", "Electrical", "Plumbing", "HVAC",
+    "Roofing", "Flooring", "Paint & Coatings", "Windows & Doors", "Hardware & Fasteners", "Insulation",
+    "Drywall & Accessories", "Site Materials", "Safety Equipment",
+]
+FIRST_NAMES = ["John", "Sarah", "Michael", "Emily", "David", "Jessica", "Robert", "Linda", "James", "Maria",
+               "William", "Karen", "Daniel", "Nancy", "Thomas", "Lisa"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Wilson", "Anderson", "Taylor", "Thomas", "Moore", "Jackson"]
+COMPANY_WORDS = ["Acme", "Summit", "Riverside", "Oak", "Granite", "Pioneer", "Liberty", "Keystone", "Harbor",
+                 "Cedar", "Northstar", "Heritage", "Evergreen", "Frontier", "Valley", "Metro"]
+COMPANY_SUFFIXES = ["Corporation", "Inc", "LLC", "Group", "Partners", "Holdings", "Industries", "Co"]
+CITIES = [("Springfield", "IL", "62701"), ("Columbus", "OH", "43215"), ("Louisville", "KY", "40202"),
+          ("Indianapolis", "IN", "46204"), ("Cincinnati", "OH", "45202"), ("Lexington", "KY", "40507")]
+STREETS = ["Main Street", "Oak Avenue", "Industrial Parkway", "Commerce Drive", "Elm Street", "River Road"]
+PROJECT_STATUSES = [("In Progress", "primary"), ("Planning", "info"), ("Completed", "success"),
+                    ("On Hold", "warning"), ("Cancelled", "danger")]
+PROJECT_KINDS = ["Office Renovation", "Kitchen Remodel", "Warehouse Expansion", "Roof Replacement",
+                 "Retail Buildout", "Parking Lot Repaving", "HVAC Upgrade", "Bathroom Remodel"]
+ACTIVITY_TYPES = ["vendor_added", "project_updated", "expense_approved", "time_log_added", "material_ordered"]
+UNITS = ["bag", "each", "board ft", "sq ft", "gallon", "box", "roll", "ton"]
+PAYMENT_TERMS = ["Net 15", "Net 30", "Net 45", "Net 60", "Due on Receipt"]
+
+START = datetime(2022, 1, 1)
+
+
+def table_sizes(rows: int) -> Dict[str, int]:
+    """Rows per table for a total, at least one each"""
+    return {table: max(1, int(rows * share)) for table, share in SHARES.items()}
+
+
+def _timestamp(rng: random.Random, days: int = 1200) -> str:
+    moment = START + timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _company(rng: random.Random) -> str:
+    return f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}"
+
+
+def _person(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _phone(rng: random.Random) -> str:
+    return f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"
+
+
+def generate(table: str, count: int, sizes: Dict[str, int], rng: random.Random) -> Iterator[Dict[str, Any]]:
+    """count rows for a table, referring to ids within the other tables' sizes"""
+    today = date.today()
+    for i in range(1, count + 1):
+        created = _timestamp(rng)
+        if table == "customers":
+            contact = _person(rng)
+            city, state, zip_code = rng.choice(CITIES)
+            yield {
+                "id": i, "name": f"{_company(rng)} {i}", "contact_name": contact,
+                "email": f"{contact.lower().replace(' ', '.')}{i}@example.com", "phone": _phone(rng),
+                "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}", "city": city, "state": state,
+                "zip": zip_code, "status": "Active" if rng.random() < 0.8 else "Inactive",
+                "customer_since": created[:10], "payment_terms": rng.choice(PAYMENT_TERMS),
+                "credit_limit": float(rng.randrange(5, 200) * 1000), "notes": "", "created_at": created,
+                "updated_at": created,
+            }
+        elif table == "projects":
+            status, color = rng.choice(PROJECT_STATUSES)
+            start = START.date() + timedelta(days=rng.randrange(1200))
+            budget = float(rng.randrange(10, 500) * 1000)
+            spent = round(budget * rng.random(), 2)
+            client_id = rng.randint(1, sizes["customers"])
+            yield {
+                "id": i, "name": f"{rng.choice(PROJECT_KINDS)} #{i}", "client_id": client_id,
+                "client_name": f"Customer {client_id}", "status": status, "status_color": color,
+                "start_date": start.isoformat(), "end_date": (start + timedelta(days=rng.randint(30, 365))).isoformat(),
+                "budget": budget, "spent": spent, "remaining": round(budget - spent, 2),
+                "description": f"{rng.choice(PROJECT_KINDS)} for customer {client_id}", "manager": _person(rng),
+                "team": [_person(rng) for _ in range(rng.randint(1, 5))], "progress": rng.randint(0, 100),
+                "created_at": created, "updated_at": created,
+            }
+        elif table == "vendors":
+            contact = _person(rng)
+            city, state, zip_code = rng.choice(CITIES)
+            yield {
+                "id": i, "name": f"{_company(rng)} Supply {i}",
+                "vendor_type": rng.choice(["Material", "Subcontractor", "Equipment"]), "contact_name": contact,
+                "email": f"{contact.lower().replace(' ', '.')}{i}@vendor.example.com", "phone": _phone(rng),
+                "address": {"street": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}", "city": city,
+                            "state": state, "zip": zip_code},
+                "material_categories": rng.sample(MATERIAL_CATEGORIES, rng.randint(1, 4)),
+                "lead_time_days": rng.randint(1, 21), "payment_terms": rng.choice(PAYMENT_TERMS),
+                "is_preferred": rng.random() < 0.2, "has_volume_discount": rng.random() < 0.3,
+                "quality_rating": rng.randint(1, 5), "insurance_policy": f"INS-{rng.randint(10000, 99999)}",
+                # Some expired, some expiring soon, most current
+                "insurance_expiry": (today + timedelta(days=rng.randint(-60, 400))).isoformat(),
+                "certifications": rng.sample(["ISO 9001", "Green Building Certified", "OSHA 30", "LEED"],
+                                             rng.randint(0, 2)),
+                "status": "active" if rng.random() < 0.85 else "inactive", "created_at": created,
+                "updated_at": created,
+            }
+        elif table == "materials":
+            yield {
+                "id": i, "vendor_id": rng.randint(1, sizes["vendors"]), "name": f"Material {i}",
+                "category": rng.choice(MATERIAL_CATEGORIES), "unit_price": round(rng.uniform(0.5, 500), 2),
+                "unit": rng.choice(UNITS), "min_order_quantity": rng.choice([1, 5, 10, 25, 100]),
+                "lead_time_days": rng.randint(1, 30), "quantity": rng.randint(0, 1000),
+                "status": rng.choice(["in_stock", "in_stock", "low_stock", "out_of_stock"]),
+                "quality_rating": rng.randint(1, 5),
+                "delivery_status": rng.choice(["on_time", "on_time", "delayed"]), "updated_at": created,
+            }
+        elif table == "purchases":
+            yield {
+                "id": i, "vendor_id": rng.randint(1, sizes["vendors"]), "project_id": rng.randint(1, sizes["projects"]),
+                "description": f"{rng.choice(MATERIAL_CATEGORIES)} order", "amount": round(rng.uniform(20, 25000), 2),
+                "date": created[:10], "category": rng.choice(MATERIAL_CATEGORIES),
+                "status": rng.choice(["approved", "approved", "approved", "pending", "rejected"]),
+                "invoice_number": f"INV-{i:07d}", "receipt_url": None, "notes": None, "created_at": created,
+                "updated_at": created,
+            }
+        elif table == "project_vendors":
+            yield {
+                "id": i, "project_id": rng.randint(1, sizes["projects"]), "vendor_id": rng.randint(1, sizes["vendors"]),
+                "status": "active" if rng.random() < 0.6 else "completed", "created_at": created,
+            }
+        elif table == "activity_log":
+            kind = rng.choice(ACTIVITY_TYPES)
+            yield {
+                "id": i, "type": kind, "description": f"{kind.replace('_', ' ').capitalize()} #{i}",
+                "created_at": created,
+            }
+        else:
+            raise ValueError(f"No generator for {table}")
+
+
+def seed(database: StubDatabase, rows: int, seed: int = 1, replace: bool = False,
+         log: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """Create and fill every table; returns rows per table
+
+    Tables that already exist are left alone unless replace is set.
+    """
+    sizes = table_sizes(rows)
+    existing = database.tables()
+    for table, columns in TABLES.items():
+        if table in existing:
+            if not replace:
+                continue
+            database.drop_table(table)
+        start = time.perf_counter()
+        database.create_table(table, columns)
+        # Each table has its own generator, so its rows don't depend on which others were seeded
+        rng = random.Random(f"{seed}:{table}")
+        count = database.bulk_insert(table, generate(table, sizes[table], sizes, rng))
+        # Indexed after loading, which is much faster than maintaining them row by row
+        for index_columns in INDEXES.get(table, []):
+            database.create_index(table, index_columns)
+        if log:
+            log(f"{table}: {count} rows in {time.perf_counter() - start:.1f} s")
+    database.connection().execute("ANALYZE")
+    return sizes
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Create and seed the Supabase stand-in's database")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--rows", type=int, default=100000, help="total rows across all tables")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replace", action="store_true", help="drop and regenerate existing tables")
+    args = parser.parse_args(argv)
+    seed(StubDatabase(args.db), args.rows, args.seed, args.replace, log=print)
+
+
+if __name__ == "__main__":
+    main()
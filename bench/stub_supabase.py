@@ -0,0 +1,970 @@
+"""
+Local stand-in for the Supabase REST and Storage APIs.
+
+Implements the part of PostgREST and Supabase Storage that the app uses, on
+top of a sqlite file, so pages can be benchmarked against realistic data
+sizes without a Supabase project:
+
+- /rest/v1/{table}: select with column lists and aliases; eq, neq, gt, gte,
+  lt, lte, like, ilike, is, in, cs, cd and ov filters and their not. forms;
+  or/and trees; order; limit, offset and Range; exact counts; single-object
+  responses; insert, upsert, update and delete, with return=representation.
+- /storage/v1: buckets, object upload and download, and the resumable (TUS)
+  uploads that services.storage sends.
+
+Column types are recorded when a table is created (see bench.seed), so
+filter values are compared as the column's type and its indexes are used.
+Rows with columns a table doesn't have yet add them, where PostgREST would
+reject the row. Embedded resources, full-text search and range operators
+aren't implemented and get a 400.
+
+Every request can be delayed by a fixed latency plus random jitter, to stand
+in for the network and database time of a hosted project:
+
+    python -m bench.seed --db /tmp/akc-bench.sqlite3 --rows 100000
+    python -m bench.stub_supabase --db /tmp/akc-bench.sqlite3 --latency-ms 5 --jitter-ms 3
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=<LOCAL_KEY> uvicorn app:app
+
+The stand-in doesn't check keys, but the Supabase client insists on one
+shaped like a JWT; LOCAL_KEY is one, and main() prints it.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import secrets
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+DEFAULT_DB = os.getenv("STUB_SUPABASE_DB", "/tmp/akc-stub-supabase.sqlite3")
+DEFAULT_PORT = 54321
+OBJECT_MEDIA_TYPE = "application/vnd.pgrst.object+json"
+# How each column type is stored: booleans as 0/1, lists and objects as JSON text
+COLUMN_TYPES = {"integer": "INTEGER", "real": "REAL", "text": "TEXT", "boolean": "INTEGER", "json": "TEXT"}
+BOOLEAN_LITERALS = {"true": 1, "t": 1, "false": 0, "f": 0}
+COMPARISONS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+# Query parameters that aren't column filters
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+TIMESTAMP_DEFAULT = "(strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))"
+
+
+def _jwt_part(value: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+LOCAL_KEY = f"{_jwt_part({'alg': 'HS256', 'typ': 'JWT'})}.{_jwt_part({'role': 'anon', 'iss': 'stub'})}.local"
+
+_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_LOGIC_TREE = re.compile(r"^(not\.)?(or|and)\(")
+
+_INTERNAL_SCHEMA = """
+create table if not exists _stub_columns (
+    tbl text not null,
+    name text not null,
+    type text not null,
+    position integer not null,
+    primary key (tbl, name)
+);
+create table if not exists _stub_buckets (
+    id text primary key,
+    name text not null,
+    public integer not null default 0,
+    file_size_limit integer,
+    allowed_mime_types text,
+    created_at text not null,
+    updated_at text not null
+);
+create table if not exists _stub_objects (
+    bucket text not null,
+    name text not null,
+    content_type text,
+    size integer not null,
+    data blob not null,
+    created_at text not null,
+    primary key (bucket, name)
+);
+"""
+
+
+class PostgrestError(Exception):
+    """An error to send back in PostgREST's error format"""
+
+    def __init__(self, status: int, code: str, message: str, details: Optional[str] = None,
+                 hint: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.details = details
+        self.hint = hint
+
+    def response(self) -> JSONResponse:
+        return JSONResponse(
+            {"code": self.code, "details": self.details, "hint": self.hint, "message": self.message},
+            status_code=self.status
+        )
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def column_type(value: Any) -> str:
+    """The column type a Python value is stored as"""
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "real"
+    if isinstance(value, (list, dict)):
+        return "json"
+    return "text"
+
+
+def quote(name: str) -> str:
+    """A table or column name quoted for SQL; anything but a plain identifier is refused"""
+    if not _NAME.match(name):
+        raise PostgrestError(400, "PGRST100", f'"{name}" is not a valid column or table name')
+    return f'"{name}"'
+
+
+def encode(kind: str, value: Any) -> Any:
+    """A value from a JSON body as stored in a column of the given type"""
+    if value is None:
+        return None
+    if kind == "json":
+        return json.dumps(value)
+    return literal(kind, value)
+
+
+def literal(kind: str, value: Any) -> Any:
+    """A filter value (text from the URL) or body value as a column of the given type"""
+    try:
+        if kind == "integer":
+            return int(value)
+        if kind == "real":
+            return float(value)
+        if kind == "boolean":
+            return BOOLEAN_LITERALS[value.lower()] if isinstance(value, str) else int(bool(value))
+    except (KeyError, TypeError, ValueError):
+        raise PostgrestError(400, "22P02", f'invalid input syntax for type {kind}: "{value}"')
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def decode(kind: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if kind == "boolean":
+        return bool(value)
+    if kind == "json":
+        return json.loads(value)
+    return value
+
+
+def split_items(text: str) -> List[str]:
+    """Split on commas that aren't inside parentheses, braces or double quotes"""
+    items, current, depth, quoted = [], [], 0, False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted:
+            if char in "({":
+                depth += 1
+            elif char in ")}":
+                depth -= 1
+            elif char == "," and depth == 0:
+                items.append("".join(current).strip())
+                current = []
+                continue
+        current.append(char)
+    items.append("".join(current).strip())
+    return [item for item in items if item]
+
+
+def unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"')
+    return value
+
+
+def _glob_pattern(pattern: str) -> str:
+    # like is case-sensitive, which sqlite's LIKE isn't, so it's run as GLOB
+    out = []
+    for char in pattern:
+        if char in "*%":
+            out.append("*")
+        elif char == "_":
+            out.append("?")
+        elif char in "[?":
+            out.append(f"[{char}]")
+        else:
+            out.append(char)
+    return "".join(out)
+
+
+def _array_values(value: str):
+    value = value.strip()
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, (list, dict)):
+        return parsed
+    if value.startswith("{") and value.endswith("}"):
+        # A Postgres array literal, e.g. {"Concrete & Masonry",Lumber}
+        return [unquote(item) for item in split_items(value[1:-1])]
+    raise PostgrestError(400, "22P02", f'malformed array literal: "{value}"')
+
+
+def _element_text(value: Any) -> str:
+    # json_each yields booleans as 1/0; everything is compared as text
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+class StubDatabase:
+    """The stand-in's tables, column types and stored objects, in one sqlite file"""
+
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._columns: Optional[Dict[str, Dict[str, str]]] = None
+        self.connection().executescript(_INTERNAL_SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection; statements autocommit unless run in transaction()"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _run(self, func, *args):
+        """Run func(conn, *args) in a transaction, mapping sqlite errors to PostgREST ones"""
+        conn = self.connection()
+        try:
+            conn.execute("BEGIN")
+            result = func(conn, *args)
+            conn.execute("COMMIT")
+            return result
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if isinstance(e, sqlite3.IntegrityError):
+                message = str(e)
+                if "UNIQUE" in message:
+                    raise PostgrestError(409, "23505", "duplicate key value violates unique constraint", message)
+                if "NOT NULL" in message:
+                    raise PostgrestError(400, "23502", "null value violates not-null constraint", message)
+                raise PostgrestError(400, "23000", message)
+            if isinstance(e, sqlite3.OperationalError):
+                raise PostgrestError(400, "42000", str(e))
+            raise
+
+    # Schema
+
+    def tables(self) -> Dict[str, Dict[str, str]]:
+        """Column types by column, by table"""
+        columns = self._columns
+        if columns is None:
+            with self._schema_lock:
+                columns = {}
+                for table, name, kind in self.connection().execute(
+                    "SELECT tbl, name, type FROM _stub_columns ORDER BY tbl, position"
+                ):
+                    columns.setdefault(table, {})[name] = kind
+                self._columns = columns
+        return columns
+
+    def columns(self, table: str) -> Dict[str, str]:
+        columns = self.tables().get(table)
+        if columns is None:
+            raise PostgrestError(404, "42P01", f'relation "public.{table}" does not exist')
+        return columns
+
+    def create_table(self, table: str, columns: Dict[str, str]) -> None:
+        """Create a table with typed columns; an integer or text "id" is the primary key"""
+        definitions = []
+        for name, kind in columns.items():
+            if kind not in COLUMN_TYPES:
+                raise ValueError(f"Unknown column type {kind} for {table}.{name}")
+            definition = f"{quote(name)} {COLUMN_TYPES[kind]}"
+            if name == "id":
+                definition += " PRIMARY KEY"
+            elif name in ("created_at", "updated_at"):
+                definition += f" DEFAULT {TIMESTAMP_DEFAULT}"
+            definitions.append(definition)
+
+        def create(conn):
+            conn.execute(f"CREATE TABLE {quote(table)} ({', '.join(definitions)})")
+            conn.executemany(
+                "INSERT INTO _stub_columns (tbl, name, type, position) VALUES (?, ?, ?, ?)",
+                [(table, name, kind, position) for position, (name, kind) in enumerate(columns.items())]
+            )
+
+        with self._schema_lock:
+            self._run(create)
+            self._columns = None
+
+    def drop_table(self, table: str) -> None:
+        def drop(conn):
+            conn.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            conn.execute("DELETE FROM _stub_columns WHERE tbl = ?", (table,))
+
+        with self._schema_lock:
+            self._run(drop)
+            self._columns = None
+
+    def create_index(self, table: str, columns: Iterable[str], unique: bool = False) -> None:
+        columns = list(columns)
+        name = f"idx_{table}_{'_'.join(columns)}"
+        self.connection().execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {quote(name)} "
+            f"ON {quote(table)} ({', '.join(quote(c) for c in columns)})"
+        )
+
+    def _add_columns(self, table: str, rows: List[Dict[str, Any]]) -> Dict[str, str]:
+        columns = self.columns(table)
+        new = {}
+        for row in rows:
+            for name, value in row.items():
+                if name not in columns and name not in new and value is not None:
+                    new[name] = column_type(value)
+        if not new:
+            return columns
+
+        def alter(conn):
+            for position, (name, kind) in enumerate(new.items(), start=len(columns)):
+                conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {COLUMN_TYPES[kind]}")
+                conn.execute(
+                    "INSERT INTO _stub_columns (tbl, name, type, position) VALUES (?, ?, ?, ?)",
+                    (table, name, kind, position)
+                )
+
+        with self._schema_lock:
+            self._run(alter)
+            self._columns = None
+        return self.columns(table)
+
+    # Query translation
+
+    def _condition(self, table: str, columns: Dict[str, str], column: str, expression: str,
+                   in_tree: bool = False) -> Tuple[str, list]:
+        kind = columns.get(column)
+        if kind is None:
+            raise PostgrestError(400, "42703", f"column {table}.{column} does not exist")
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        operator, separator, value = expression.partition(".")
+        if not separator:
+            raise PostgrestError(400, "PGRST100", f'failed to parse filter ({column}={expression})')
+        if in_tree:
+            value = unquote(value)
+        name = quote(column)
+
+        if operator in COMPARISONS:
+            sql, args = f"{name} {COMPARISONS[operator]} ?", [literal(kind, value)]
+        elif operator == "like":
+            sql, args = f"{name} GLOB ?", [_glob_pattern(value)]
+        elif operator == "ilike":
+            sql, args = f"{name} LIKE ?", [value.replace("*", "%")]
+        elif operator == "is":
+            if value.lower() in ("null", "unknown"):
+                sql, args = f"{name} IS NULL", []
+            elif value.lower() in ("true", "false"):
+                sql, args = f"{name} = ?", [BOOLEAN_LITERALS[value.lower()]]
+            else:
+                raise PostgrestError(400, "PGRST100", f'failed to parse filter (is.{value})')
+        elif operator == "in":
+            value = value.strip()
+            if not (value.startswith("(") and value.endswith(")")):
+                raise PostgrestError(400, "PGRST100", f'failed to parse filter (in.{value})')
+            items = [literal(kind, unquote(item)) for item in split_items(value[1:-1])]
+            sql, args = (f"{name} IN ({', '.join('?' * len(items))})", items) if items else ("0", [])
+        elif operator in ("cs", "cd", "ov"):
+            if kind != "json":
+                raise PostgrestError(400, "PGRST100", f"{operator} on {table}.{column} isn't supported by the stand-in")
+            sql, args = self._array_condition(name, operator, _array_values(value))
+        else:
+            raise PostgrestError(400, "PGRST100", f'operator "{operator}" isn\'t supported by the stand-in')
+        return (f"NOT ({sql})" if negate else sql), args
+
+    @staticmethod
+    def _array_condition(name: str, operator: str, values) -> Tuple[str, list]:
+        if isinstance(values, dict):
+            if operator != "cs":
+                raise PostgrestError(400, "PGRST100", f"{operator} with an object isn't supported by the stand-in")
+            terms, args = [], []
+            for key, value in values.items():
+                if isinstance(value, (list, dict)):
+                    raise PostgrestError(400, "PGRST100", "nested containment isn't supported by the stand-in")
+                terms.append(f"json_extract({name}, ?) = ?")
+                args += [f'$."{key}"', int(value) if isinstance(value, bool) else value]
+            return (" AND ".join(terms) or "1"), args
+
+        elements = [_element_text(value) for value in values]
+        marks = ", ".join("?" * len(elements))
+        if operator == "cs":
+            terms = [f"EXISTS (SELECT 1 FROM json_each({name}) WHERE CAST(value AS TEXT) = ?)" for _ in elements]
+            return (" AND ".join(terms) or "1"), elements
+        if operator == "ov":
+            if not elements:
+                return "0", []
+            return f"EXISTS (SELECT 1 FROM json_each({name}) WHERE CAST(value AS TEXT) IN ({marks}))", elements
+        if not elements:
+            return f"({name} IS NOT NULL AND json_array_length({name}) = 0)", []
+        return (f"({name} IS NOT NULL AND NOT EXISTS "
+                f"(SELECT 1 FROM json_each({name}) WHERE CAST(value AS TEXT) NOT IN ({marks})))"), elements
+
+    def _tree(self, table: str, columns: Dict[str, str], operator: str, text: str) -> Tuple[str, list]:
+        text = text.strip()
+        if not (text.startswith("(") and text.endswith(")")):
+            raise PostgrestError(400, "PGRST100", f'failed to parse logic tree ({text})')
+        terms, args = [], []
+        for item in split_items(text[1:-1]):
+            match = _LOGIC_TREE.match(item)
+            if match:
+                sql, item_args = self._tree(table, columns, match.group(2), item[match.end() - 1:])
+                if match.group(1):
+                    sql = f"NOT ({sql})"
+            else:
+                column, _, expression = item.partition(".")
+                sql, item_args = self._condition(table, columns, column, expression, in_tree=True)
+            terms.append(sql)
+            args += item_args
+        if not terms:
+            return "1", []
+        return "(" + f" {operator.upper()} ".join(terms) + ")", args
+
+    def _where(self, table: str, columns: Dict[str, str], params: List[Tuple[str, str]]) -> Tuple[str, list]:
+        terms, args = [], []
+        for key, value in params:
+            if key in RESERVED_PARAMS:
+                continue
+            if key in ("or", "and", "not.or", "not.and"):
+                negate = key.startswith("not.")
+                sql, item_args = self._tree(table, columns, key.rpartition(".")[2], value)
+                if negate:
+                    sql = f"NOT ({sql})"
+            elif "." in key:
+                raise PostgrestError(400, "PGRST108", f"'{key}': embedded resources aren't supported by the stand-in")
+            else:
+                sql, item_args = self._condition(table, columns, key, value)
+            terms.append(sql)
+            args += item_args
+        return (" WHERE " + " AND ".join(terms) if terms else ""), args
+
+    @staticmethod
+    def _projection(table: str, columns: Dict[str, str], select: Optional[str]) -> List[Tuple[str, str]]:
+        """(output name, column) pairs for a select parameter"""
+        if not select or select == "*":
+            return [(name, name) for name in columns]
+        pairs = []
+        for item in split_items(select):
+            if "(" in item:
+                raise PostgrestError(400, "PGRST200", f"'{item}': embedded resources aren't supported by the stand-in")
+            if item == "*":
+                pairs += [(name, name) for name in columns]
+                continue
+            item = item.split("::", 1)[0]
+            alias, separator, column = item.partition(":")
+            column = column if separator else alias
+            if column not in columns:
+                raise PostgrestError(400, "42703", f"column {table}.{column} does not exist")
+            pairs.append((alias, column))
+        return pairs
+
+    @staticmethod
+    def _order_by(table: str, columns: Dict[str, str], order: Optional[str]) -> str:
+        if not order:
+            return ""
+        terms = []
+        for item in split_items(order):
+            column, *modifiers = item.split(".")
+            if column not in columns:
+                raise PostgrestError(400, "42703", f"column {table}.{column} does not exist")
+            descending = "desc" in modifiers
+            # Postgres puts nulls last going up and first going down
+            if "nullsfirst" in modifiers:
+                nulls = "FIRST"
+            elif "nullslast" in modifiers:
+                nulls = "LAST"
+            else:
+                nulls = "FIRST" if descending else "LAST"
+            terms.append(f"{quote(column)} {'DESC' if descending else 'ASC'} NULLS {nulls}")
+        return " ORDER BY " + ", ".join(terms)
+
+    @staticmethod
+    def _decode_rows(cursor, columns: Dict[str, str], pairs: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        names = [d[0] for d in cursor.description]
+        index = {name: i for i, name in enumerate(names)}
+        kinds = [(alias, index[column], columns.get(column, "text")) for alias, column in pairs]
+        return [{alias: decode(kind, row[i]) for alias, i, kind in kinds} for row in cursor.fetchall()]
+
+    # Table operations
+
+    def select(self, table: str, params: List[Tuple[str, str]], offset: int = 0, limit: Optional[int] = None,
+               count: bool = False) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Rows matching the query, and the total without paging if count is set"""
+        columns = self.columns(table)
+        options = dict(params)
+        pairs = self._projection(table, columns, options.get("select"))
+        where, args = self._where(table, columns, params)
+        order = self._order_by(table, columns, options.get("order"))
+        selected = ", ".join(sorted({quote(column) for _, column in pairs})) or "1"
+
+        def run(conn):
+            cursor = conn.execute(
+                f"SELECT {selected} FROM {quote(table)}{where}{order} LIMIT ? OFFSET ?",
+                args + [-1 if limit is None else limit, offset]
+            )
+            rows = self._decode_rows(cursor, columns, pairs)
+            total = None
+            if count:
+                total = conn.execute(f"SELECT count(*) FROM {quote(table)}{where}", args).fetchone()[0]
+            return rows, total
+
+        return self._run(run)
+
+    def insert(self, table: str, rows: List[Dict[str, Any]], params: List[Tuple[str, str]],
+               resolution: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Insert rows, or upsert them with resolution "merge" or "ignore"; returns the rows written"""
+        options = dict(params)
+        if options.get("columns"):
+            keep = set(split_items(options["columns"]))
+            rows = [{k: v for k, v in row.items() if k in keep} for row in rows]
+        columns = self._add_columns(table, rows)
+        pairs = self._projection(table, columns, options.get("select"))
+        target = split_items(options.get("on_conflict") or "id")
+        for name in target:
+            quote(name)
+
+        def run(conn):
+            written = []
+            for row in rows:
+                keys = list(row)
+                if keys:
+                    sql = (f"INSERT INTO {quote(table)} ({', '.join(quote(k) for k in keys)}) "
+                           f"VALUES ({', '.join('?' * len(keys))})")
+                else:
+                    sql = f"INSERT INTO {quote(table)} DEFAULT VALUES"
+                updates = [k for k in keys if k not in target]
+                if resolution == "merge" and updates:
+                    sql += (f" ON CONFLICT ({', '.join(quote(k) for k in target)}) DO UPDATE SET "
+                            + ", ".join(f"{quote(k)} = excluded.{quote(k)}" for k in updates))
+                elif resolution:
+                    sql += f" ON CONFLICT ({', '.join(quote(k) for k in target)}) DO NOTHING"
+                cursor = conn.execute(sql + " RETURNING *", [encode(columns[k], row[k]) for k in keys])
+                written += self._decode_rows(cursor, columns, pairs)
+            return written
+
+        return self._run(run)
+
+    def update(self, table: str, values: Dict[str, Any], params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        columns = self._add_columns(table, [values])
+        pairs = self._projection(table, columns, dict(params).get("select"))
+        where, args = self._where(table, columns, params)
+        if not values:
+            return []
+        assignments = ", ".join(f"{quote(k)} = ?" for k in values)
+
+        def run(conn):
+            cursor = conn.execute(
+                f"UPDATE {quote(table)} SET {assignments}{where} RETURNING *",
+                [encode(columns[k], v) for k, v in values.items()] + args
+            )
+            return self._decode_rows(cursor, columns, pairs)
+
+        return self._run(run)
+
+    def delete(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        columns = self.columns(table)
+        pairs = self._projection(table, columns, dict(params).get("select"))
+        where, args = self._where(table, columns, params)
+
+        def run(conn):
+            cursor = conn.execute(f"DELETE FROM {quote(table)}{where} RETURNING *", args)
+            return self._decode_rows(cursor, columns, pairs)
+
+        return self._run(run)
+
+    def bulk_insert(self, table: str, rows: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+        """Load rows with the table's columns straight into sqlite, for seeding; returns how many"""
+        columns = self.columns(table)
+        names = list(columns)
+        sql = (f"INSERT INTO {quote(table)} ({', '.join(quote(n) for n in names)}) "
+               f"VALUES ({', '.join('?' * len(names))})")
+        total = 0
+        batch = []
+
+        def flush(conn, batch):
+            conn.executemany(sql, batch)
+
+        for row in rows:
+            batch.append([encode(columns[n], row.get(n)) for n in names])
+            if len(batch) >= batch_size:
+                self._run(flush, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self._run(flush, batch)
+            total += len(batch)
+        return total
+
+    # Storage
+
+    def get_bucket(self, bucket_id: str) -> Optional[Dict[str, Any]]:
+        row = self.connection().execute(
+            "SELECT id, name, public, file_size_limit, allowed_mime_types, created_at, updated_at "
+            "FROM _stub_buckets WHERE id = ?", (bucket_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "name": row[1], "owner": "", "public": bool(row[2]),
+            "file_size_limit": row[3], "allowed_mime_types": json.loads(row[4]) if row[4] else None,
+            "created_at": row[5], "updated_at": row[6]
+        }
+
+    def list_buckets(self) -> List[Dict[str, Any]]:
+        ids = [row[0] for row in self.connection().execute("SELECT id FROM _stub_buckets ORDER BY id")]
+        return [self.get_bucket(bucket_id) for bucket_id in ids]
+
+    def create_bucket(self, bucket_id: str, name: Optional[str] = None, public: bool = False,
+                      file_size_limit: Optional[int] = None, allowed_mime_types: Optional[List[str]] = None) -> bool:
+        """Create a bucket; False if it already exists"""
+        now = now_iso()
+        cursor = self.connection().execute(
+            "INSERT OR IGNORE INTO _stub_buckets "
+            "(id, name, public, file_size_limit, allowed_mime_types, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (bucket_id, name or bucket_id, int(bool(public)), file_size_limit,
+             json.dumps(allowed_mime_types) if allowed_mime_types else None, now, now)
+        )
+        return cursor.rowcount == 1
+
+    def object_exists(self, bucket: str, name: str) -> bool:
+        return self.connection().execute(
+            "SELECT 1 FROM _stub_objects WHERE bucket = ? AND name = ?", (bucket, name)
+        ).fetchone() is not None
+
+    def put_object(self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None,
+                   upsert: bool = False) -> bool:
+        """Store an object; False if it exists and upsert isn't set"""
+        verb = "INSERT OR REPLACE" if upsert else "INSERT OR IGNORE"
+        cursor = self.connection().execute(
+            f"{verb} INTO _stub_objects (bucket, name, content_type, size, data, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (bucket, name, content_type, len(data), data, now_iso())
+        )
+        return cursor.rowcount == 1
+
+    def get_object(self, bucket: str, name: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        row = self.connection().execute(
+            "SELECT data, content_type FROM _stub_objects WHERE bucket = ? AND name = ?", (bucket, name)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+
+# REST API
+
+def _prefer(request: Request) -> Dict[str, str]:
+    prefer = {}
+    for item in request.headers.get("prefer", "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key:
+            prefer[key] = value
+    return prefer
+
+
+def _paging(request: Request, params: Dict[str, str]) -> Tuple[int, Optional[int]]:
+    try:
+        offset = int(params["offset"]) if "offset" in params else None
+        limit = int(params["limit"]) if "limit" in params else None
+    except ValueError:
+        raise PostgrestError(400, "PGRST100", "limit and offset must be integers")
+    range_header = request.headers.get("range")
+    if range_header:
+        start, _, end = range_header.partition("-")
+        try:
+            start = int(start)
+            range_limit = int(end) - start + 1 if end else None
+        except ValueError:
+            raise PostgrestError(416, "PGRST103", f"Requested range not satisfiable: {range_header}")
+        if offset is None:
+            offset = start
+        if range_limit is not None:
+            limit = range_limit if limit is None else min(limit, range_limit)
+    return offset or 0, limit
+
+
+def _content_range(offset: int, returned: int, total: Optional[int]) -> str:
+    total_text = "*" if total is None else str(total)
+    if not returned:
+        return f"*/{total_text}"
+    return f"{offset}-{offset + returned - 1}/{total_text}"
+
+
+def _rows_response(request: Request, rows: List[Dict[str, Any]], status: int,
+                   headers: Dict[str, str]) -> Response:
+    if OBJECT_MEDIA_TYPE in request.headers.get("accept", ""):
+        if len(rows) != 1:
+            raise PostgrestError(
+                406, "PGRST116", "JSON object requested, multiple (or no) rows returned",
+                f"Results contain {len(rows)} rows, {OBJECT_MEDIA_TYPE} requires 1 row"
+            )
+        return JSONResponse(rows[0], status_code=status, headers=headers, media_type=OBJECT_MEDIA_TYPE)
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers)
+    return JSONResponse(rows, status_code=status, headers=headers)
+
+
+async def rest_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    table = request.path_params["table"]
+    params = list(request.query_params.multi_items())
+    options = dict(params)
+    prefer = _prefer(request)
+    count = prefer.get("count") in ("exact", "planned", "estimated")
+    representation = prefer.get("return") == "representation"
+    try:
+        if table.startswith("_stub_"):
+            raise PostgrestError(404, "42P01", f'relation "public.{table}" does not exist')
+        if request.method in ("GET", "HEAD"):
+            offset, limit = _paging(request, options)
+            rows, total = await run_in_threadpool(database.select, table, params, offset, limit, count)
+            headers = {"Content-Range": _content_range(offset, len(rows), total)}
+            return _rows_response(request, rows, 200, headers)
+
+        body = None
+        if request.method in ("POST", "PATCH"):
+            try:
+                body = json.loads(await request.body() or b"null")
+            except ValueError:
+                raise PostgrestError(400, "PGRST102", "Empty or invalid json")
+        if request.method == "POST":
+            rows = body if isinstance(body, list) else [body]
+            if not all(isinstance(row, dict) for row in rows):
+                raise PostgrestError(400, "PGRST102", "All object keys must match")
+            resolution = prefer.get("resolution", "").replace("-duplicates", "") or None
+            written = await run_in_threadpool(database.insert, table, rows, params, resolution)
+            status = 201
+        elif request.method == "PATCH":
+            if not isinstance(body, dict):
+                raise PostgrestError(400, "PGRST102", "Empty or invalid json")
+            written = await run_in_threadpool(database.update, table, body, params)
+            status = 200
+        else:
+            written = await run_in_threadpool(database.delete, table, params)
+            status = 200
+
+        headers = {"Content-Range": _content_range(0, len(written), len(written) if count else None)}
+        if not representation:
+            return Response(status_code=201 if status == 201 else 204, headers=headers)
+        return _rows_response(request, written, status, headers)
+    except PostgrestError as e:
+        return e.response()
+
+
+# Storage API
+
+def _storage_error(status: int, error: str, message: str) -> JSONResponse:
+    return JSONResponse({"statusCode": str(status), "error": error, "message": message}, status_code=status)
+
+
+async def buckets_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    if request.method == "GET":
+        return JSONResponse(await run_in_threadpool(database.list_buckets))
+    options = await request.json()
+    bucket_id = options.get("id") or options.get("name")
+    if not bucket_id:
+        return _storage_error(400, "Invalid Input", "A bucket id is required")
+    created = await run_in_threadpool(
+        database.create_bucket, bucket_id, options.get("name"), options.get("public", False),
+        options.get("file_size_limit"), options.get("allowed_mime_types")
+    )
+    if not created:
+        return _storage_error(409, "Duplicate", "The resource already exists")
+    return JSONResponse({"name": bucket_id})
+
+
+async def bucket_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    bucket = await run_in_threadpool(database.get_bucket, request.path_params["bucket_id"])
+    if bucket is None:
+        return _storage_error(404, "Bucket not found", "Bucket not found")
+    return JSONResponse(bucket)
+
+
+async def object_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    bucket, name = request.path_params["bucket"], request.path_params["path"]
+    if request.method == "GET":
+        stored = await run_in_threadpool(database.get_object, bucket, name)
+        if stored is None:
+            return _storage_error(404, "not_found", "Object not found")
+        return Response(stored[0], media_type=stored[1] or "application/octet-stream")
+
+    if await run_in_threadpool(database.get_bucket, bucket) is None:
+        return _storage_error(404, "Bucket not found", "Bucket not found")
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            return _storage_error(400, "Invalid Input", "A file is required")
+        data, content_type = await upload.read(), upload.content_type
+    else:
+        data, content_type = await request.body(), request.headers.get("content-type")
+    # PUT replaces an object, as does POST with x-upsert
+    upsert = request.method == "PUT" or request.headers.get("x-upsert", "").lower() == "true"
+    if not await run_in_threadpool(database.put_object, bucket, name, data, content_type, upsert):
+        return _storage_error(409, "Duplicate", "The resource already exists")
+    return JSONResponse({"Key": f"{bucket}/{name}"})
+
+
+class ResumableUploads:
+    """Resumable (TUS) uploads in progress; finished ones are stored as objects"""
+
+    def __init__(self):
+        self._uploads: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, bucket: str, name: str, length: int, content_type: Optional[str], upsert: bool) -> str:
+        upload_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._uploads[upload_id] = {
+                "bucket": bucket, "name": name, "length": length, "content_type": content_type,
+                "upsert": upsert, "offset": 0, "data": bytearray()
+            }
+        return upload_id
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+
+def _tus_metadata(header: str) -> Dict[str, str]:
+    metadata = {}
+    for item in header.split(","):
+        key, _, value = item.strip().partition(" ")
+        if key:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+    return metadata
+
+
+async def resumable_start_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    metadata = _tus_metadata(request.headers.get("upload-metadata", ""))
+    bucket, name = metadata.get("bucketName"), metadata.get("objectName")
+    try:
+        length = int(request.headers["upload-length"])
+    except (KeyError, ValueError):
+        return _storage_error(400, "Invalid Input", "Upload-Length is required")
+    if not bucket or not name:
+        return _storage_error(400, "Invalid Input", "bucketName and objectName are required")
+    if await run_in_threadpool(database.get_bucket, bucket) is None:
+        return _storage_error(404, "Bucket not found", "Bucket not found")
+    upsert = request.headers.get("x-upsert", "").lower() == "true"
+    if not upsert and await run_in_threadpool(database.object_exists, bucket, name):
+        return _storage_error(409, "Duplicate", "The resource already exists")
+    upload_id = request.app.state.uploads.start(bucket, name, length, metadata.get("contentType"), upsert)
+    location = str(request.url_for("resumable_upload", upload_id=upload_id))
+    return Response(status_code=201, headers={"Location": location, "Tus-Resumable": "1.0.0"})
+
+
+async def resumable_upload_endpoint(request: Request) -> Response:
+    database: StubDatabase = request.app.state.database
+    upload = request.app.state.uploads.get(request.path_params["upload_id"])
+    if upload is None:
+        return Response(status_code=404)
+    if request.method == "HEAD":
+        return Response(status_code=200, headers={
+            "Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["length"]),
+            "Tus-Resumable": "1.0.0", "Cache-Control": "no-store"
+        })
+
+    if request.headers.get("upload-offset") != str(upload["offset"]):
+        return Response(status_code=409, headers={"Upload-Offset": str(upload["offset"])})
+    chunk = await request.body()
+    if upload["offset"] + len(chunk) > upload["length"]:
+        return _storage_error(413, "Payload too large", "The chunk goes past Upload-Length")
+    upload["data"] += chunk
+    upload["offset"] += len(chunk)
+    if upload["offset"] == upload["length"]:
+        stored = await run_in_threadpool(
+            database.put_object, upload["bucket"], upload["name"], bytes(upload["data"]),
+            upload["content_type"], upload["upsert"]
+        )
+        upload["data"] = bytearray()
+        if not stored:
+            return _storage_error(409, "Duplicate", "The resource already exists")
+    return Response(status_code=204, headers={"Upload-Offset": str(upload["offset"]), "Tus-Resumable": "1.0.0"})
+
+
+class LatencyMiddleware:
+    """ASGI middleware delaying every request by a fixed latency plus up to jitter seconds"""
+
+    def __init__(self, app, latency: float = 0.0, jitter: float = 0.0):
+        self.app = app
+        self.latency = latency
+        self.jitter = jitter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        await self.app(scope, receive, send)
+
+
+def create_app(database: Optional[StubDatabase] = None, latency: float = 0.0, jitter: float = 0.0) -> Starlette:
+    """The stand-in as an ASGI app; latency and jitter are in seconds"""
+    app = Starlette(routes=[
+        Route("/rest/v1/{table}", rest_endpoint, methods=["GET", "HEAD", "POST", "PATCH", "DELETE"]),
+        Route("/storage/v1/bucket", buckets_endpoint, methods=["GET", "POST"]),
+        Route("/storage/v1/bucket/{bucket_id}", bucket_endpoint, methods=["GET"]),
+        Route("/storage/v1/object/{bucket}/{path:path}", object_endpoint, methods=["GET", "POST", "PUT"]),
+        Route("/storage/v1/upload/resumable", resumable_start_endpoint, methods=["POST"]),
+        Route("/storage/v1/upload/resumable/{upload_id}", resumable_upload_endpoint,
+              methods=["HEAD", "PATCH"], name="resumable_upload"),
+    ])
+    app.state.database = database or StubDatabase()
+    app.state.uploads = ResumableUploads()
+    app.add_middleware(LatencyMiddleware, latency=latency, jitter=jitter)
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the local Supabase stand-in")
+    parser.add_argument("--db", default=DEFAULT_DB, help="sqlite file, seeded with bench.seed")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra delay, up to this much")
+    args = parser.parse_args(argv)
+
+    app = create_app(StubDatabase(args.db), args.latency_ms / 1000, args.jitter_ms / 1000)
+    print(f"Serving {args.db} as SUPABASE_URL=http://{args.host}:{args.port} SUPABASE_KEY={LOCAL_KEY}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Gunicorn settings for running the app in production.
+
+Runs Uvicorn workers, one per CPU the container is allowed to use, so a slow
+report or template render only holds up its own worker. The app is imported
+and its caches warmed once in the master before workers are forked, and
+workers are recycled gracefully after a number of requests so memory growth
+never builds up.
+
+    gunicorn app:app -c gunicorn.conf.py
+"""
+import math
+import os
+import sys
+
+
+def cpu_quota() -> int:
+    """CPUs this container may use: its cgroup CPU quota if it has one, else the CPUs it can run on"""
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8080')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or cpu_quota()
+
+# Import the app in the master so workers share its memory and warm caches
+preload_app = True
+
+# Recycle each worker after this many requests (jittered so they don't all restart together);
+# a recycled worker finishes its in-flight requests first
+max_requests = int(os.getenv("MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Request logging goes through the app's structured logs rather than an access log
+accesslog = None
+errorlog = "-"
+
+# In-memory sessions would be per worker; share them through a file unless configured otherwise
+if workers > 1:
+    os.environ.setdefault("SESSION_BACKEND", "sqlite")
+
+# Templates compiled once in the master, with their bytecode cached on disk for restarts
+os.environ.setdefault("TEMPLATE_MODE", "production")
+
+
+def when_ready(server):
+    """Warm caches in the master once the app is loaded, before any worker is forked"""
+    from services.warmup import run_warmups
+    run_warmups()
+    server.log.info("Serving with %d workers", workers)
+
+
+def post_fork(server, worker):
+    # The Supabase client made at import may hold pooled connections opened by the master;
+    # each worker gets its own rather than sharing those sockets
+    app_module = sys.modules.get("app")
+    if app_module is not None and getattr(app_module, "supabase", None) is not None:
+        app_module.supabase = app_module.get_supabase_client()
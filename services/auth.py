@@ -0,0 +1,227 @@
+"""
+Cached verification of Supabase Auth access tokens.
+
+Verifying a JWT means parsing it, checking its signature and validating its
+claims, and with asymmetric keys it also needs the project's JWKS. Signing
+keys are fetched once and kept (an unknown key id triggers a rate-limited
+refresh, which is how key rotation shows up), and the claims of a verified
+token are kept until the token's exp, so for a client that repeats the same
+bearer token on every request, authentication after the first is a dict
+lookup. Tokens that fail verification are never cached.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+import jwt
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+AUTH_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+CLAIMS_CACHE_SIZE = int(os.getenv("AUTH_CLAIMS_CACHE_SIZE", "10000"))
+# Signing keys are re-fetched after this long even if every kid is known
+JWKS_TTL = 3600
+# An unknown kid re-fetches the JWKS at most this often, so junk tokens can't hammer Supabase
+JWKS_MIN_REFRESH_INTERVAL = 60
+JWKS_TIMEOUT = 10
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+
+class AuthError(Exception):
+    """Raised when a token can't be verified"""
+
+
+class SigningKeyCache:
+    """Signing keys from a JWKS endpoint, by key id"""
+
+    def __init__(self, jwks_url: str, fetch: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 ttl: float = JWKS_TTL, min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.jwks_url = jwks_url
+        self.fetch = fetch or _fetch_jwks
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self, kid: Optional[str]):
+        """The key for a key id, fetching the JWKS if it's stale or the kid is new"""
+        key = self._keys.get(kid)
+        if key is not None and not self._stale():
+            return key
+        with self._lock:
+            key = self._keys.get(kid)
+            now = self.clock()
+            recently_fetched = self._fetched_at is not None and now - self._fetched_at < self.min_refresh_interval
+            if (key is None or self._stale()) and not recently_fetched:
+                self._refresh(now)
+                key = self._keys.get(kid)
+        if key is None:
+            raise AuthError(f"Unknown signing key: {kid}")
+        return key
+
+    def _stale(self) -> bool:
+        return self._fetched_at is None or self.clock() - self._fetched_at >= self.ttl
+
+    def _refresh(self, now: float) -> None:
+        self._fetched_at = now
+        try:
+            jwks = self.fetch(self.jwks_url)
+        except Exception as e:
+            # Keep serving the keys we have; a rotated-out key still fails on its own
+            logger.warning(f"Could not fetch signing keys from {self.jwks_url}: {e}")
+            return
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk).key
+            except jwt.PyJWTError as e:
+                logger.warning(f"Skipping unusable signing key {jwk.get('kid')}: {e}")
+        self._keys = keys
+
+
+def _fetch_jwks(url: str) -> Dict[str, Any]:
+    response = httpx.get(url, timeout=JWKS_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+class TokenVerifier:
+    """Verifies access tokens and caches their claims until they expire
+
+    HS256 tokens are checked against the project's JWT secret and
+    asymmetrically signed tokens against keys from signing_keys; either may
+    be left out if the project doesn't use it.
+    """
+
+    def __init__(self, secret: Optional[str] = None, signing_keys: Optional[SigningKeyCache] = None,
+                 audience: Optional[str] = AUTH_AUDIENCE, issuer: Optional[str] = None,
+                 cache_size: int = CLAIMS_CACHE_SIZE, clock: Callable[[], float] = time.time):
+        self.secret = secret
+        self.signing_keys = signing_keys
+        self.audience = audience
+        self.issuer = issuer
+        self.cache_size = cache_size
+        self.clock = clock
+        self._claims: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, token: str) -> Optional[Dict[str, Any]]:
+        """Claims of a token verified earlier that hasn't expired yet, or None"""
+        with self._lock:
+            entry = self._claims.get(token)
+            if entry is None:
+                return None
+            claims, expires = entry
+            if expires <= self.clock():
+                del self._claims[token]
+                return None
+            self._claims.move_to_end(token)
+            return claims
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Claims of a valid token; raises AuthError otherwise"""
+        claims = self.cached(token)
+        if claims is not None:
+            return claims
+
+        claims = self._decode(token)
+        with self._lock:
+            self._claims[token] = (claims, claims["exp"])
+            self._claims.move_to_end(token)
+            while len(self._claims) > self.cache_size:
+                self._claims.popitem(last=False)
+        return claims
+
+    def _decode(self, token: str) -> Dict[str, Any]:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise AuthError(f"Malformed token: {e}")
+
+        algorithm = header.get("alg")
+        if algorithm == "HS256" and self.secret:
+            key = self.secret
+        elif algorithm in ASYMMETRIC_ALGORITHMS and self.signing_keys:
+            key = self.signing_keys.get(header.get("kid"))
+        else:
+            raise AuthError(f"Unsupported token algorithm: {algorithm}")
+
+        try:
+            return jwt.decode(
+                token, key, algorithms=[algorithm],
+                audience=self.audience, issuer=self.issuer,
+                options={"require": ["exp"], "verify_aud": self.audience is not None}
+            )
+        except jwt.PyJWTError as e:
+            raise AuthError(str(e))
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._claims.pop(token, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._claims.clear()
+
+
+def create_token_verifier() -> TokenVerifier:
+    """Token verifier for the project in SUPABASE_URL, using SUPABASE_JWT_SECRET if set"""
+    supabase_url = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+    signing_keys = None
+    issuer = None
+    if supabase_url:
+        signing_keys = SigningKeyCache(f"{supabase_url}/auth/v1/.well-known/jwks.json")
+        issuer = f"{supabase_url}/auth/v1"
+    return TokenVerifier(secret=os.getenv("SUPABASE_JWT_SECRET"), signing_keys=signing_keys, issuer=issuer)
+
+
+def user_role(claims: Dict[str, Any]) -> Optional[str]:
+    """The application role from app_metadata, falling back to the token's role claim"""
+    return (claims.get("app_metadata") or {}).get("role") or claims.get("role")
+
+
+class BearerAuth:
+    """FastAPI dependency returning the verified claims of the request's bearer token
+
+        @app.get("/api/projects")
+        async def api_projects(claims: dict = Depends(require_user)):
+            ...
+    """
+
+    def __init__(self, verifier: Optional[TokenVerifier] = None, role: Optional[str] = None):
+        self.verifier = verifier
+        self.role = role
+
+    async def __call__(self, request: Request) -> Dict[str, Any]:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+        verifier = self.verifier or token_verifier
+        claims = verifier.cached(token)
+        if claims is None:
+            # A miss may need to fetch signing keys, so it's kept off the event loop
+            try:
+                claims = await run_in_threadpool(verifier.verify, token)
+            except AuthError as e:
+                logger.info(f"Rejected bearer token: {e}")
+                raise HTTPException(status_code=401, detail="Invalid authentication credentials",
+                                    headers={"WWW-Authenticate": "Bearer"})
+
+        if self.role and user_role(claims) != self.role:
+            raise HTTPException(status_code=403, detail="Not authorized to access this resource")
+        return claims
+
+
+token_verifier = create_token_verifier()
+require_user = BearerAuth()
+require_admin = BearerAuth(role="admin")
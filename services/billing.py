@@ -0,0 +1,219 @@
+"""
+Billing runs: turn unbilled billable expenses and approved billable time
+into invoice line items for a project or client over a date range.
+
+Unbilled items are indexed by project and kept sorted by date, so a run only
+touches the items it bills instead of scanning every expense and time log.
+"""
+import bisect
+import os
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+DEFAULT_HOURLY_RATE = float(os.getenv("BILLING_HOURLY_RATE", "75.00"))
+INVOICE_NUMBER_PREFIX = "INV-2025-"
+
+
+def is_unbilled_expense(expense: Dict[str, Any]) -> bool:
+    return expense.get("invoice_id") is None and expense.get("billable") is True
+
+
+def is_unbilled_time_log(time_log: Dict[str, Any]) -> bool:
+    return (
+        time_log.get("invoice_id") is None
+        and time_log.get("billable") is True
+        and time_log.get("status") == "Approved"
+    )
+
+
+class UnbilledIndex:
+    """Unbilled items grouped by project id, each group sorted by (date, id)"""
+
+    def __init__(self, is_unbilled: Callable[[Dict[str, Any]], bool]):
+        self.is_unbilled = is_unbilled
+        self._keys: Dict[Any, List[tuple]] = {}
+        self._items: Dict[Any, Dict[str, Any]] = {}
+
+    def rebuild(self, items: Iterable[Dict[str, Any]]) -> None:
+        self._keys = {}
+        self._items = {}
+        for item in items:
+            if self.is_unbilled(item):
+                self._items[item["id"]] = item
+                self._keys.setdefault(item.get("project_id"), []).append((item.get("date") or "", item["id"]))
+        for keys in self._keys.values():
+            keys.sort()
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """Index an item if it is unbilled (call after creating or editing one)"""
+        self.discard(item)
+        if self.is_unbilled(item):
+            self._items[item["id"]] = item
+            bisect.insort(self._keys.setdefault(item.get("project_id"), []), (item.get("date") or "", item["id"]))
+
+    def discard(self, item: Dict[str, Any]) -> None:
+        indexed = self._items.pop(item["id"], None)
+        if indexed is None:
+            return
+        keys = self._keys.get(indexed.get("project_id"), [])
+        key = (indexed.get("date") or "", indexed["id"])
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def select(self, project_ids: Iterable[Any], start_date: Optional[str] = None,
+               end_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Unbilled items for the projects, dated within [start_date, end_date]"""
+        selected = []
+        for project_id in project_ids:
+            keys = self._keys.get(project_id, [])
+            low = bisect.bisect_left(keys, (start_date,)) if start_date else 0
+            high = bisect.bisect_left(keys, (end_date + "\uffff",)) if end_date else len(keys)
+            selected.extend(self._items[item_id] for _, item_id in keys[low:high])
+        return selected
+
+    def for_project(self, project_id: Any = None) -> List[Dict[str, Any]]:
+        if project_id is None:
+            return self.select(list(self._keys))
+        return self.select([project_id])
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class BillingService:
+    """Runs billing over in-memory expenses, time logs and invoices
+
+    All reads and writes for a run happen under one lock, and the run's line
+    items are built before anything is modified, so a run either bills every
+    selected item or none of them.
+    """
+
+    def __init__(self, expenses: List[Dict[str, Any]], time_logs: List[Dict[str, Any]],
+                 invoices: List[Dict[str, Any]], projects: List[Dict[str, Any]],
+                 hourly_rate: float = DEFAULT_HOURLY_RATE):
+        self.expenses = expenses
+        self.time_logs = time_logs
+        self.invoices = invoices
+        self.projects = projects
+        self.hourly_rate = hourly_rate
+        self.expense_index = UnbilledIndex(is_unbilled_expense)
+        self.time_log_index = UnbilledIndex(is_unbilled_time_log)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Rebuild the unbilled indexes from the underlying lists"""
+        with self._lock:
+            self.expense_index.rebuild(self.expenses)
+            self.time_log_index.rebuild(self.time_logs)
+
+    def unbilled_expenses(self, project_id: Any = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self.expense_index.for_project(project_id)
+
+    def next_invoice_number(self) -> str:
+        numbers = [int(i["invoice_number"].split("-")[-1]) for i in self.invoices]
+        return f"{INVOICE_NUMBER_PREFIX}{max(numbers, default=0) + 1:03d}"
+
+    def _project_ids(self, project_id: Any, client_id: Any) -> List[Any]:
+        if project_id is not None:
+            return [project_id]
+        return [p["id"] for p in self.projects if p.get("client_id") == client_id]
+
+    def _line_items(self, invoice_id: int, expenses: List[Dict[str, Any]],
+                    time_logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        items = []
+        for expense in expenses:
+            items.append({
+                "invoice_id": invoice_id,
+                "description": expense.get("description") or expense.get("category", "Expense"),
+                "quantity": 1,
+                "unit_price": float(expense["amount"]),
+                "amount": float(expense["amount"]),
+                "type": expense.get("category", "Expense"),
+                "taxable": True,
+                "expense_id": expense["id"]
+            })
+        for time_log in time_logs:
+            hours = float(time_log["hours"])
+            rate = float(time_log.get("rate") or self.hourly_rate)
+            description = f"{time_log.get('task_name', 'Labor')} ({time_log['date']})"
+            if time_log.get("description"):
+                description += f": {time_log['description']}"
+            items.append({
+                "invoice_id": invoice_id,
+                "description": description,
+                "quantity": hours,
+                "unit_price": rate,
+                "amount": round(hours * rate, 2),
+                "type": "Labor",
+                "taxable": True,
+                "time_log_id": time_log["id"]
+            })
+        for position, item in enumerate(items, start=1):
+            item["id"] = position
+        return items
+
+    def run(self, project_id: Any = None, client_id: Any = None, start_date: Optional[str] = None,
+            end_date: Optional[str] = None, tax_rate: float = 0.0,
+            created_by: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Bill all unbilled items for a project (or all of a client's projects)
+
+        Returns the new draft invoice, or None if there was nothing to bill.
+        """
+        if project_id is None and client_id is None:
+            raise ValueError("A billing run needs a project_id or client_id")
+
+        with self._lock:
+            project_ids = self._project_ids(project_id, client_id)
+            expenses = self.expense_index.select(project_ids, start_date, end_date)
+            time_logs = self.time_log_index.select(project_ids, start_date, end_date)
+            if not expenses and not time_logs:
+                return None
+
+            project = next((p for p in self.projects if p["id"] == project_id), None)
+            if project is None:
+                project = next((p for p in self.projects if p["id"] in project_ids), {})
+
+            invoice_id = max((i["id"] for i in self.invoices), default=0) + 1
+            items = self._line_items(invoice_id, expenses, time_logs)
+            subtotal = round(sum(item["amount"] for item in items), 2)
+            tax_amount = round(sum(item["amount"] for item in items if item["taxable"]) * tax_rate / 100, 2)
+            now = datetime.now()
+            invoice = {
+                "id": invoice_id,
+                "invoice_number": self.next_invoice_number(),
+                "client_id": project.get("client_id", client_id),
+                "client_name": project.get("client_name"),
+                "project_id": project_id,
+                "project_name": project.get("name") if project_id is not None else None,
+                "status": "Draft",
+                "issue_date": now.strftime("%Y-%m-%d"),
+                "due_date": None,
+                "subtotal": subtotal,
+                "tax_rate": tax_rate,
+                "tax_amount": tax_amount,
+                "discount_amount": 0.00,
+                "total_amount": round(subtotal + tax_amount, 2),
+                "amount_paid": 0.00,
+                "balance_due": round(subtotal + tax_amount, 2),
+                "notes": f"Billing run {start_date or 'start'} to {end_date or now.strftime('%Y-%m-%d')}",
+                "terms": "Net 30",
+                "created_by": created_by,
+                "created_at": now.isoformat(),
+                "updated_at": now.isoformat(),
+                "items": items,
+                "payments": []
+            }
+
+            # Everything is built; apply the changes together
+            self.invoices.append(invoice)
+            for expense in expenses:
+                expense["invoice_id"] = invoice_id
+                self.expense_index.discard(expense)
+            for time_log in time_logs:
+                time_log["invoice_id"] = invoice_id
+                self.time_log_index.discard(time_log)
+            return invoice
@@ -0,0 +1,131 @@
+"""
+Helpers behind the list pages: filtering, pagination, vendor insurance dates
+and the time summary report's grouping.
+
+They run on every list request, so they are kept as plain functions of
+their inputs, which bench/microbench.py times on fixed datasets.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+ITEMS_PER_PAGE = 10
+
+# Time summary groupings: group_by -> (id field, name field)
+SUMMARY_GROUPS = {
+    "project": ("project_id", "project_name"),
+    "user": ("user_id", "user_name"),
+    "task": ("task_id", "task_name"),
+}
+
+
+def paginate(items: Sequence, page: int, per_page: int = ITEMS_PER_PAGE) -> Tuple[list, int, int]:
+    """A page of items, with the page number clamped to the pages there are, and the page count"""
+    total_pages = (len(items) + per_page - 1) // per_page  # Ceiling division
+    if page < 1:
+        page = 1
+    elif page > total_pages and total_pages > 0:
+        page = total_pages
+    start = (page - 1) * per_page
+    return items[start:start + per_page], page, total_pages
+
+
+def filter_time_logs(logs: List[Dict[str, Any]], search_query: Optional[str] = None,
+                     status_filter: Optional[str] = None, project_filter: Optional[int] = None) -> List[Dict[str, Any]]:
+    if search_query:
+        logs = [log for log in logs if
+                search_query.lower() in log["project_name"].lower() or
+                search_query.lower() in log["task_name"].lower() or
+                search_query.lower() in log["description"].lower()]
+    if status_filter:
+        logs = [log for log in logs if log["status"].lower() == status_filter.lower()]
+    if project_filter:
+        logs = [log for log in logs if log["project_id"] == project_filter]
+    return logs
+
+
+def filter_expenses(expenses: List[Dict[str, Any]], search: Optional[str] = None, category: Optional[str] = None,
+                    project_id: Optional[int] = None, status: Optional[str] = None,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    if search:
+        search = search.lower()
+        expenses = [e for e in expenses if
+                    (e["description"] and search in e["description"].lower()) or
+                    (e["vendor_name"] and search in e["vendor_name"].lower()) or
+                    (e["project_name"] and search in e["project_name"].lower()) or
+                    (e["category"] and search in e["category"].lower()) or
+                    (e["submitted_by"] and search in e["submitted_by"].lower())]
+    if category and category != "All":
+        expenses = [e for e in expenses if e["category"] == category]
+    if project_id:
+        expenses = [e for e in expenses if e["project_id"] == project_id]
+    if status and status != "All":
+        expenses = [e for e in expenses if e["status"] == status]
+    # Dates are ISO strings, so they compare in date order
+    if date_from:
+        expenses = [e for e in expenses if e["date"] >= date_from]
+    if date_to:
+        expenses = [e for e in expenses if e["date"] <= date_to]
+    return expenses
+
+
+def filter_invoices(invoices: List[Dict[str, Any]], search: Optional[str] = None, status: Optional[str] = None,
+                    client_id: Optional[int] = None, project_id: Optional[int] = None,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    if search:
+        search = search.lower()
+        invoices = [i for i in invoices if
+                    (i["invoice_number"] and search in i["invoice_number"].lower()) or
+                    (i["client_name"] and search in i["client_name"].lower()) or
+                    (i["project_name"] and search in i["project_name"].lower()) or
+                    (i["notes"] and search in i["notes"].lower())]
+    if status and status != "All":
+        invoices = [i for i in invoices if i["status"] == status]
+    if client_id:
+        invoices = [i for i in invoices if i["client_id"] == client_id]
+    if project_id:
+        invoices = [i for i in invoices if i["project_id"] == project_id]
+    if date_from:
+        invoices = [i for i in invoices if i["issue_date"] >= date_from]
+    if date_to:
+        invoices = [i for i in invoices if i["issue_date"] <= date_to]
+    return invoices
+
+
+def with_insurance_dates(vendors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of the vendors with insurance_expiry parsed to a date, or None if it doesn't parse
+
+    Copies, so shared lists such as MOCK_VENDORS keep their strings.
+    """
+    vendors = [dict(vendor) for vendor in vendors]
+    for vendor in vendors:
+        if vendor.get('insurance_expiry'):
+            try:
+                insurance_date = datetime.fromisoformat(vendor['insurance_expiry'].replace('Z', '+00:00'))
+                vendor['insurance_expiry'] = insurance_date.date()
+            except (ValueError, AttributeError):
+                vendor['insurance_expiry'] = None
+    return vendors
+
+
+def summarize_hours(logs: List[Dict[str, Any]], group_by: str) -> List[Dict[str, Any]]:
+    """Total, billable and non-billable hours per project, user or task; empty for any other group_by"""
+    fields = SUMMARY_GROUPS.get(group_by)
+    if fields is None:
+        return []
+    id_field, name_field = fields
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for log in logs:
+        group = groups.get(log[id_field])
+        if group is None:
+            group = groups[log[id_field]] = {
+                "name": log[name_field],
+                "total_hours": 0,
+                "billable_hours": 0,
+                "non_billable_hours": 0
+            }
+        group["total_hours"] += log["hours"]
+        if log["billable"]:
+            group["billable_hours"] += log["hours"]
+        else:
+            group["non_billable_hours"] += log["hours"]
+    return list(groups.values())
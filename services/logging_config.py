@@ -0,0 +1,229 @@
+"""
+Structured JSON logging through a background writer.
+
+Log calls only put the record on an in-process queue; a QueueListener
+thread formats each record as one JSON line and writes it to stdout, so a
+burst of errors never blocks the event loop on the stream. Records carry the
+id of the request they were logged in (RequestIdMiddleware, which also echoes
+it in X-Request-ID), and repeats of the same warning or error from the same
+place are sampled: the first few per window are written and the rest are
+counted and reported on the next one that gets through. Tracebacks are
+formatted once per exception and reused wherever they're needed.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Each distinct warning/error is written this many times per window, then sampled
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5"))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+REQUEST_ID_HEADER = b"x-request-id"
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_handler: Optional[logging.handlers.QueueHandler] = None
+_writer: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Fields every LogRecord has, which aren't copied into the JSON as extras
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "suppressed"}
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def formatted_traceback(exc: BaseException) -> str:
+    """An exception's traceback as text, formatted on first use and cached on the exception"""
+    text = getattr(exc, "_formatted_traceback", None)
+    if text is None:
+        text = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        try:
+            exc._formatted_traceback = text
+        except AttributeError:
+            pass
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and record.exc_info[1] is not None:
+            entry["exc_type"] = record.exc_info[0].__name__
+            entry["traceback"] = formatted_traceback(record.exc_info[1])
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request's id; runs in the logging thread, where the id is set"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Lets the first `burst` repeats of a warning or error through per window, counting the rest
+
+    Repeats are records with the same logger, level, message template and
+    source line, so "Error viewing vendor: %s" is one kind of record however
+    many vendors fail.
+    """
+
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, window: float = LOG_SAMPLE_WINDOW,
+                 level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._seen: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, str(record.msg), record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                suppressed = entry[2] if entry else 0
+                self._seen[key] = [now, 1, 0]
+                if len(self._seen) > 10000:
+                    # Forget kinds that haven't been seen for a window
+                    self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+                record.suppressed = suppressed
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            return False
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, leaving message and traceback formatting to the writer thread
+
+    The stock QueueHandler formats records before queueing them so they can
+    be pickled, which would put the formatting back on the logging thread.
+    The queue here never leaves the process.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _start_writer(handler: logging.handlers.QueueHandler, writer: logging.Handler) -> None:
+    global _listener
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def configure_logging(level: str = LOG_LEVEL, stream=None) -> None:
+    """Route all logging through the queue to a JSON writer thread (safe to call more than once)"""
+    global _handler, _writer
+    if _handler is not None:
+        return
+
+    _writer = logging.StreamHandler(stream or sys.stdout)
+    _writer.setFormatter(JsonFormatter())
+    _handler = _RecordQueueHandler(queue.SimpleQueue())
+    _handler.addFilter(RequestIdFilter())
+    _handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    # Uvicorn's and Gunicorn's loggers write through the same queue
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error"):
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = []
+        server_logger.propagate = True
+
+    _start_writer(_handler, _writer)
+    atexit.register(stop_logging)
+
+
+def _restart_writer_after_fork() -> None:
+    # Threads don't survive fork, so a forked worker needs its own writer
+    if _handler is not None:
+        _start_writer(_handler, _writer)
+
+
+os.register_at_fork(after_in_child=_restart_writer_after_fork)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """ASGI middleware giving each request an id for its log records
+
+    An incoming X-Request-ID (e.g. from a load balancer) is kept so logs can
+    be matched across services; otherwise one is generated. Either way it is
+    returned in the response's X-Request-ID header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or secrets.token_hex(8)
+        token = _request_id.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        # Left set if the request raised: the exception handlers run outside
+        # this middleware, and their records should still carry the id. Each
+        # request runs in its own context, so the id doesn't leak further.
+        _request_id.reset(token)
@@ -0,0 +1,208 @@
+"""
+Request timing and Prometheus metrics.
+
+MetricsMiddleware times every request and records it against the route
+template that matched ("/vendors/{vendor_id}", not the raw path), so latency
+histograms stay one series per page. Code that does measurable work inside a
+request (database calls, template rendering) adds its time to the request's
+phases with timed() or record_timing(); the phases go out to the browser in
+a Server-Timing header and into per-route phase totals. Everything is served
+in the Prometheus text format from render_metrics(). Metrics are kept per
+process, so with several workers each one reports its own.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.templating import Jinja2Templates
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds in seconds; chosen so the pages that matter land between 50 ms and 2.5 s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Seconds spent per phase in the current request; None outside a request
+_request_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_phases", default=None)
+
+
+def record_timing(phase: str, seconds: float) -> None:
+    """Add time spent in a phase (e.g. "db") to the current request"""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str):
+    """Time the enclosed block as part of a phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+def current_phases() -> Optional[Dict[str, float]]:
+    """The phase timings recorded so far for the current request"""
+    return _request_phases.get()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+class MetricsRegistry:
+    """Per-route latency histograms, status counts, in-flight requests and phase totals"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._latency: Dict[tuple, list] = {}
+        self._responses: Dict[tuple, int] = {}
+        self._phases: Dict[tuple, float] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start_request(self, method: str) -> None:
+        with self._lock:
+            self._in_flight[method] = self._in_flight.get(method, 0) + 1
+
+    def finish_request(self, method: str, route: str, status: int, seconds: float,
+                       phases: Optional[Dict[str, float]] = None) -> None:
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._in_flight[method] -= 1
+            series = self._latency.get((method, route))
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._latency[(method, route)] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += seconds
+            key = (method, route, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+            for phase, phase_seconds in (phases or {}).items():
+                key = (route, phase)
+                self._phases[key] = self._phases.get(key, 0.0) + phase_seconds
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            latency = {key: list(series) for key, series in self._latency.items()}
+            responses = dict(self._responses)
+            phases = dict(self._phases)
+            in_flight = dict(self._in_flight)
+
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route template.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), series in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"http_request_duration_seconds_bucket{{{_labels(method=method, route=route, le=bound)}}} {cumulative}")
+            lines.append(f"http_request_duration_seconds_sum{{{_labels(method=method, route=route)}}} {series[-1]}")
+            lines.append(f"http_request_duration_seconds_count{{{_labels(method=method, route=route)}}} {cumulative}")
+
+        lines += ["# HELP http_requests_total Responses by route template and status code.",
+                  "# TYPE http_requests_total counter"]
+        for (method, route, status), count in sorted(responses.items()):
+            lines.append(f"http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+        lines += ["# HELP http_requests_in_progress Requests currently being handled.",
+                  "# TYPE http_requests_in_progress gauge"]
+        for method, count in sorted(in_flight.items()):
+            lines.append(f"http_requests_in_progress{{{_labels(method=method)}}} {count}")
+
+        lines += ["# HELP http_request_phase_seconds_total Time spent in each phase (db, template) by route template.",
+                  "# TYPE http_request_phase_seconds_total counter"]
+        for (route, phase), seconds in sorted(phases.items()):
+            lines.append(f"http_request_phase_seconds_total{{{_labels(route=route, phase=phase)}}} {seconds}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def render_metrics() -> str:
+    return metrics_registry.render()
+
+
+def server_timing_header(phases: Dict[str, float], total: float) -> bytes:
+    """A Server-Timing header value with each phase and the total, in milliseconds"""
+    entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in sorted(phases.items())]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing requests by route and adding Server-Timing headers
+
+    The route is taken from the endpoint the router matched, which the router
+    records in the request scope, so it costs a dict lookup per request.
+    """
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.registry = registry or metrics_registry
+        self._route_paths: Dict[int, str] = {}
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(id(endpoint))
+        if path is None:
+            # Built on first use, and rebuilt if routes were added since
+            paths = {}
+            for route in reversed(getattr(scope.get("app"), "routes", [])):
+                if getattr(route, "endpoint", None) is not None:
+                    paths[id(route.endpoint)] = route.path
+                elif getattr(route, "app", None) is not None:
+                    paths[id(route.app)] = route.path + "/{path}"
+            self._route_paths = paths
+            path = paths.get(id(endpoint), UNMATCHED_ROUTE)
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        phases: Dict[str, float] = {}
+        token = _request_phases.set(phases)
+        status = 500
+        start = time.perf_counter()
+        self.registry.start_request(method)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(phases, time.perf_counter() - start)))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.finish_request(
+                method, self._route_template(scope), status, time.perf_counter() - start, phases
+            )
+            _request_phases.reset(token)
+
+
+class TimedJinja2Templates(Jinja2Templates):
+    """Jinja2Templates that counts rendering towards the request's template phase"""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with timed("template"):
+            return super().TemplateResponse(*args, **kwargs)
@@ -0,0 +1,104 @@
+"""
+Invoice payments ledger.
+
+Each invoice's "payments" list is its ledger, and "amount_paid" is the
+running total of that ledger, so posting a payment updates the balance in
+O(1) without re-summing. Posting happens under a per-invoice lock, and a
+repeated idempotency key returns the payment it first recorded, so a
+double-submitted form or a retried request is only applied once.
+Payments beyond the balance due are rejected rather than held as credit.
+"""
+import threading
+from datetime import date as date_type, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PaymentLedger:
+    """Records payments against in-memory invoices"""
+
+    def __init__(self, invoices: List[Dict[str, Any]]):
+        self.invoices = invoices
+        self._locks: Dict[Any, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._keys: Dict[Tuple[Any, str], Dict[str, Any]] = {}
+
+    def _lock_for(self, invoice_id: Any) -> threading.Lock:
+        with self._locks_lock:
+            lock = self._locks.get(invoice_id)
+            if lock is None:
+                lock = self._locks[invoice_id] = threading.Lock()
+            return lock
+
+    def _find_invoice(self, invoice_id: Any) -> Optional[Dict[str, Any]]:
+        return next((i for i in self.invoices if i["id"] == invoice_id), None)
+
+    @staticmethod
+    def _set_balance(invoice: Dict[str, Any], paid_date: Optional[str] = None) -> None:
+        """Set balance_due from amount_paid, and status and paid_date from the balance"""
+        invoice["balance_due"] = round(max(invoice["total_amount"] - invoice["amount_paid"], 0), 2)
+        if invoice["balance_due"] <= 0:
+            invoice["status"] = "Paid"
+            invoice["paid_date"] = invoice.get("paid_date") or paid_date or datetime.now().strftime("%Y-%m-%d")
+        elif invoice.get("status") == "Paid":
+            # No longer fully paid; due dates are ISO strings, so they compare in date order
+            overdue = invoice.get("due_date") and invoice["due_date"] < date_type.today().isoformat()
+            invoice["status"] = "Overdue" if overdue else "Sent"
+            invoice["paid_date"] = None
+
+    def record(self, invoice_id: Any, amount: float, idempotency_key: Optional[str] = None,
+               date: Optional[str] = None, method: Optional[str] = None,
+               reference: Optional[str] = None, notes: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Post a payment to an invoice
+
+        Returns (payment, created). created is False when the idempotency key
+        was already used, in which case the original payment is returned and
+        the balance is unchanged. payment is None if the invoice doesn't exist.
+        Raises ValueError if the amount isn't positive or is more than the
+        balance due.
+        """
+        if amount <= 0:
+            raise ValueError("Payment amount must be positive")
+
+        invoice = self._find_invoice(invoice_id)
+        if invoice is None:
+            return None, False
+
+        with self._lock_for(invoice_id):
+            if idempotency_key:
+                existing = self._keys.get((invoice_id, idempotency_key))
+                if existing is not None:
+                    return existing, False
+
+            balance_due = round(invoice["total_amount"] - invoice.get("amount_paid", 0), 2)
+            if round(amount, 2) > balance_due:
+                raise ValueError(f"Payment of {amount:.2f} is more than the balance due of {max(balance_due, 0):.2f}")
+
+            ledger = invoice.setdefault("payments", [])
+            payment = {
+                "id": max((p["id"] for p in ledger), default=0) + 1,
+                "invoice_id": invoice_id,
+                "date": date or datetime.now().strftime("%Y-%m-%d"),
+                "amount": amount,
+                "method": method,
+                "reference": reference,
+                "notes": notes,
+                "idempotency_key": idempotency_key
+            }
+            ledger.append(payment)
+            if idempotency_key:
+                self._keys[(invoice_id, idempotency_key)] = payment
+
+            invoice["amount_paid"] = round(invoice.get("amount_paid", 0) + amount, 2)
+            self._set_balance(invoice, payment["date"])
+            return payment, True
+
+    def reconcile(self, invoice_id: Any) -> Optional[float]:
+        """Recompute an invoice's running total, balance and status from its ledger; returns the total"""
+        invoice = self._find_invoice(invoice_id)
+        if invoice is None:
+            return None
+        with self._lock_for(invoice_id):
+            payments = invoice.get("payments", [])
+            invoice["amount_paid"] = round(sum(p["amount"] for p in payments), 2)
+            self._set_balance(invoice, max((p["date"] for p in payments), default=None))
+            return invoice["amount_paid"]
@@ -0,0 +1,187 @@
+"""
+On-demand sampling profiler for a live worker.
+
+A background thread wakes every interval, takes the current stack of every
+other thread with sys._current_frames() and counts each distinct stack. The
+sampled code runs unmodified, so the overhead is the sampler's own wakeups
+(well under 1% at the default 200 Hz) and only while a profile is running.
+Results are in the collapsed-stack format ("root;caller;callee count" per
+line) that flamegraph.pl, speedscope and similar tools read.
+
+A whole-worker profile runs for a fixed number of seconds. A request can
+also be profiled on its own by sending X-Profile with PROFILE_TOKEN; the
+profile covers the worker while that request is handled, and its URL comes
+back in the X-Profile-URL response header. Request profiles are kept in the
+session store (SESSION_BACKEND), so the URL works whichever worker answers it.
+"""
+import asyncio
+import os
+import secrets
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from services.sessions import create_session_backend
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+DEFAULT_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60
+# How long a request profile can be fetched from its X-Profile-URL
+PROFILE_TTL_SECONDS = 60 * 60
+# Innermost frames of threads that are waiting for work rather than doing it
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+# Only one profile runs at a time, so concurrent profiles can't skew each other
+_profile_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in the process until stopped"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[tuple, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not _profile_lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        _profile_lock.release()
+        return self.stacks
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        key = (code, frame.f_lineno)
+        label = self._labels.get(key)
+        if label is None:
+            label = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            self._labels[key] = label
+        return label
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+def collapsed(stacks: Counter) -> str:
+    """Stack counts in the collapsed-stack format, heaviest first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+async def profile_worker(seconds: float, interval: float = DEFAULT_INTERVAL) -> str:
+    """Profile the whole worker for a number of seconds, without blocking the event loop"""
+    profiler = SamplingProfiler(interval=max(interval, 0.001))
+    profiler.start()
+    try:
+        await asyncio.sleep(min(seconds, MAX_PROFILE_SECONDS))
+    finally:
+        stacks = profiler.stop()
+    return collapsed(stacks)
+
+
+_profile_store = create_session_backend(cached=False)
+
+
+def get_profile(profile_id: str) -> Optional[str]:
+    """A request profile kept by any worker, or None if unknown or expired"""
+    record = _profile_store.load("profile:" + profile_id)
+    return record["profile"] if record else None
+
+
+def _keep_profile(profile: str) -> str:
+    profile_id = secrets.token_urlsafe(12)
+    _profile_store.save("profile:" + profile_id, {"profile": profile}, PROFILE_TTL_SECONDS)
+    return profile_id
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Whether a token grants access to profiling (never, unless PROFILE_TOKEN is set)"""
+    return bool(PROFILE_TOKEN) and token is not None and secrets.compare_digest(token, PROFILE_TOKEN)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling requests that carry an X-Profile header with PROFILE_TOKEN"""
+
+    def __init__(self, app, url_prefix: str = "/debug/profiles/", skip_prefix: str = "/debug/"):
+        self.app = app
+        self.url_prefix = url_prefix
+        # The profiling endpoints themselves are never profiled
+        self.skip_prefix = skip_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_TOKEN or scope["path"].startswith(self.skip_prefix):
+            await self.app(scope, receive, send)
+            return
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                token = value.decode("latin-1")
+                break
+        if not authorized(token):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler()
+        try:
+            profiler.start()
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+        stopped = False
+
+        async def finish() -> str:
+            nonlocal stopped
+            stopped = True
+            return await run_in_threadpool(_keep_profile, collapsed(profiler.stop()))
+
+        async def send_wrapper(message):
+            # The profile covers the request up to its response headers
+            if message["type"] == "http.response.start" and not stopped:
+                profile_id = await finish()
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-url", f"{self.url_prefix}{profile_id}".encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not stopped:
+                await finish()
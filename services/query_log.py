@@ -0,0 +1,178 @@
+"""
+Per-request data-access log and N+1 detection.
+
+Every Supabase (PostgREST) query made while handling a request is recorded
+with its duration and its shape: the table, the filters and their operators,
+without the values. A request that runs the same shape more than
+N_PLUS_ONE_THRESHOLD times is almost always looping over rows and fetching
+each one's related data separately, and is logged as a warning. Per-request
+totals go to the log and to the Server-Timing header, and with
+QUERY_LOG_DEBUG=true the call lists of recent requests are kept for
+recent_requests() to show.
+
+Other data layers (e.g. SQL) report their calls with record_query().
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from services.metrics import record_timing
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+QUERY_LOG_DEBUG = os.getenv("QUERY_LOG_DEBUG", "false").lower() == "true"
+RECENT_REQUESTS = 50
+# Query parameters that aren't filters; their values are part of the shape
+SHAPE_PARAMS = ("select", "order", "on_conflict", "columns")
+# Paging parameters; present or not is part of the shape, their values aren't
+PAGING_PARAMS = ("limit", "offset")
+
+_current_log: ContextVar[Optional["RequestQueryLog"]] = ContextVar("request_query_log", default=None)
+
+
+class RequestQueryLog:
+    """The data-access calls made while handling one request"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.calls: List[Dict[str, Any]] = []
+        self.shapes: Counter = Counter()
+        self.total_seconds = 0.0
+
+    def add(self, kind: str, shape: str, seconds: float, detail: Optional[str] = None) -> None:
+        self.calls.append({
+            "kind": kind,
+            "shape": shape,
+            "ms": round(seconds * 1000, 2),
+            "detail": detail,
+        })
+        self.shapes[shape] += 1
+        self.total_seconds += seconds
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """Shapes run more than threshold times, with their counts"""
+        return {shape: count for shape, count in self.shapes.items() if count > threshold}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "query_count": len(self.calls),
+            "query_ms": round(self.total_seconds * 1000, 2),
+            "repeated_shapes": self.repeated_shapes(),
+            "calls": self.calls,
+        }
+
+
+_recent: deque = deque(maxlen=RECENT_REQUESTS)
+_recent_lock = threading.Lock()
+
+
+def recent_requests() -> List[Dict[str, Any]]:
+    """Call lists of the most recent requests, newest first (kept only with QUERY_LOG_DEBUG)"""
+    with _recent_lock:
+        return [log.as_dict() for log in reversed(_recent)]
+
+
+def current_query_log() -> Optional[RequestQueryLog]:
+    return _current_log.get()
+
+
+def record_query(kind: str, shape: str, seconds: float, detail: Optional[str] = None) -> None:
+    """Record a data-access call against the current request and its db time"""
+    record_timing("db", seconds)
+    log = _current_log.get()
+    if log is not None:
+        log.add(kind, shape, seconds, detail)
+
+
+def postgrest_shape(http_method: str, path: str, params) -> str:
+    """A query's table and filter operators, e.g. "GET vendors?id=eq&select=*" """
+    parts = []
+    for key, value in sorted(params.multi_items()):
+        if key in SHAPE_PARAMS:
+            parts.append(f"{key}={value}")
+        elif key in PAGING_PARAMS:
+            parts.append(key)
+        else:
+            # Filters look like id=eq.5 or status=in.(a,b); keep the operator
+            operator = value.split(".", 1)[0]
+            parts.append(f"{key}={operator}")
+    table = path.lstrip("/")
+    return f"{http_method} {table}?{'&'.join(parts)}" if parts else f"{http_method} {table}"
+
+
+def instrument_postgrest() -> None:
+    """Record every Supabase (PostgREST) query in the current request's log"""
+    from postgrest._sync import request_builder
+
+    # MaybeSingle builders run through SyncSingleRequestBuilder.execute, so these two cover every query
+    for builder in (request_builder.SyncQueryRequestBuilder, request_builder.SyncSingleRequestBuilder):
+        execute = builder.execute
+        if getattr(execute, "_instrumented", False):
+            continue
+
+        @functools.wraps(execute)
+        def logged_execute(self, _execute=execute):
+            start = time.perf_counter()
+            try:
+                return _execute(self)
+            finally:
+                seconds = time.perf_counter() - start
+                detail = f"{self.http_method} {self.path}?{self.params}" if QUERY_LOG_DEBUG else None
+                record_query("postgrest", postgrest_shape(self.http_method, self.path, self.params), seconds, detail)
+
+        logged_execute._instrumented = True
+        builder.execute = logged_execute
+
+
+class QueryLogMiddleware:
+    """ASGI middleware giving each request a query log and reporting it when the request ends"""
+
+    def __init__(self, app, threshold: int = N_PLUS_ONE_THRESHOLD, keep_recent: bool = QUERY_LOG_DEBUG):
+        self.app = app
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        log = RequestQueryLog(scope["method"], scope["path"])
+        token = _current_log.set(log)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and log.calls:
+                headers = list(message.get("headers", []))
+                description = f"{len(log.calls)} queries"
+                headers.append((b"server-timing", f'queries;desc="{description}"'.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_log.reset(token)
+            self._report(log)
+
+    def _report(self, log: RequestQueryLog) -> None:
+        if not log.calls:
+            return
+        logger.debug(
+            f"{log.method} {log.path}: {len(log.calls)} queries in {log.total_seconds * 1000:.1f} ms"
+        )
+        for shape, count in log.repeated_shapes(self.threshold).items():
+            logger.warning(f"Possible N+1 in {log.method} {log.path}: {shape} ran {count} times")
+        if self.keep_recent:
+            with _recent_lock:
+                _recent.append(log)
@@ -0,0 +1,322 @@
+"""
+Server-side sessions.
+
+The session cookie only carries a random session id; session data lives in a
+backend. MemorySessionBackend is an in-process LRU with expiry.
+SqliteSessionBackend is shared by the workers of one container, and
+RedisSessionBackend by workers on any number of hosts, fronted by a small
+in-process LRU (CachedSessionBackend) so most requests don't touch the
+network. The middleware only writes to the backend, and only sends
+Set-Cookie, when a request changed its session or the session is due a
+refresh: expiry slides, so a session in use is re-saved with a fresh
+max age at most once every SESSION_REFRESH_INTERVAL seconds. Calls that
+reach a shared store run in the threadpool so they don't block the event
+loop. Login and
+logout call Session.regenerate(), which moves the session to a new id and
+deletes the old one, so an id planted before login is useless after it.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from typing import Any, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import redis
+except ImportError:  # Only needed for SESSION_BACKEND=redis
+    redis = None
+
+SESSION_COOKIE = "session_id"
+SESSION_MAX_AGE = 14 * 24 * 60 * 60
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# How long the in-process front may serve a session without re-reading the shared store
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "5"))
+# A session in use has its expiry pushed back this often, rather than on every request
+SESSION_REFRESH_INTERVAL = 60 * 60
+# Session key holding when the session was last saved
+REFRESHED_KEY = "_refreshed_at"
+
+
+class Session(dict):
+    """Session data that records whether it was changed
+
+    Only assignments and deletions on the session itself are tracked, so
+    mutate nested values by assigning them back (session["x"] = new_list).
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None):
+        super().__init__(data or {})
+        self.session_id = session_id
+        self.modified = False
+        self.regenerate_id = False
+
+    def regenerate(self):
+        """Move the session to a new id when the response is sent, deleting the old one
+
+        Call whenever the user behind the session changes (login, logout).
+        """
+        self.regenerate_id = True
+        self.modified = True
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            self.modified = True
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.modified = True
+
+    def pop(self, key, *default):
+        if key in self:
+            self.modified = True
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self.modified = True
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        if self:
+            self.modified = True
+        super().clear()
+
+
+class MemorySessionBackend:
+    """In-process session store: an LRU of sessions that expire max_age after their last save"""
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires <= time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return dict(data)
+
+    def save(self, session_id: str, data: Dict[str, Any], max_age: int) -> None:
+        with self._lock:
+            self._sessions[session_id] = (dict(data), time.monotonic() + max_age)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionBackend:
+    """Shared session store in Redis, with the session TTL kept by Redis"""
+
+    def __init__(self, url: str, prefix: str = "session:"):
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self.prefix + session_id)
+        return json.loads(raw) if raw else None
+
+    def save(self, session_id: str, data: Dict[str, Any], max_age: int) -> None:
+        self.client.setex(self.prefix + session_id, max_age, json.dumps(data, default=str))
+
+    def delete(self, session_id: str) -> None:
+        self.client.delete(self.prefix + session_id)
+
+
+class SqliteSessionBackend:
+    """Session store in a SQLite file, shared by the workers of one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, opened lazily so a forked worker never reuses its parent's
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires > ?", (session_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id: str, data: Dict[str, Any], max_age: int) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+            (session_id, json.dumps(data, default=str), now + max_age)
+        )
+        # Expired sessions are cleared out now and then rather than on every save
+        if secrets.randbelow(100) == 0:
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+        conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        conn.commit()
+
+
+class CachedSessionBackend:
+    """An in-process LRU in front of a shared backend
+
+    Reads are served from the LRU for up to cache_ttl seconds, so a change
+    made through another worker shows up here within that time. Writes go
+    to both.
+    """
+
+    def __init__(self, store, cache_size: int = SESSION_CACHE_SIZE, cache_ttl: float = SESSION_CACHE_TTL):
+        self.store = store
+        self.cache = MemorySessionBackend(cache_size)
+        self.cache_ttl = cache_ttl
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self.cache.load(session_id)
+        if data is not None:
+            return data
+        data = self.store.load(session_id)
+        if data is not None:
+            self.cache.save(session_id, data, self.cache_ttl)
+        return data
+
+    def save(self, session_id: str, data: Dict[str, Any], max_age: int) -> None:
+        self.store.save(session_id, data, max_age)
+        self.cache.save(session_id, data, min(self.cache_ttl, max_age))
+
+    def delete(self, session_id: str) -> None:
+        self.cache.delete(session_id)
+        self.store.delete(session_id)
+
+
+def create_session_backend(cached: bool = True):
+    """Session backend from SESSION_BACKEND (memory, sqlite or redis), SESSION_SQLITE_PATH and SESSION_REDIS_URL
+
+    Pass cached=False for state that changes between requests, such as upload
+    progress, which must not be read from the local copy of a remote store.
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    if backend == "redis":
+        store = RedisSessionBackend(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"))
+        return CachedSessionBackend(store) if cached else store
+    if backend == "sqlite":
+        # A local file is fast enough to read directly, which keeps workers from serving stale copies
+        return SqliteSessionBackend(os.getenv("SESSION_SQLITE_PATH", "/tmp/akc-sessions.sqlite3"))
+    if backend == "memory":
+        return MemorySessionBackend()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+
+class ServerSessionMiddleware:
+    """ASGI middleware providing request.session from a server-side backend"""
+
+    def __init__(self, app, backend=None, cookie_name: str = SESSION_COOKIE, max_age: int = SESSION_MAX_AGE,
+                 https_only: bool = False, same_site: str = "lax",
+                 refresh_interval: float = SESSION_REFRESH_INTERVAL):
+        self.app = app
+        self.backend = backend or create_session_backend()
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.security_flags = f"httponly; samesite={same_site}" + ("; secure" if https_only else "")
+
+    def _session_id_from(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                cookie = SimpleCookie(value.decode("latin-1"))
+                if self.cookie_name in cookie:
+                    return cookie[self.cookie_name].value
+        return None
+
+    def _cookie_header(self, session_id: str, max_age: int) -> tuple:
+        value = f"{self.cookie_name}={session_id}; path=/; Max-Age={max_age}; {self.security_flags}"
+        return (b"set-cookie", value.encode("latin-1"))
+
+    async def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if isinstance(self.backend, MemorySessionBackend):
+            return self.backend.load(session_id)
+        if isinstance(self.backend, CachedSessionBackend):
+            # A hit in the in-process front needs no I/O
+            data = self.backend.cache.load(session_id)
+            if data is not None:
+                return data
+        return await run_in_threadpool(self.backend.load, session_id)
+
+    async def _run(self, method, *args) -> None:
+        if isinstance(self.backend, MemorySessionBackend):
+            method(*args)
+        else:
+            await run_in_threadpool(method, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = self._session_id_from(scope)
+        data = await self._load(session_id) if session_id else None
+        if data is None:
+            session_id = None
+        session = Session(data, session_id)
+        # Sliding expiry: a session in use is re-saved once its last save is refresh_interval old
+        if data and time.time() - data.get(REFRESHED_KEY, 0) >= self.refresh_interval:
+            session.modified = True
+        scope["session"] = session
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and session.modified:
+                headers = list(message.get("headers", []))
+                old_id = session.session_id
+                if old_id and (session.regenerate_id or not session):
+                    await self._run(self.backend.delete, old_id)
+                    session.session_id = None
+                if session:
+                    new_id = session.session_id or secrets.token_urlsafe(32)
+                    dict.__setitem__(session, REFRESHED_KEY, time.time())
+                    await self._run(self.backend.save, new_id, dict(session), self.max_age)
+                    # Re-issued on every save so the cookie expires with the stored session
+                    headers.append(self._cookie_header(new_id, self.max_age))
+                    session.session_id = new_id
+                elif old_id:
+                    headers.append(self._cookie_header("null", 0))
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,200 @@
+"""
+Streaming uploads to Supabase Storage.
+
+Files are sent with Supabase's resumable (TUS) upload endpoint one chunk at a
+time, so an upload holds a single chunk in memory however large the file is,
+and an interrupted chunk is retried from the offset the server confirms
+rather than from the start. Bucket existence is checked once per process,
+and each upload's progress is recorded in the session store under an upload
+id that the browser can poll from any worker.
+"""
+import base64
+import logging
+import os
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+import httpx
+
+from services.sessions import create_session_backend
+
+logger = logging.getLogger(__name__)
+
+# Supabase's resumable upload endpoint requires 6 MB chunks
+UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024
+UPLOAD_RETRIES = int(os.getenv("STORAGE_UPLOAD_RETRIES", "3"))
+UPLOAD_TIMEOUT = float(os.getenv("STORAGE_UPLOAD_TIMEOUT", "60"))
+TUS_VERSION = "1.0.0"
+
+# How long an upload's progress is kept after its last update
+PROGRESS_TTL_SECONDS = 600
+
+_known_buckets = set()
+_known_buckets_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Raised when a file could not be uploaded to storage"""
+
+
+def ensure_bucket(client, bucket: str) -> None:
+    """Create the bucket if it doesn't exist, checking at most once per process"""
+    if bucket in _known_buckets:
+        return
+    with _known_buckets_lock:
+        if bucket in _known_buckets:
+            return
+        try:
+            client.storage.get_bucket(bucket)
+        except Exception:
+            client.storage.create_bucket(bucket)
+        _known_buckets.add(bucket)
+
+
+class UploadProgress:
+    """Upload progress keyed by upload id, kept in the session store
+
+    Progress lives in the same backend as sessions (SESSION_BACKEND), so the
+    worker answering a poll sees uploads streamed by any other worker. Each
+    record expires ttl seconds after it was last written.
+    """
+
+    def __init__(self, backend, ttl: int = PROGRESS_TTL_SECONDS, prefix: str = "upload:"):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _save(self, upload_id: str, upload: Dict[str, Any]) -> None:
+        self.backend.save(self.prefix + upload_id, upload, self.ttl)
+
+    def start(self, upload_id: str, total: int) -> None:
+        self._save(upload_id, {"bytes_sent": 0, "total": total, "status": "uploading", "error": None})
+
+    def update(self, upload_id: str, bytes_sent: int) -> None:
+        upload = self.backend.load(self.prefix + upload_id)
+        if upload:
+            upload["bytes_sent"] = bytes_sent
+            self._save(upload_id, upload)
+
+    def finish(self, upload_id: str, error: Optional[str] = None) -> None:
+        upload = self.backend.load(self.prefix + upload_id)
+        if upload:
+            upload["status"] = "failed" if error else "complete"
+            upload["error"] = error
+            self._save(upload_id, upload)
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        upload = self.backend.load(self.prefix + upload_id)
+        if upload is None:
+            return None
+        total = upload["total"]
+        return {
+            "bytes_sent": upload["bytes_sent"],
+            "total": total,
+            "percent": round(upload["bytes_sent"] * 100 / total, 1) if total else 100.0,
+            "status": upload["status"],
+            "error": upload["error"]
+        }
+
+
+upload_progress = UploadProgress(create_session_backend(cached=False))
+
+
+def _file_size(fileobj: BinaryIO) -> int:
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size - position
+
+
+def _metadata(values: Dict[str, str]) -> str:
+    return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in values.items() if value)
+
+
+def stream_upload(client, bucket: str, path: str, fileobj: BinaryIO, content_type: Optional[str] = None,
+                  upsert: bool = False, upload_id: Optional[str] = None,
+                  on_progress: Optional[Callable[[int, int], None]] = None,
+                  chunk_size: int = UPLOAD_CHUNK_SIZE) -> Optional[str]:
+    """Upload a file object to storage in chunks; returns the stored path
+
+    Reads from the file object's current position. Pass upload_id to record
+    progress in upload_progress, or on_progress to be called with
+    (bytes_sent, total) after every chunk. Returns None without uploading if
+    there is no Supabase client (mock mode).
+    """
+    if client is None:
+        return None
+
+    ensure_bucket(client, bucket)
+    total = _file_size(fileobj)
+    start = fileobj.tell()
+    if upload_id:
+        upload_progress.start(upload_id, total)
+
+    headers = {
+        "Authorization": f"Bearer {client.supabase_key}",
+        "apikey": client.supabase_key,
+        "Tus-Resumable": TUS_VERSION
+    }
+    if upsert:
+        headers["x-upsert"] = "true"
+
+    try:
+        with httpx.Client(timeout=UPLOAD_TIMEOUT) as http:
+            response = http.post(
+                f"{client.storage_url}/upload/resumable",
+                headers={
+                    **headers,
+                    "Upload-Length": str(total),
+                    "Upload-Metadata": _metadata({
+                        "bucketName": bucket,
+                        "objectName": path,
+                        "contentType": content_type or "application/octet-stream"
+                    })
+                }
+            )
+            if response.status_code != 201:
+                raise UploadError(f"Could not start upload of {path}: {response.status_code} {response.text}")
+            location = response.headers["Location"]
+
+            offset = 0
+            failures = 0
+            while offset < total:
+                fileobj.seek(start + offset)
+                chunk = fileobj.read(chunk_size)
+                try:
+                    response = http.patch(location, content=chunk, headers={
+                        **headers,
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream"
+                    })
+                    if response.status_code != 204:
+                        raise UploadError(f"Chunk at {offset} of {path} failed: {response.status_code} {response.text}")
+                    offset = int(response.headers["Upload-Offset"])
+                    failures = 0
+                except (httpx.HTTPError, UploadError) as e:
+                    failures += 1
+                    if failures > UPLOAD_RETRIES:
+                        raise UploadError(str(e)) from e
+                    logger.warning(f"Retrying upload of {path} at offset {offset}: {e}")
+                    time.sleep(min(2 ** failures, 10) / 10)
+                    # Resume from whatever the server actually received
+                    head = http.head(location, headers=headers)
+                    if head.status_code == 200 and "Upload-Offset" in head.headers:
+                        offset = int(head.headers["Upload-Offset"])
+                    continue
+
+                if upload_id:
+                    upload_progress.update(upload_id, offset)
+                if on_progress:
+                    on_progress(offset, total)
+    except Exception as e:
+        if upload_id:
+            upload_progress.finish(upload_id, error=str(e))
+        raise
+
+    if upload_id:
+        upload_progress.finish(upload_id)
+    return path
@@ -0,0 +1,78 @@
+"""
+Reverse routing for the templates' url_for().
+
+URLTable compiles every route's path once, from the app's routes plus the
+few names templates use that no route is registered under, so building a
+URL is a dict lookup and a format call. Path parameters are checked
+against the route and run through its convertors, as Starlette's own
+url_path_for does; any other arguments become the query string, as in
+Flask, whose url_for the templates were written for.
+"""
+import re
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+from starlette.routing import NoMatchFound, Route, compile_path
+
+_PARAM = re.compile(r"{(\w+)}")
+
+
+class URLPattern:
+    """One route's path, ready to fill in"""
+
+    __slots__ = ("name", "path", "params", "_template", "_fields")
+
+    def __init__(self, name: str, path_format: str, convertors: Dict[str, Any]):
+        self.name = name
+        self.path = path_format
+        self.params = tuple(_PARAM.findall(path_format))
+        self._template = _PARAM.sub("{}", path_format)
+        self._fields = tuple((param, convertors[param]) for param in self.params)
+
+    def format(self, params: Dict[str, Any]) -> str:
+        """The URL for these arguments; raises NoMatchFound if a path parameter is missing or invalid"""
+        if not params and not self.params:
+            return self.path
+        path = self.path
+        if self._fields:
+            values = []
+            try:
+                for param, convertor in self._fields:
+                    values.append(convertor.to_string(params[param]))
+            except (KeyError, AssertionError):
+                raise NoMatchFound(self.name, params) from None
+            path = self._template.format(*values)
+        if len(params) > len(self.params):
+            query = urlencode([(key, value) for key, value in params.items()
+                               if key not in self.params and value is not None], doseq=True)
+            if query:
+                path = f"{path}?{query}"
+        return path
+
+
+class URLTable:
+    """Route name -> URLPattern, built from the app's routes on first use"""
+
+    def __init__(self, app, extra_paths: Optional[Dict[str, str]] = None):
+        self.app = app
+        self.extra_paths = extra_paths or {}
+        self._patterns: Optional[Dict[str, URLPattern]] = None
+
+    def build(self) -> int:
+        """Compile every route; call once all routes are registered. Returns how many names there are"""
+        patterns = {}
+        for route in self.app.routes:
+            # Mounts (static files) take a path rather than parameters, so url_for handles them itself
+            if isinstance(route, Route) and route.name not in patterns:
+                patterns[route.name] = URLPattern(route.name, route.path_format, route.param_convertors)
+        for name, path in self.extra_paths.items():
+            if name not in patterns:
+                _, path_format, convertors = compile_path(path)
+                patterns[name] = URLPattern(name, path_format, convertors)
+        self._patterns = patterns
+        return len(patterns)
+
+    def get(self, name: str) -> Optional[URLPattern]:
+        if self._patterns is None:
+            self.build()
+        return self._patterns.get(name)
@@ -0,0 +1,88 @@
+"""
+Startup cache warming.
+
+Modules register the work that fills their caches (compiling templates,
+loading reference data) with register_warmup(), and run_warmups() runs it
+once per process. Under the production server it runs in the master before
+workers are forked, so every worker starts with the caches filled and
+shares their memory with the master until it changes them.
+
+template_options() sets up the template environment for this: with
+TEMPLATE_MODE=production (the default under gunicorn.conf.py) templates are
+not checked against their files again once compiled, and their bytecode is
+kept in TEMPLATE_CACHE_DIR, so a restarted or newly started server loads it
+instead of compiling every template from source.
+"""
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_MODE = os.getenv("TEMPLATE_MODE", "development").lower()
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "/tmp/akc-template-cache")
+
+_warmups: List[Callable[[], object]] = []
+_done = False
+
+
+def register_warmup(func: Callable[[], object]) -> Callable[[], object]:
+    """Register a function to run at startup; usable as a decorator"""
+    _warmups.append(func)
+    return func
+
+
+def run_warmups() -> None:
+    """Run every registered warmup, once per process (a forked worker inherits the master's)"""
+    global _done
+    if _done:
+        return
+    _done = True
+    for func in _warmups:
+        start = time.perf_counter()
+        try:
+            result = func()
+        except Exception:
+            # A cache that didn't warm fills on first use instead
+            logger.exception("Warmup %s failed", func.__name__)
+            continue
+        logger.info("Warmup %s: %s in %.0f ms", func.__name__, result, (time.perf_counter() - start) * 1000)
+
+
+def warm_templates(templates) -> int:
+    """Compile every template into the environment's cache; returns how many compiled"""
+    env = templates.env
+    names = env.list_templates(extensions=["html"])
+    if env.cache is not None and env.cache.capacity < len(names):
+        # Room for all of them, so none is evicted and recompiled later
+        env.cache = type(env.cache)(len(names) * 2)
+    compiled = 0
+    for name in names:
+        try:
+            env.get_template(name)
+        except TemplateError as e:
+            # Leave it to fail on the page that uses it, as it would unwarmed
+            logger.warning("Template %s didn't compile: %s", name, e)
+            continue
+        compiled += 1
+    return compiled
+
+
+def template_options(mode: str = TEMPLATE_MODE, cache_dir: str = TEMPLATE_CACHE_DIR) -> Dict[str, Any]:
+    """Jinja2 environment options for the template mode; development keeps Jinja's defaults, so edits show up on reload"""
+    if mode != "production":
+        return {}
+    options: Dict[str, Any] = {"auto_reload": False}
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            # Templates still compile at startup, just from source every time
+            logger.warning("Template bytecode cache %s unavailable: %s", cache_dir, e)
+        else:
+            # Entries are keyed by template and checked against its source, so a deploy's edits are picked up
+            options["bytecode_cache"] = FileSystemBytecodeCache(cache_dir)
+    return options
@@ -0,0 +1,70 @@
+// AKC CRM upload progress
+//
+// Submits a multipart form in the background and shows its progress: first
+// the browser sending the file, then the server streaming it on to storage,
+// which is polled from /uploads/{upload_id}/progress. The form needs a hidden
+// upload_id input and a progress section with a label and a progress bar.
+
+function submitWithProgress(form, progress) {
+    const submitButton = form.querySelector('button[type="submit"]');
+    const uploadId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : String(Date.now()) + Math.random().toString(16).slice(2);
+    form.querySelector('input[name="upload_id"]').value = uploadId;
+
+    function setProgress(label, percent) {
+        percent = Math.min(100, Math.round(percent));
+        progress.label.textContent = label;
+        progress.bar.style.width = percent + '%';
+        progress.bar.setAttribute('aria-valuenow', percent);
+        progress.bar.textContent = percent + '%';
+    }
+
+    function fail(message) {
+        progress.container.style.display = 'none';
+        submitButton.disabled = false;
+        alert(message);
+    }
+
+    // The server streams the file on to storage after receiving it; poll its progress
+    function pollStorageProgress(xhr) {
+        if (xhr.readyState === XMLHttpRequest.DONE) {
+            return;
+        }
+        fetch('/uploads/' + uploadId + '/progress')
+            .then(function(response) { return response.ok ? response.json() : null; })
+            .then(function(status) {
+                if (status && status.status === 'uploading') {
+                    setProgress('Saving to storage', status.percent);
+                }
+            })
+            .catch(function() {})
+            .finally(function() { setTimeout(function() { pollStorageProgress(xhr); }, 500); });
+    }
+
+    submitButton.disabled = true;
+    progress.container.style.display = 'block';
+    setProgress('Uploading', 0);
+
+    const xhr = new XMLHttpRequest();
+    xhr.open('POST', form.getAttribute('action') || window.location.href);
+    xhr.upload.addEventListener('progress', function(event) {
+        if (event.lengthComputable) {
+            setProgress('Uploading', event.loaded * 100 / event.total);
+        }
+    });
+    xhr.upload.addEventListener('load', function() {
+        setProgress('Saving to storage', 0);
+        pollStorageProgress(xhr);
+    });
+    xhr.addEventListener('load', function() {
+        if (xhr.status < 400) {
+            setProgress('Done', 100);
+            window.location.href = xhr.responseURL || window.location.href;
+        } else {
+            fail('Upload failed. Please try again.');
+        }
+    });
+    xhr.addEventListener('error', function() {
+        fail('Upload failed. Please check your connection and try again.');
+    });
+    xhr.send(new FormData(form));
+}
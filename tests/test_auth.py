@@ -0,0 +1,205 @@
+"""
+Tests for cached access token verification
+"""
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from jwt.algorithms import ECAlgorithm
+
+from services.auth import AuthError, BearerAuth, SigningKeyCache, TokenVerifier
+
+SECRET = "test-jwt-secret-that-is-long-enough-for-hs256"
+
+
+class Clock:
+    """A clock the test moves by hand"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def hs256_token(expires_in=3600, **claims):
+    payload = {"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + expires_in, **claims}
+    return jwt.encode(payload, SECRET, algorithm="HS256")
+
+
+@pytest.fixture
+def ec_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def jwks(*keys):
+    """A JWKS document for (kid, private key) pairs"""
+    documents = []
+    for kid, key in keys:
+        jwk = json.loads(ECAlgorithm.to_jwk(key.public_key()))
+        documents.append({**jwk, "kid": kid, "alg": "ES256", "use": "sig"})
+    return {"keys": documents}
+
+
+class Fetcher:
+    """A JWKS fetch that counts its calls"""
+
+    def __init__(self, document):
+        self.document = document
+        self.calls = 0
+
+    def __call__(self, url):
+        self.calls += 1
+        if isinstance(self.document, Exception):
+            raise self.document
+        return self.document
+
+
+def test_verified_claims_cached_until_exp():
+    """Test that a token is decoded once and its claims are dropped at exp"""
+    clock = Clock(time.time())
+    verifier = TokenVerifier(secret=SECRET, clock=clock)
+    token = hs256_token(expires_in=60)
+    decodes = []
+    decode = verifier._decode
+    verifier._decode = lambda t: decodes.append(t) or decode(t)
+
+    claims = verifier.verify(token)
+    assert claims["sub"] == "user-1"
+    assert verifier.verify(token) == claims
+    assert verifier.cached(token) == claims
+    assert len(decodes) == 1
+
+    clock.now += 61
+    assert verifier.cached(token) is None
+    verifier.verify(token)
+    assert len(decodes) == 2
+
+
+def test_invalid_tokens_rejected_and_not_cached():
+    """Test that expired, forged and malformed tokens raise AuthError and are never cached"""
+    verifier = TokenVerifier(secret=SECRET)
+    expired = hs256_token(expires_in=-10)
+    forged = jwt.encode({"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 60},
+                        "another-secret-that-is-long-enough-for-hs256", algorithm="HS256")
+    no_exp = jwt.encode({"sub": "user-1", "aud": "authenticated"}, SECRET, algorithm="HS256")
+
+    for token in (expired, forged, no_exp, "not-a-token", hs256_token(aud="anon")):
+        with pytest.raises(AuthError):
+            verifier.verify(token)
+        assert verifier.cached(token) is None
+
+    # No secret configured means HS256 isn't accepted at all
+    with pytest.raises(AuthError):
+        TokenVerifier().verify(hs256_token())
+
+
+def test_claims_cache_is_bounded():
+    """Test that the least recently used claims are evicted past cache_size"""
+    verifier = TokenVerifier(secret=SECRET, cache_size=2)
+    first, second, third = (hs256_token(sub=f"user-{i}") for i in range(3))
+
+    verifier.verify(first)
+    verifier.verify(second)
+    verifier.verify(first)
+    verifier.verify(third)
+
+    assert verifier.cached(first) is not None
+    assert verifier.cached(second) is None
+    assert verifier.cached(third) is not None
+
+
+def test_asymmetric_tokens_use_signing_keys(ec_key):
+    """Test that ES256 tokens are verified against the key named by their kid"""
+    keys = SigningKeyCache("https://example.test/jwks.json", fetch=Fetcher(jwks(("key-1", ec_key))))
+    verifier = TokenVerifier(signing_keys=keys)
+    payload = {"sub": "user-2", "aud": "authenticated", "exp": int(time.time()) + 60}
+
+    token = jwt.encode(payload, ec_key, algorithm="ES256", headers={"kid": "key-1"})
+    assert verifier.verify(token)["sub"] == "user-2"
+
+    other_key = ec.generate_private_key(ec.SECP256R1())
+    with pytest.raises(AuthError):
+        verifier.verify(jwt.encode(payload, other_key, algorithm="ES256", headers={"kid": "key-1"}))
+
+
+def test_signing_keys_refresh_after_ttl(ec_key):
+    """Test that keys are fetched once, then again once the JWKS is older than ttl"""
+    clock = Clock()
+    fetch = Fetcher(jwks(("key-1", ec_key)))
+    keys = SigningKeyCache("https://example.test/jwks.json", fetch=fetch, ttl=3600,
+                           min_refresh_interval=60, clock=clock)
+
+    key = keys.get("key-1")
+    clock.now += 3599
+    assert keys.get("key-1") is key
+    assert fetch.calls == 1
+
+    # A rotated key shows up on the refresh after the ttl
+    rotated = ec.generate_private_key(ec.SECP256R1())
+    fetch.document = jwks(("key-2", rotated))
+    clock.now += 1
+    keys.get("key-2")
+    assert fetch.calls == 2
+    with pytest.raises(AuthError):
+        keys.get("key-1")
+
+
+def test_unknown_kid_refresh_is_rate_limited(ec_key):
+    """Test that unknown key ids refresh the JWKS at most once per min_refresh_interval"""
+    clock = Clock()
+    fetch = Fetcher(jwks(("key-1", ec_key)))
+    keys = SigningKeyCache("https://example.test/jwks.json", fetch=fetch, min_refresh_interval=60, clock=clock)
+    keys.get("key-1")
+
+    for kid in ("junk-1", "junk-2", "junk-3"):
+        with pytest.raises(AuthError):
+            keys.get(kid)
+    assert fetch.calls == 1
+
+    clock.now += 60
+    with pytest.raises(AuthError):
+        keys.get("junk-4")
+    assert fetch.calls == 2
+
+
+def test_failed_refresh_keeps_known_keys(ec_key):
+    """Test that a JWKS fetch failure keeps serving the keys already fetched"""
+    clock = Clock()
+    fetch = Fetcher(jwks(("key-1", ec_key)))
+    keys = SigningKeyCache("https://example.test/jwks.json", fetch=fetch, ttl=100,
+                           min_refresh_interval=10, clock=clock)
+    key = keys.get("key-1")
+
+    fetch.document = RuntimeError("Supabase is down")
+    clock.now += 100
+    assert keys.get("key-1") is key
+    assert fetch.calls == 2
+
+
+def test_bearer_auth_dependency():
+    """Test that the dependency rejects missing and invalid tokens and enforces the role"""
+    verifier = TokenVerifier(secret=SECRET)
+    app = FastAPI()
+
+    @app.get("/me")
+    async def me(claims: dict = Depends(BearerAuth(verifier))):
+        return {"sub": claims["sub"]}
+
+    @app.get("/admin")
+    async def admin(claims: dict = Depends(BearerAuth(verifier, role="admin"))):
+        return {"sub": claims["sub"]}
+
+    client = TestClient(app)
+    token = hs256_token(app_metadata={"role": "foreman"})
+
+    assert client.get("/me").status_code == 401
+    assert client.get("/me", headers={"Authorization": "Bearer junk"}).status_code == 401
+    assert client.get("/me", headers={"Authorization": f"Bearer {token}"}).json() == {"sub": "user-1"}
+    assert client.get("/admin", headers={"Authorization": f"Bearer {token}"}).status_code == 403
+    admin_token = hs256_token(app_metadata={"role": "admin"})
+    assert client.get("/admin", headers={"Authorization": f"Bearer {admin_token}"}).status_code == 200